@@ -1,22 +1,35 @@
 from flask import Flask, jsonify
 from flask_login import LoginManager
 from flask_cors import CORS
-from flask_bcrypt import Bcrypt
-from models import db, Doctor
+from models import db
 from routes.auth import auth_bp
 from routes.doctors import doctors_bp
 from routes.patients import patients_bp
+from migrations import upgrade
+from stats import rebuild_stats
+from principals import load_principal
+from passwords import PasswordHasherBusy
+from groupcommit import GroupCommitUnavailable
+from database import init_engines
+from metrics import init_metrics
+from audit import init_audit
+from config import configs
 import os
 
-def create_app():
+def create_app(config_name=None):
     app = Flask(__name__)
     
-    # Load configuration
-    app.config.from_object('config.DevelopmentConfig')
+    # Load configuration: by name, else from APP_CONFIG, else development
+    config_name = config_name or os.environ.get('APP_CONFIG') or 'development'
+    if config_name not in configs:
+        raise ValueError(f"Unknown config '{config_name}', expected one of: {', '.join(configs)}")
+    app.config.from_object(configs[config_name])
     
     # Initialize extensions
     db.init_app(app)
-    bcrypt = Bcrypt(app)
+    init_engines(app, db)
+    init_metrics(app, db)
+    init_audit(app)
     CORS(app)
     
     # Flask-Login setup
@@ -26,7 +39,7 @@ def create_app():
     
     @login_manager.user_loader
     def load_user(user_id):
-        return Doctor.query.get(int(user_id))
+        return load_principal(int(user_id))
     
     @login_manager.unauthorized_handler
     def unauthorized():
@@ -46,9 +59,33 @@ def create_app():
     def internal_error(error):
         return jsonify({'message': 'Internal server error'}), 500
     
-    # Create tables
-    with app.app_context():
-        db.create_all()
+    @app.errorhandler(PasswordHasherBusy)
+    def hasher_busy(error):
+        return jsonify({'message': 'Too many logins in progress, try again shortly'}), 503, {'Retry-After': '1'}
+    
+    @app.errorhandler(GroupCommitUnavailable)
+    def writer_unavailable(error):
+        return jsonify({'message': 'Writes are not being committed right now, try again shortly'}), 503, {'Retry-After': '1'}
+    
+    # Create tables in development and tests; deployments run `flask migrate` instead
+    if app.config['CREATE_SCHEMA']:
+        with app.app_context():
+            db.create_all()
+            # create_all skips tables that already exist; migrations bring older databases up to date
+            upgrade(db.engine)
+    
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Apply pending schema migrations."""
+        applied = upgrade(db.engine)
+        print(f"Applied migrations: {applied}" if applied else "Database is up to date")
+    
+    @app.cli.command('rebuild-stats')
+    def rebuild_stats_command():
+        """Recount the patient census counters from the patients table."""
+        with db.engine.begin() as connection:
+            total = rebuild_stats(connection)
+        print(f"Rebuilt patient statistics for {total} patients")
     
     # Root endpoint
     @app.route('/')
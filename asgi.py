@@ -0,0 +1,383 @@
+"""ASGI entry point: the hot API paths as coroutines on an async SQLAlchemy session.
+
+    pip install -r requirements.txt    # includes uvicorn and aiosqlite
+    MULTI_PROCESS=1 uvicorn asgi:app --workers 2
+
+Login, /me and the doctor and patient reads run as coroutines on aiosqlite,
+so a request waiting on SQLite or bcrypt does not pin a thread, and one
+worker holds thousands of open connections. Every other route, including
+all writes, goes to the regular Flask app on a small thread pool: SQLite
+takes one writer at a time anyway, and the write paths keep a single
+implementation. Both sides run inside a Flask request context built from
+the same environ, so URLs, JSON bodies, validators and the session cookie
+are identical to the sync app.
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from flask import jsonify, request, session as flask_session
+from sqlalchemy import func, select, true
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import joinedload
+from app import create_app
+from models import db, Doctor, Patient
+from database import apply_sqlite_pragmas
+from metrics import instrument_engine
+from pagination import CursorError, get_page_limit, page_query, page_response, split_page
+from conditional import add_validators, make_etag, make_versioned_etag, not_modified
+from cache import cached_response, get_response_cache
+from fieldsets import FieldsError, load_fields, requested_fields
+from serializers import get_layout
+from audit import audit
+from principals import get_principal_cache, invalidate_principal
+from passwords import PasswordHasherBusy, get_password_hasher
+from tokens import issue_token
+
+def build_environ(scope):
+    """WSGI environ for an ASGI http scope."""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name
+        value = value.decode('latin-1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+def response_start(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    }
+
+async def load_principal_async(session, doctor_id):
+    """load_principal() for coroutines; shares the per-process principal cache."""
+    cache = get_principal_cache()
+    doctor = cache.get(doctor_id)
+    if doctor is None:
+        doctor = await session.get(Doctor, doctor_id)
+        if doctor is None:
+            return None
+        session.expunge(doctor)
+        cache.set(doctor_id, doctor)
+    return doctor
+
+def login_required(f):
+    """Async counterpart of flask_login.login_required, reading the same session cookie."""
+    @wraps(f)
+    async def decorated(session, *args, **kwargs):
+        user_id = flask_session.get('_user_id')
+        current_user = await load_principal_async(session, int(user_id)) if user_id else None
+        if current_user is None:
+            return jsonify({'message': 'Unauthorized access'}), 401
+        return await f(session, current_user, *args, **kwargs)
+    return decorated
+
+async def login(session):
+    data = request.get_json()
+    doctor = (await session.execute(select(Doctor).filter_by(email=data['email']))).scalar_one_or_none()
+    hasher = get_password_hasher()
+
+    if not doctor or not await hasher.verify_async(data['password'], doctor.password_hash):
+        return jsonify({'message': 'Invalid email or password'}), 401
+
+    if not doctor.is_active:
+        return jsonify({'message': 'Account is deactivated'}), 401
+
+    # Upgrade hashes made with an old cost factor while we have the plain password
+    # (skipped when the hashing pool is saturated; the next login tries again)
+    if hasher.needs_rehash(doctor.password_hash):
+        try:
+            doctor.password_hash = await hasher.hash_async(data['password'])
+        except PasswordHasherBusy:
+            pass
+        else:
+            await session.commit()
+            invalidate_principal(doctor.id)
+
+    token = issue_token(doctor)
+
+    # Same session keys as flask_login.login_user, so the cookie works on both sides
+    flask_session['_user_id'] = str(doctor.id)
+    flask_session['_fresh'] = True
+
+    return jsonify({
+        'message': 'Login successful',
+        'token': token,
+        'doctor': doctor.to_dict()
+    }), 200
+
+@login_required
+async def get_current_user(session, current_user):
+    return jsonify(current_user.to_dict()), 200
+
+@login_required
+async def get_doctors(session, current_user):
+    cache = get_response_cache('doctors')
+    key = cache.key('list?' + request.query_string.decode())
+    entry = cache.get(key)
+    if entry:
+        return cached_response(entry, request)
+
+    try:
+        fields = requested_fields(Doctor.SERIALIZED_FIELDS)
+    except FieldsError as e:
+        return jsonify({'message': str(e)}), 400
+
+    active = Doctor.is_active == True
+    last_modified, count = (await session.execute(
+        select(func.max(Doctor.updated_at), func.count(Doctor.id)).where(active))).one()
+    etag = make_etag('doctors', last_modified, count, sorted(request.args.items()))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    layout = get_layout(Doctor, fields)
+    try:
+        limit = get_page_limit()
+        statement = page_query(layout.statement().where(active), (Doctor.id,), limit, request.args.get('cursor'))
+    except CursorError as e:
+        return jsonify({'message': str(e)}), 400
+    doctors, next_cursor = split_page((await session.execute(statement)).all(), (Doctor.id,), limit)
+
+    response = add_validators(page_response(layout.encode(doctors), next_cursor), etag)
+    cache.set(key, response)
+    return response, 200
+
+@login_required
+async def get_doctor(session, current_user, doctor_id):
+    cache = get_response_cache('doctors')
+    key = cache.key(f'doctor/{doctor_id}?' + request.query_string.decode())
+    entry = cache.get(key)
+    if entry:
+        return cached_response(entry, request)
+
+    try:
+        fields = requested_fields(Doctor.SERIALIZED_FIELDS)
+    except FieldsError as e:
+        return jsonify({'message': str(e)}), 400
+
+    options = [load_fields(Doctor, fields, 'updated_at')] if fields is not None else []
+    doctor = await session.get(Doctor, doctor_id, options=options)
+    if doctor is None:
+        return jsonify({'message': 'Resource not found'}), 404
+
+    etag = make_etag('doctor', doctor.id, doctor.updated_at, fields)
+    cached = not_modified(etag, doctor.updated_at)
+    if cached:
+        return cached
+
+    response = add_validators(jsonify(doctor.to_dict(fields)), etag, doctor.updated_at)
+    cache.set(key, response)
+    return response, 200
+
+@login_required
+async def get_patients(session, current_user):
+    try:
+        fields = requested_fields(Patient.SERIALIZED_FIELDS)
+    except FieldsError as e:
+        return jsonify({'message': str(e)}), 400
+
+    # Same scoping and ETag inputs as routes.patients.get_patients
+    if getattr(current_user, 'is_admin', False):
+        scope = true()
+        names_version = (await session.execute(select(func.max(Doctor.updated_at)))).scalar()
+    else:
+        scope = Patient.doctor_id == current_user.id
+        names_version = current_user.updated_at
+    last_modified, count = (await session.execute(
+        select(func.max(Patient.updated_at), func.count(Patient.id)).where(scope))).one()
+    etag = make_etag('patients', last_modified, count, names_version, sorted(request.args.items()))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    # Always the row-tuple path: no ORM objects to hydrate, nothing that could lazy-load
+    columns = (Patient.last_name, Patient.id)
+    layout = get_layout(Patient, fields)
+    try:
+        limit = get_page_limit()
+        statement = page_query(layout.statement().where(scope), columns, limit, request.args.get('cursor'))
+    except CursorError as e:
+        return jsonify({'message': str(e)}), 400
+    patients, next_cursor = split_page((await session.execute(statement)).all(), columns, limit)
+    audit('list', [patient.id for patient in patients])
+
+    response = page_response(layout.encode(patients), next_cursor)
+    return add_validators(response, etag), 200
+
+@login_required
+async def get_patient(session, current_user, patient_id):
+    try:
+        fields = requested_fields(Patient.SERIALIZED_FIELDS)
+    except FieldsError as e:
+        return jsonify({'message': str(e)}), 400
+
+    options = [joinedload(Patient.doctor)]
+    if fields is not None:
+        options.append(load_fields(Patient, fields, 'doctor_id', 'updated_at'))
+    patient = await session.get(Patient, patient_id, options=options)
+    if patient is None:
+        return jsonify({'message': 'Resource not found'}), 404
+    audit('read', patient.id)
+
+    # Check if current doctor owns this patient
+    if patient.doctor_id != current_user.id and not getattr(current_user, 'is_admin', False):
+        return jsonify({'message': 'Access denied'}), 403
+
+    etag = make_versioned_etag(patient.updated_at, 'patient', patient.id, patient.updated_at, patient.doctor_id,
+                               patient.doctor.updated_at if patient.doctor else None, fields)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    return add_validators(jsonify(patient.to_dict(fields=fields)), etag), 200
+
+# Flask endpoint -> coroutine serving it; anything else goes to the sync view
+ASYNC_VIEWS = {
+    'auth.login': login,
+    'auth.get_current_user': get_current_user,
+    'doctors.get_doctors': get_doctors,
+    'doctors.get_doctor': get_doctor,
+    'patients.get_patients': get_patients,
+    'patients.get_patient': get_patient,
+}
+
+class AsyncApp:
+    """ASGI application wrapping a Flask app created by create_app()."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        config = flask_app.config
+        with flask_app.app_context():
+            url = db.engine.url
+
+        self.engine = create_async_engine(url.set(drivername='sqlite+aiosqlite'), **config['ASGI_ENGINE_OPTIONS'])
+        apply_sqlite_pragmas(self.engine.sync_engine, config['SQLITE_PRAGMAS'])
+        if 'metrics' in flask_app.extensions:
+            instrument_engine(self.engine.sync_engine)
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.executor = ThreadPoolExecutor(config['ASGI_SYNC_THREADS'], thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        environ = build_environ(scope)
+        try:
+            endpoint, _ = self.flask_app.url_map.bind_to_environ(environ).match()
+        except Exception:  # 404, 405 and slash redirects are the sync app's business
+            endpoint = None
+        view = ASYNC_VIEWS.get(endpoint) if scope['method'] != 'HEAD' else None
+
+        # The body is read up front, so the length is known even for chunked uploads
+        body = await read_body(receive)
+        environ['wsgi.input'] = io.BytesIO(body)
+        environ['CONTENT_LENGTH'] = str(len(body))
+        if view is None:
+            return await self.call_sync(environ, send)
+
+        response = await self.dispatch(view, environ)
+        await send(response_start(response.status_code, response.headers.items()))
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+
+    async def dispatch(self, view, environ):
+        """Flask's full_dispatch_request, awaiting ``view`` instead of calling a sync one."""
+        app = self.flask_app
+        with app.request_context(environ):
+            try:
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        async with self.sessions() as session:
+                            rv = await view(session, **request.view_args)
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                return app.finalize_request(rv)
+            except Exception as e:
+                return app.handle_exception(e)
+
+    async def call_sync(self, environ, send):
+        """Run the WSGI app on the thread pool, streaming its output back chunk by chunk."""
+        loop = asyncio.get_running_loop()
+        started = {}
+
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        def run():
+            result = self.flask_app(environ, start_response)
+            try:
+                sent_start = False
+                for chunk in result:
+                    if not sent_start:
+                        send_from_thread(response_start(started['status'], started['headers']))
+                        sent_start = True
+                    if chunk:
+                        send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                if not sent_start:
+                    send_from_thread(response_start(started['status'], started['headers']))
+                send_from_thread({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+
+        await loop.run_in_executor(self.executor, run)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+def create_asgi_app(flask_app=None):
+    return AsyncApp(flask_app or create_app())
+
+def __getattr__(name):
+    # ``uvicorn asgi:app`` builds the app on first use rather than whenever the module is imported
+    if name == 'app':
+        globals()['app'] = create_asgi_app()
+        return globals()['app']
+    raise AttributeError(name)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi:app', port=5000)
@@ -0,0 +1,255 @@
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+from functools import partial
+from flask import current_app, g, request
+from flask_login import current_user
+from sqlalchemy import event, inspect, text
+from models import db, AuditEvent
+from database import dedicated_engine
+
+# The trail can only grow: edits and deletes through SQL are refused
+AUDIT_DDL = (
+    """CREATE TRIGGER IF NOT EXISTS audit_log_no_update BEFORE UPDATE ON audit_log BEGIN
+        SELECT RAISE(ABORT, 'audit_log is append-only');
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS audit_log_no_delete BEFORE DELETE ON audit_log BEGIN
+        SELECT RAISE(ABORT, 'audit_log is append-only');
+    END""",
+)
+
+OVERFLOW_POLICIES = ('block', 'drop')
+
+_STOP = object()
+_create_lock = threading.Lock()
+
+def create_audit_log(connection):
+    """Create the audit table and its append-only triggers if missing."""
+    AuditEvent.__table__.create(connection, checkfirst=True)
+    if connection.dialect.name == 'sqlite':
+        for statement in AUDIT_DDL:
+            connection.execute(text(statement))
+
+@event.listens_for(AuditEvent.__table__, 'after_create')
+def _create_audit_triggers(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        for statement in AUDIT_DDL:
+            connection.execute(text(statement))
+
+class AuditLog:
+    """Buffers patient access events in memory and appends them to audit_log in batches.
+
+    record() is one put on a bounded queue, so requests never wait on the
+    database. When the queue is full, ``overflow`` decides: 'block' waits up
+    to ``block_timeout`` for room and then drops, 'drop' drops at once.
+    Either way the drop is counted. A background thread writes a batch once
+    ``batch_size`` events are waiting, ``flush_interval`` seconds after the
+    first one (None: only on demand), on flush() and on shutdown().
+
+    A batch whose write fails is retried once, together with the next write
+    (or straight away on shutdown). If that fails too its events are lost:
+    they are logged and counted as failed, never written.
+    """
+
+    def __init__(self, app, queue_size=10000, batch_size=500, flush_interval=1.0,
+                 overflow='block', block_timeout=0.1):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'overflow must be one of: {", ".join(OVERFLOW_POLICIES)}')
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        with app.app_context():
+            self.engine = dedicated_engine(app, db.engine)
+            self._own_engine = self.engine is not db.engine
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._queue = queue.Queue(queue_size)
+        self._thread = threading.Thread(target=self._run, name='audit-log', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def record(self, actor_id, action, patient_ids, status, remote_addr):
+        """Queue one event; returns False if it was dropped."""
+        item = (datetime.utcnow(), actor_id, action, patient_ids, status, remote_addr)
+        try:
+            if self._stopped:
+                raise queue.Full
+            if self.overflow == 'block':
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        with self._lock:
+            self.queued += 1
+        return True
+
+    def flush(self, timeout=None):
+        """Block until everything recorded so far has been sent to the database; False if ``timeout`` ran out."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def shutdown(self):
+        """Write out everything queued and stop the thread; later calls do nothing."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        atexit.unregister(self.shutdown)
+        if self._own_engine:
+            self.engine.dispose()
+
+    def _run(self):
+        pending = []
+        retry = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, tuple):
+                pending.append(item)
+                if deadline is None and self.flush_interval is not None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(pending) < self.batch_size:
+                    continue
+
+            if pending or retry:
+                if self._write(retry + pending):
+                    retry = []
+                else:
+                    # The retried events have now failed twice; this batch gets one more go
+                    self._discard(retry)
+                    retry = pending
+                    if item is _STOP and not self._write(retry):
+                        self._discard(retry)
+                pending = []
+            deadline = None
+            if retry and self.flush_interval is not None:
+                deadline = time.monotonic() + self.flush_interval
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
+
+    def _write(self, events):
+        # A list read becomes one row per patient served, so every access is queryable by patient
+        rows = [{'occurred_at': occurred_at, 'actor_id': actor_id, 'action': action,
+                 'patient_id': patient_id, 'status': status, 'remote_addr': remote_addr}
+                for occurred_at, actor_id, action, patient_ids, status, remote_addr in events
+                for patient_id in (patient_ids or (None,))]
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(AuditEvent.__table__.insert(), rows)
+        except Exception:
+            self.app.logger.exception('Could not write %d audit events', len(events))
+            return False
+        with self._lock:
+            self.written += len(events)
+        return True
+
+    def _discard(self, events):
+        if not events:
+            return
+        self.app.logger.error('Discarding %d audit events after a failed retry', len(events))
+        with self._lock:
+            self.failed += len(events)
+
+    def render(self):
+        """Counters in Prometheus text format, appended to /metrics."""
+        with self._lock:
+            counters = {'queued': self.queued, 'written': self.written,
+                        'dropped': self.dropped, 'failed': self.failed}
+        lines = []
+        for name, value in counters.items():
+            lines += [f'# HELP audit_events_{name}_total Audit events {name}.',
+                      f'# TYPE audit_events_{name}_total counter',
+                      f'audit_events_{name}_total {value}']
+        lines += ['# HELP audit_queue_depth Audit events waiting to be written.',
+                  '# TYPE audit_queue_depth gauge',
+                  f'audit_queue_depth {self._queue.qsize()}']
+        return '\n'.join(lines) + '\n'
+
+def get_audit_log():
+    audit_log = current_app.extensions.get('audit_log')
+    if audit_log is None:
+        # Locked so concurrent first requests cannot start two writers, one of which shutdown would miss
+        with _create_lock:
+            audit_log = current_app.extensions.get('audit_log')
+            if audit_log is None:
+                config = current_app.config
+                audit_log = current_app.extensions['audit_log'] = AuditLog(
+                    current_app._get_current_object(), config['AUDIT_QUEUE_SIZE'], config['AUDIT_BATCH_SIZE'],
+                    config['AUDIT_FLUSH_INTERVAL'], config['AUDIT_OVERFLOW'], config['AUDIT_BLOCK_TIMEOUT'])
+    return audit_log
+
+def audit(action, patient_ids):
+    """Mark this request as ``action`` on ``patient_ids`` (an id or a list of them).
+
+    The event is queued after the response is built, so it carries the final status.
+    """
+    if isinstance(patient_ids, int):
+        patient_ids = (patient_ids,)
+    g._audit = (action, tuple(patient_ids))
+
+def audit_stream(action, rows, chunk_size=500):
+    """Wrap the serialized patients in ``rows`` so ``action`` events are queued for them as they go out.
+
+    For streamed responses, which after_request sees before a single row is
+    sent. One event per ``chunk_size`` patients keeps memory flat; a stream
+    cut short records the patients sent up to that point.
+    """
+    if not current_app.config['AUDIT_ENABLED']:
+        return rows
+    # Taken now: the body is generated after the view has returned
+    record = partial(get_audit_log().record, _actor_id(), action)
+    remote_addr = request.remote_addr
+
+    def generate():
+        patient_ids = []
+        try:
+            for row in rows:
+                patient_ids.append(row['id'])
+                if len(patient_ids) >= chunk_size:
+                    record(tuple(patient_ids), 200, remote_addr)
+                    patient_ids = []
+                yield row
+        finally:
+            if patient_ids:
+                record(tuple(patient_ids), 200, remote_addr)
+    return generate()
+
+def _actor_id():
+    user = current_user._get_current_object()
+    # Read off the identity key: a commit in the view has expired the doctor, and .id would reload it
+    state = inspect(user, raiseerr=False)
+    if state is not None and state.identity:
+        return state.identity[0]
+    return getattr(user, 'id', None)
+
+def _record_audit(response):
+    pending = g.pop('_audit', None)
+    if pending is not None:
+        action, patient_ids = pending
+        actor_id = _actor_id()
+        get_audit_log().record(actor_id, action, patient_ids, response.status_code, request.remote_addr)
+    return response
+
+def init_audit(app):
+    """Queue the events marked with audit() as requests finish."""
+    if app.config['AUDIT_ENABLED']:
+        app.after_request(_record_audit)
@@ -0,0 +1,36 @@
+from flask import current_app
+
+class BatchError(ValueError):
+    pass
+
+def parse_ids(values):
+    """Validate requested ids (ints or numeric strings); duplicates are dropped, order is kept."""
+    if not isinstance(values, list) or not values:
+        raise BatchError('ids must be a non-empty list of integers')
+
+    ids = []
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise BatchError('ids must be a non-empty list of integers')
+        try:
+            ids.append(int(value))
+        except ValueError:
+            raise BatchError(f'Invalid id: {value}')
+    ids = list(dict.fromkeys(ids))
+
+    limit = current_app.config['BATCH_SIZE_MAX']
+    if len(ids) > limit:
+        raise BatchError(f'At most {limit} ids per request')
+    return ids
+
+def batch_results(ids, found, name, forbidden=()):
+    """One entry per requested id, in request order, with the status a single GET would give."""
+    results = []
+    for ident in ids:
+        if ident in found:
+            results.append({'id': ident, 'status': 200, name: found[ident]})
+        elif ident in forbidden:
+            results.append({'id': ident, 'status': 403, 'message': 'Access denied'})
+        else:
+            results.append({'id': ident, 'status': 404, 'message': 'Resource not found'})
+    return results
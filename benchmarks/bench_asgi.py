@@ -0,0 +1,170 @@
+"""Sync (threaded WSGI) vs ASGI serving of the same read traffic at high connection counts.
+
+Each server runs in its own process over the same seeded database. An
+asyncio client opens --connections concurrent connections, all logged in
+as one doctor, alternating patient list and patient detail requests.
+Reports throughput, latency, errors and the server's RSS and thread count.
+
+    pip install uvicorn aiosqlite
+    python benchmarks/bench_asgi.py --connections 2000 --seconds 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import PASSWORD, doctor_email, seed_database
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def serve(mode, port):
+    from app import create_app
+
+    app = create_app()
+    app.config['DEBUG'] = False
+    if mode == 'sync':
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+    else:
+        import uvicorn
+        from asgi import create_asgi_app
+        uvicorn.run(create_asgi_app(app), host='127.0.0.1', port=port, log_level='error',
+                    backlog=4096, timeout_keep_alive=60)
+
+def process_status(pid):
+    status = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            status[name] = value.strip()
+    return {'rss_mb': round(int(status['VmRSS'].split()[0]) / 1024, 1), 'threads': int(status['Threads'])}
+
+async def http_request(port, method, path, cookie=None, body=None, connection=None):
+    """One HTTP/1.1 request; reuses ``connection`` if the server kept it open."""
+    if connection is None:
+        connection = await asyncio.open_connection('127.0.0.1', port)
+    reader, writer = connection
+    payload = json.dumps(body).encode() if body is not None else b''
+    head = f'{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: {len(payload)}\r\n'
+    if body is not None:
+        head += 'Content-Type: application/json\r\n'
+    if cookie:
+        head += f'Cookie: {cookie}\r\n'
+    writer.write(head.encode() + b'\r\n' + payload)
+    await writer.drain()
+
+    status_line = await reader.readline()
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    data = await reader.readexactly(int(headers.get('content-length', 0)))
+
+    # The werkzeug dev server speaks HTTP/1.0 and closes after every response
+    if status_line.startswith(b'HTTP/1.0') or headers.get('connection', '').lower() == 'close':
+        writer.close()
+        connection = None
+    return int(status_line.split()[1]), headers, data, connection
+
+async def load(port, args):
+    status, headers, data, _ = await http_request(
+        port, 'POST', '/api/auth/login', body={'email': doctor_email(1), 'password': PASSWORD})
+    assert status == 200, data
+    cookie = headers['set-cookie'].split(';')[0]
+    patient_ids = [patient['id'] for patient in json.loads((await http_request(
+        port, 'GET', '/api/patients/?limit=100', cookie))[2])]
+
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + args.seconds
+
+    async def client(number):
+        nonlocal errors
+        connection = None
+        paths = ['/api/patients/?limit=20', f'/api/patients/{patient_ids[number % len(patient_ids)]}']
+        request_number = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status, _, _, connection = await http_request(
+                    port, 'GET', paths[request_number % 2], cookie, connection=connection)
+            except (OSError, asyncio.IncompleteReadError):
+                errors += 1
+                connection = None
+                await asyncio.sleep(0.05)
+                continue
+            request_number += 1
+            if status != 200:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(client(number) for number in range(args.connections)))
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / args.seconds, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2) if latencies else None,
+    }
+
+def run(mode, args):
+    port = free_port()
+    server = multiprocessing.Process(target=serve, args=(mode, port), daemon=True)
+    server.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    async def measure():
+        task = asyncio.create_task(load(port, args))
+        await asyncio.sleep(args.seconds / 2)
+        status = process_status(server.pid)
+        return {**await task, **status}
+
+    try:
+        return asyncio.run(measure())
+    finally:
+        server.terminate()
+        server.join()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--doctors', type=int, default=10)
+    parser.add_argument('--patients', type=int, default=10000)
+    args = parser.parse_args()
+
+    import resource
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+    from app import create_app
+    seed_database(create_app(), args.doctors, args.patients)
+
+    report = {'connections': args.connections, 'sync': run('sync', args), 'asgi': run('asgi', args)}
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
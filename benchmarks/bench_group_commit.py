@@ -0,0 +1,85 @@
+"""Writes per second with and without group commit under concurrent writers.
+
+Runs the 'ingest' mix of bench_load (patient creates and updates only) twice
+over the same seeded database: once committing per request, once through
+the group-commit writer. Reports throughput, latency and, for group commit,
+how many requests shared each COMMIT.
+
+Group commit pays off in proportion to what a durable COMMIT costs. On
+storage with a volatile write cache, fsync is nearly free; --fsync-ms then
+adds that much blocking time to every COMMIT to model a real disk.
+
+    python benchmarks/bench_group_commit.py --threads 32 --seconds 10
+    python benchmarks/bench_group_commit.py --config production --window 0.005 --fsync-ms 2
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import seed_database
+from bench_load import run
+
+def measure(args, group_commit):
+    from app import create_app
+    from models import db
+
+    app = create_app(args.config)
+    app.config.update({'DEBUG': False, 'SLOW_REQUEST_THRESHOLD': None,
+                       'GROUP_COMMIT_ENABLED': group_commit, 'GROUP_COMMIT_WINDOW': args.window,
+                       'GROUP_COMMIT_MAX_BATCH': args.max_batch})
+    report = run(app, args)
+    result = {
+        'writes_per_sec': report['total']['throughput_rps'],
+        'errors': report['total']['errors'],
+        **{f'{operation}_{key}': values[key] for operation, values in report['operations'].items()
+           for key in ('p50_ms', 'p99_ms')},
+    }
+
+    writer = app.extensions.pop('group_commit', None)
+    if writer is not None:
+        writer.shutdown()
+        result['commits'] = writer.batches
+        result['writes_per_commit'] = round(writer.jobs / max(writer.batches, 1), 1)
+    with app.app_context():
+        db.engine.dispose()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', default='development', help='app config (its SQLite PRAGMAs decide the fsync cost)')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--doctors', type=int, default=32)
+    parser.add_argument('--patients', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--window', type=float, default=0.002, help='group-commit window in seconds')
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--fsync-ms', type=float, default=0, help='extra time every COMMIT blocks for')
+    args = parser.parse_args()
+    args.mix = 'ingest'
+
+    if args.fsync_ms:
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        event.listen(Engine, 'commit', lambda conn: time.sleep(args.fsync_ms / 1000))
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['BCRYPT_LOG_ROUNDS'] = '4'
+    from app import create_app
+    seed_database(create_app('development'), args.doctors, args.patients, args.seed)
+
+    report = {
+        'settings': {'config': args.config, 'threads': args.threads, 'seconds': args.seconds,
+                     'window': args.window, 'max_batch': args.max_batch, 'fsync_ms': args.fsync_ms},
+        'per_request_commit': measure(args, False),
+        'group_commit': measure(args, True),
+    }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
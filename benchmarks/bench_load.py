@@ -0,0 +1,241 @@
+"""Throughput, latency percentiles and queries per request under a mix of API calls.
+
+Drives the real create_app() from many threads, each with its own client
+logged in as a different seeded doctor. The report is JSON so runs can be
+stored and compared; with --baseline the run fails (exit 1) when an
+operation got slower, lost throughput or started issuing more SQL.
+
+    python benchmarks/seed.py --db /tmp/bench.db --doctors 1000 --patients 1000000
+    python benchmarks/bench_load.py --db /tmp/bench.db --threads 16 --seconds 30 --output base.json
+    python benchmarks/bench_load.py --db /tmp/bench.db --threads 16 --seconds 30 --baseline base.json
+
+Without --db a small population is seeded into a temporary file first.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from seed import PASSWORD, doctor_email, seed_database
+
+# Relative weights of each operation
+MIXES = {
+    'read': {'list': 60, 'get': 35, 'login': 5},
+    'write': {'create': 40, 'update': 40, 'delete': 15, 'get': 5},
+    'ingest': {'create': 50, 'update': 50},
+    'mixed': {'list': 35, 'get': 30, 'create': 12, 'update': 12, 'delete': 6, 'login': 5},
+}
+
+def percentile(samples, pct):
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+class QueryCounter:
+    """Counts SQL statements per thread; every request runs on its caller's thread here."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def attach(self, engine):
+        from sqlalchemy import event
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def take(self):
+        count = getattr(self._local, 'count', 0)
+        self._local.count = 0
+        return count
+
+class Worker:
+    """One simulated clerk: a logged-in client plus the patient ids it may touch."""
+
+    def __init__(self, app, number, seed):
+        from models import db, Doctor, Patient
+
+        self.client = app.test_client()
+        self.email = doctor_email(number)
+        self.rng = random.Random(seed * 100003 + number)
+        self.cursor = None
+        self.created = []
+        with app.app_context():
+            doctor_id = db.session.query(Doctor.id).filter_by(email=self.email).scalar()
+            self.patient_ids = [patient_id for patient_id, in db.session.query(Patient.id)
+                                .filter_by(doctor_id=doctor_id).limit(1000)]
+        response = self.login()
+        if response.status_code != 200:
+            raise RuntimeError(f'{self.email} could not log in: {response.status_code}')
+
+    def login(self):
+        return self.client.post('/api/auth/login', json={'email': self.email, 'password': PASSWORD})
+
+    def list(self):
+        # Walk the list page by page, starting over at the end
+        url = '/api/patients/?limit=50'
+        if self.cursor:
+            url += '&cursor=' + self.cursor
+        response = self.client.get(url)
+        self.cursor = response.headers.get('X-Next-Cursor')
+        return response
+
+    def get(self):
+        ids = self.patient_ids or self.created or [0]
+        return self.client.get(f'/api/patients/{self.rng.choice(ids)}')
+
+    def create(self):
+        response = self.client.post('/api/patients/', json={
+            'first_name': 'Load',
+            'last_name': f'Test{self.rng.randrange(1000)}',
+            'date_of_birth': '1985-06-15',
+            'gender': 'Female',
+            'phone': '0700000000',
+            'blood_type': 'A+',
+        })
+        if response.status_code == 201:
+            self.created.append(response.get_json()['patient']['id'])
+        return response
+
+    def update(self):
+        ids = self.patient_ids or self.created or [0]
+        return self.client.put(f'/api/patients/{self.rng.choice(ids)}',
+                               json={'phone': f'07{self.rng.randrange(10 ** 8):08d}'})
+
+    def delete(self):
+        # Only patients this run created are deleted, so the seeded data stays reusable
+        if not self.created:
+            return None
+        return self.client.delete(f'/api/patients/{self.created.pop()}')
+
+def run(app, args):
+    from models import db
+
+    counter = QueryCounter()
+    with app.app_context():
+        counter.attach(db.engine)
+    read_engine = app.extensions.get('read_engine')
+    if read_engine is not None:
+        counter.attach(read_engine)
+
+    workers = [Worker(app, number % args.doctors + 1, args.seed) for number in range(args.threads)]
+    operations, weights = zip(*MIXES[args.mix].items())
+    samples = []
+    deadline = time.perf_counter() + args.seconds
+
+    def loop(worker):
+        records = []
+        while time.perf_counter() < deadline:
+            operation = worker.rng.choices(operations, weights)[0]
+            counter.take()
+            start = time.perf_counter()
+            response = getattr(worker, operation)()
+            elapsed = time.perf_counter() - start
+            if response is None:
+                continue
+            records.append((operation, elapsed, counter.take(), response.status_code))
+        samples.extend(records)
+
+    threads = [threading.Thread(target=loop, args=(worker,)) for worker in workers]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    report = {}
+    for operation in operations:
+        rows = [sample for sample in samples if sample[0] == operation]
+        if not rows:
+            continue
+        latencies = sorted(elapsed for _, elapsed, _, _ in rows)
+        report[operation] = {
+            'count': len(rows),
+            'errors': sum(1 for _, _, _, status in rows if status >= 400),
+            'throughput_rps': round(len(rows) / wall, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'queries_per_request': round(sum(queries for _, _, queries, _ in rows) / len(rows), 2),
+        }
+    total = {
+        'count': len(samples),
+        'errors': sum(1 for _, _, _, status in samples if status >= 400),
+        'throughput_rps': round(len(samples) / wall, 1),
+    }
+    return {'operations': report, 'total': total}
+
+def compare(report, baseline, tolerance):
+    """List regressions of ``report`` against ``baseline`` beyond a relative ``tolerance``."""
+    regressions = []
+    for operation, current in report['operations'].items():
+        before = baseline['operations'].get(operation)
+        if before is None:
+            continue
+        if current['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{operation}: p95 {before['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{operation}: throughput {before['throughput_rps']} -> {current['throughput_rps']} req/s")
+        # Query counts are deterministic, so any real increase is a regression
+        if current['queries_per_request'] > before['queries_per_request'] + 0.5:
+            regressions.append(f"{operation}: queries/request {before['queries_per_request']} -> "
+                               f"{current['queries_per_request']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', help='SQLite file made by seed.py (seeded here if missing)')
+    parser.add_argument('--doctors', type=int, default=100, help='population to seed, and doctors to log in as')
+    parser.add_argument('--patients', type=int, default=20000, help='population to seed')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--mix', choices=sorted(MIXES), default='mixed')
+    parser.add_argument('--rounds', type=int, default=4, help='bcrypt cost factor (match the seeded hashes)')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=JSON',
+                        help='override an app config value, e.g. --set FAST_SERIALIZATION=true')
+    parser.add_argument('--output', help='write the report here as well as to stdout')
+    parser.add_argument('--baseline', help='report of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    path = os.path.abspath(args.db) if args.db else os.path.join(tempfile.mkdtemp(), 'bench.db')
+    fresh = not os.path.exists(path)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(args.rounds)
+    from app import create_app
+
+    app = create_app()
+    app.config['DEBUG'] = False
+    for override in args.set:
+        key, _, value = override.partition('=')
+        app.config[key] = json.loads(value)
+    if fresh:
+        seed_database(app, args.doctors, args.patients, args.seed)
+
+    report = {
+        'settings': {'mix': args.mix, 'threads': args.threads, 'seconds': args.seconds,
+                     'doctors': args.doctors, 'patients': args.patients, 'overrides': args.set},
+        **run(app, args),
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        report['regressions'] = regressions
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Login p99 under concurrent load, with bcrypt inline vs on the hashing pool.
+
+Runs the real app on a threaded local server. Login threads hammer
+/api/auth/login while reader threads hit a cheap endpoint; with inline
+hashing every login occupies a request thread for the whole bcrypt run.
+With the pool, logins past BCRYPT_QUEUE_SIZE are shed with 503 and the
+client retries after --backoff.
+
+    python benchmarks/bench_login.py --logins 16 --readers 8 --seconds 10
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 2) if samples else None,
+        'p99_ms': round(percentile(samples, 99) * 1000, 2) if samples else None,
+    }
+
+def run(workers, args):
+    from app import create_app
+    from models import db, Doctor
+
+    app = create_app()
+    # The hashing pool is built lazily from config, so this takes effect for the whole run
+    app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+    app.config['BCRYPT_WORKERS'] = workers
+    app.config['BCRYPT_QUEUE_SIZE'] = args.queue_size
+    with app.app_context():
+        if not Doctor.query.filter_by(email='bench@doctor.com').first():
+            doctor = Doctor(first_name='Bench', last_name='Doctor', email='bench@doctor.com',
+                            license_number='BENCH1')
+            doctor.set_password('password123')
+            db.session.add(doctor)
+            db.session.commit()
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    body = json.dumps({'email': 'bench@doctor.com', 'password': 'password123'}).encode()
+    results = {'login': [], 'login_with_retries': [], 'read': [], 'shed': 0}
+    deadline = time.perf_counter() + args.seconds
+
+    def login_loop():
+        while time.perf_counter() < deadline:
+            request = urllib.request.Request(base + '/api/auth/login', data=body,
+                                             headers={'Content-Type': 'application/json'})
+            first = time.perf_counter()
+            # A shed login (503) is retried after --backoff; 'login' times each successful
+            # request, 'login_with_retries' the wait from the first attempt to success
+            while True:
+                start = time.perf_counter()
+                try:
+                    urllib.request.urlopen(request).read()
+                    break
+                except urllib.error.HTTPError as e:
+                    if e.code != 503:
+                        raise
+                    results['shed'] += 1
+                    time.sleep(args.backoff)
+            results['login'].append(time.perf_counter() - start)
+            results['login_with_retries'].append(time.perf_counter() - first)
+
+    def read_loop():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            urllib.request.urlopen(base + '/').read()
+            results['read'].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=login_loop) for _ in range(args.logins)]
+    threads += [threading.Thread(target=read_loop) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    return {
+        'bcrypt_workers': workers,
+        'login': summarize(results['login']),
+        'login_with_retries': summarize(results['login_with_retries']),
+        'login_503s': results['shed'],
+        'read': summarize(results['read']),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=16, help='concurrent login threads')
+    parser.add_argument('--readers', type=int, default=8, help='concurrent threads on a cheap endpoint')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rounds', type=int, default=12, help='bcrypt cost factor')
+    parser.add_argument('--workers', type=int, default=2, help='hashing pool size for the "after" run')
+    parser.add_argument('--queue-size', type=int, default=8, help='hashes allowed to wait for the pool')
+    parser.add_argument('--backoff', type=float, default=0.05, help='seconds a client waits before retrying a 503')
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    report = {'before': run(0, args), 'after': run(args.workers, args)}
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
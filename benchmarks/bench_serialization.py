@@ -0,0 +1,68 @@
+"""Rows/sec of the patient list serializers: ORM + to_dict + jsonify vs row tuples + RowLayout.
+
+    python benchmarks/bench_serialization.py --patients 50000 --page 500 --repeat 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--patients', type=int, default=50000)
+    parser.add_argument('--page', type=int, default=500, help='rows per list response')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+    from flask import jsonify
+    from app import create_app
+    from models import db, Doctor, Patient, serialize_patients
+    from serializers import get_layout, orjson
+
+    app = create_app()
+    app.config['DEBUG'] = False
+    with app.app_context():
+        doctor = Doctor(first_name='Bench', last_name='Doctor', email='bench@doctor.com', password_hash='x')
+        db.session.add(doctor)
+        db.session.commit()
+        rows = [{'first_name': f'First{i}', 'last_name': f'Last{i % 1000}', 'date_of_birth': date(1980, 1, 1),
+                 'gender': 'Female', 'phone': '555-0100', 'email': f'p{i}@mail.com',
+                 'address': '1 Main Street', 'blood_type': 'O+', 'allergies': 'none',
+                 'doctor_id': doctor.id} for i in range(args.patients)]
+        db.session.execute(Patient.__table__.insert(), rows)
+        db.session.commit()
+
+        order = (Patient.last_name, Patient.id)
+        layout = get_layout(Patient)
+
+        def orm_path():
+            patients = Patient.query.order_by(*order).limit(args.page).all()
+            body = jsonify(serialize_patients(patients)).get_data()
+            db.session.expunge_all()
+            return body
+
+        def fast_path():
+            return layout.encode(layout.select(Patient.query).order_by(*order).limit(args.page).all())
+
+        report = {'rows_per_request': args.page, 'orjson': orjson is not None}
+        with app.test_request_context():
+            for name, f in (('orm', orm_path), ('fast', fast_path)):
+                f()
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    f()
+                elapsed = time.perf_counter() - start
+                report[name] = {'rows_per_sec': round(args.page * args.repeat / elapsed),
+                                'ms_per_request': round(elapsed / args.repeat * 1000, 2)}
+            assert json.loads(orm_path()) == json.loads(fast_path())
+
+    report['speedup'] = round(report['fast']['rows_per_sec'] / report['orm']['rows_per_sec'], 2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
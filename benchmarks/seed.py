@@ -0,0 +1,118 @@
+"""Fill a database with a reproducible doctor/patient population for benchmarks.
+
+The same --seed always produces the same rows. Every doctor gets the same
+password (one bcrypt run for the whole population) and an email derived
+from their number, so load generators can log in as any of them.
+
+    python benchmarks/seed.py --db /tmp/bench.db --doctors 1000 --patients 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = 'password123'
+
+FIRST_NAMES = ('James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda',
+               'Amina', 'Wanjiru', 'Otieno', 'Aisha', 'Kofi', 'Yuki', 'Mei', 'Omar', 'Sofia', 'Luca')
+LAST_NAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis',
+              'Mwangi', 'Kamau', 'Ochieng', 'Njoroge', 'Mensah', 'Tanaka', 'Chen', 'Haddad', 'Rossi')
+SPECIALTIES = ('General', 'Cardiology', 'Pediatrics', 'Oncology', 'Neurology', 'Dermatology')
+BLOOD_TYPES = ('O+', 'O-', 'A+', 'A-', 'B+', 'B-', 'AB+', 'AB-')
+GENDERS = ('Male', 'Female')
+ALLERGIES = (None, None, None, 'Penicillin', 'Peanuts', 'Latex', 'Dust, pollen')
+
+def doctor_email(number):
+    return f'doctor{number}@bench.local'
+
+def doctor_rows(count, password_hash, rng):
+    for number in range(1, count + 1):
+        yield {
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES),
+            'email': doctor_email(number),
+            'phone': f'555-{number:07d}',
+            'specialty': rng.choice(SPECIALTIES),
+            'license_number': f'BENCH{number:07d}',
+            'password_hash': password_hash,
+            'is_active': True,
+        }
+
+def patient_rows(count, doctor_ids, rng):
+    born = date(1930, 1, 1)
+    now = datetime.utcnow()
+    for number in range(1, count + 1):
+        stamp = now - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+        yield {
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES) + str(number % 500),
+            'date_of_birth': born + timedelta(days=rng.randrange(90 * 365)),
+            'gender': rng.choice(GENDERS),
+            'phone': f'07{number:08d}',
+            'email': f'patient{number}@mail.local',
+            'address': f'{rng.randrange(1, 999)} Hospital Road',
+            'emergency_contact': None,
+            'blood_type': rng.choice(BLOOD_TYPES),
+            'allergies': rng.choice(ALLERGIES),
+            'doctor_id': rng.choice(doctor_ids),
+            'created_at': stamp,
+            'updated_at': stamp,
+        }
+
+def insert_chunked(session, table, rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            session.execute(table.insert(), chunk)
+            session.commit()
+            chunk = []
+    if chunk:
+        session.execute(table.insert(), chunk)
+        session.commit()
+
+def seed_database(app, doctors, patients, seed=0, chunk_size=10000):
+    """Insert ``doctors`` and ``patients`` rows into the app's (empty) database.
+
+    Rows go in through Core executemany in chunks, so memory stays flat
+    however many patients are asked for. Returns a summary dict.
+    """
+    from models import db, Doctor, Patient
+    from passwords import get_password_hasher
+
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    with app.app_context():
+        if db.session.query(Doctor.id).first() is not None:
+            raise RuntimeError('Database is not empty; seed into a fresh file')
+
+        password_hash = get_password_hasher().hash(PASSWORD)
+        insert_chunked(db.session, Doctor.__table__, doctor_rows(doctors, password_hash, rng), chunk_size)
+        doctor_ids = [doctor_id for doctor_id, in db.session.query(Doctor.id).order_by(Doctor.id)]
+        insert_chunked(db.session, Patient.__table__, patient_rows(patients, doctor_ids, rng), chunk_size)
+
+    return {'doctors': doctors, 'patients': patients, 'seed': seed,
+            'seconds': round(time.perf_counter() - start, 2)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='SQLite file to create')
+    parser.add_argument('--doctors', type=int, default=1000)
+    parser.add_argument('--patients', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rounds', type=int, default=4, help='bcrypt cost of the shared password hash')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.db)
+    os.environ['BCRYPT_LOG_ROUNDS'] = str(args.rounds)
+    from app import create_app
+
+    print(json.dumps(seed_database(create_app(), args.doctors, args.patients, args.seed), indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from flask import current_app
+from werkzeug.utils import import_string
+
+class TTLCache:
+    """Thread-safe LRU with a per-entry time-to-live and hit/miss counters."""
+
+    def __init__(self, max_size=1024, ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+class CacheBackend(ABC):
+    """Storage interface for ResponseCache.
+
+    Values are plain dicts of bytes/strings so a shared store (memcached,
+    redis or a local stand-in) can pickle them. ``incr`` must be atomic.
+    Backends that every server process sees set ``shared = True``.
+    """
+
+    shared = False
+
+    @abstractmethod
+    def get(self, key):
+        """The stored value, or None when missing or expired."""
+
+    @abstractmethod
+    def set(self, key, value):
+        """Store ``value``; the backend decides when it expires."""
+
+    @abstractmethod
+    def incr(self, key):
+        """Atomically add one to the counter at ``key`` (missing counts as 0) and return it."""
+
+class NullCacheBackend(CacheBackend):
+    """Stores nothing: every lookup misses. Stands in for a process-local backend under MULTI_PROCESS."""
+
+    def __init__(self, max_size=None, ttl=None):
+        pass
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def incr(self, key):
+        return 0
+
+class LocalCacheBackend(CacheBackend):
+    """Default backend: an in-process TTLCache, so invalidation only reaches this process."""
+
+    def __init__(self, max_size=1024, ttl=300):
+        self._entries = TTLCache(max_size, ttl)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+        return self._entries.get(key)
+
+    def set(self, key, value):
+        self._entries.set(key, value)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def stats(self):
+        return self._entries.stats()
+
+# Response headers kept alongside the encoded body
+CACHED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'X-Next-Cursor')
+
+class ResponseCache:
+    """Pre-encoded response bodies keyed by a generation counter.
+
+    Writers call invalidate() to bump the generation; entries from older
+    generations are never read again and age out of the backend. The bump
+    only reaches processes that share the backend, so under MULTI_PROCESS a
+    process-local backend is replaced by NullCacheBackend.
+    """
+
+    def __init__(self, backend, namespace):
+        self.backend = backend
+        self.namespace = namespace
+
+    def key(self, name):
+        """Versioned key for ``name``; take it before querying and reuse it for set().
+
+        A write that lands mid-request bumps the generation, so a stale body
+        can only ever be stored under a key nobody reads again.
+        """
+        generation = self.backend.get(f'{self.namespace}:generation') or 0
+        return f'{self.namespace}:{generation}:{name}'
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, response):
+        self.backend.set(key, {
+            'body': response.get_data(),
+            'status': response.status_code,
+            'headers': {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers},
+        })
+
+    def invalidate(self):
+        self.backend.incr(f'{self.namespace}:generation')
+
+def cached_response(entry, request):
+    """Rebuild a response from cached bytes; If-None-Match is still honoured."""
+    response = current_app.response_class(entry['body'], status=entry['status'])
+    for name, value in entry['headers'].items():
+        response.headers[name] = value
+    return response.make_conditional(request)
+
+def get_response_cache(namespace):
+    caches = current_app.extensions.setdefault('response_caches', {})
+    if namespace not in caches:
+        backend = current_app.extensions.get('response_cache_backend')
+        if backend is None:
+            backend_class = import_string(current_app.config['RESPONSE_CACHE_BACKEND'])
+            if current_app.config['MULTI_PROCESS'] and not backend_class.shared:
+                backend_class = NullCacheBackend
+            backend = current_app.extensions['response_cache_backend'] = backend_class(
+                current_app.config['RESPONSE_CACHE_SIZE'], current_app.config['RESPONSE_CACHE_TTL'])
+        caches[namespace] = ResponseCache(backend, namespace)
+    return caches[namespace]
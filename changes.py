@@ -0,0 +1,80 @@
+from sqlalchemy import event, text
+from models import db, Patient
+
+class ChangesError(ValueError):
+    pass
+
+_upsert = 'INSERT OR REPLACE INTO patient_changes (patient_id, doctor_id, deleted) '
+
+# Change log kept by triggers in the writing transaction, so ORM writes, Core
+# bulk inserts, PATCH, reassignment and the doctor delete cascade all show up.
+# Only the latest change per (patient, doctor) is kept: REPLACE drops the old
+# row and hands out a new seq, so the log grows with churn, not with history.
+# A patient moving to another doctor leaves a tombstone in the old panel.
+CHANGES_DDL = (
+    """CREATE TABLE IF NOT EXISTS patient_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER NOT NULL,
+        doctor_id INTEGER NOT NULL,
+        deleted BOOLEAN NOT NULL,
+        UNIQUE (patient_id, doctor_id)
+    )""",
+    'CREATE INDEX IF NOT EXISTS ix_patient_changes_doctor_seq ON patient_changes (doctor_id, seq)',
+    f"""CREATE TRIGGER IF NOT EXISTS patient_changes_ai AFTER INSERT ON patients BEGIN
+        {_upsert} VALUES (new.id, new.doctor_id, 0);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_changes_ad AFTER DELETE ON patients BEGIN
+        {_upsert} VALUES (old.id, old.doctor_id, 1);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_changes_au AFTER UPDATE ON patients BEGIN
+        {_upsert} SELECT old.id, old.doctor_id, 1 WHERE old.doctor_id IS NOT new.doctor_id;
+        {_upsert} VALUES (new.id, new.doctor_id, 0);
+    END""",
+)
+
+def create_changes_table(connection):
+    """Create the change log and triggers if missing, seeding one entry per existing patient."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patient_changes'")).first()
+    for statement in CHANGES_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        connection.execute(text('INSERT INTO patient_changes (patient_id, doctor_id, deleted) '
+                                'SELECT id, doctor_id, 0 FROM patients ORDER BY id'))
+
+@event.listens_for(Patient.__table__, 'after_create')
+def _create_changes_table(target, connection, **kw):
+    create_changes_table(connection)
+
+@event.listens_for(Patient.__table__, 'before_drop')
+def _drop_changes_table(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DROP TABLE IF EXISTS patient_changes'))
+
+def parse_since(value):
+    """?since= is the seq of the last change a client applied; 0 or missing means from scratch."""
+    if value in (None, ''):
+        return 0
+    try:
+        since = int(value)
+    except ValueError:
+        raise ChangesError('since must be a non-negative integer')
+    if since < 0:
+        raise ChangesError('since must be a non-negative integer')
+    return since
+
+def changes_since(since, limit, doctor_id=None):
+    """Up to ``limit`` changes after ``since`` in seq order, as (seq, patient_id, deleted) rows.
+
+    Returns the rows and whether more are waiting. SQLite serializes writers,
+    so seqs become visible in order and a client never skips a change.
+    """
+    sql = 'SELECT seq, patient_id, deleted FROM patient_changes WHERE seq > :since'
+    if doctor_id is not None:
+        sql += ' AND doctor_id = :doctor_id'
+    rows = db.session.execute(text(sql + ' ORDER BY seq LIMIT :limit'),
+                              {'since': since, 'doctor_id': doctor_id, 'limit': limit + 1}).all()
+    return rows[:limit], len(rows) > limit
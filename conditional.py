@@ -0,0 +1,76 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+from flask import Response, request
+
+_EPOCH = datetime(1970, 1, 1)
+
+class PreconditionError(ValueError):
+    pass
+
+def make_etag(*parts):
+    """Strong ETag from cheap version data (ids, timestamps, counts), never from the payload."""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+def make_versioned_etag(version, *parts):
+    """make_etag() prefixed with ``version`` (a row's updated_at), so If-Match can be checked in SQL."""
+    micros = (version - _EPOCH) // timedelta(microseconds=1) if version else 0
+    return f'{micros:x}-{make_etag(*parts)[:16]}'
+
+def if_match_versions():
+    """Row versions named by If-Match, or None when there is no precondition (absent or ``*``).
+
+    Raises PreconditionError for tags that did not come from make_versioned_etag.
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+
+    versions = []
+    for etag in request.if_match.as_set(include_weak=False):
+        micros, _, _ = etag.partition('-')
+        try:
+            micros = int(micros, 16)
+        except ValueError:
+            raise PreconditionError('If-Match does not name a version of this resource')
+        versions.append(_EPOCH + timedelta(microseconds=micros) if micros else None)
+    if not versions:
+        raise PreconditionError('If-Match does not name a version of this resource')
+    return versions
+
+def _http_date(value):
+    # Stored timestamps are naive UTC; HTTP dates have one-second resolution
+    return value.replace(tzinfo=timezone.utc, microsecond=0) if value else None
+
+def _stable_http_date(value):
+    """``value`` as an HTTP date, or None while it is still in the current second.
+
+    A later edit in the same second would carry the same date, and a client
+    revalidating with If-Modified-Since would get a 304 for content it lacks.
+    """
+    if value is None or value.replace(microsecond=0) >= datetime.utcnow().replace(microsecond=0):
+        return None
+    return _http_date(value)
+
+def not_modified(etag, last_modified=None):
+    """A 304 response when the client's validators still match, otherwise None.
+
+    If-None-Match wins over If-Modified-Since, as RFC 9110 requires. Only pass
+    ``last_modified`` when it changes whenever anything the ETag covers does;
+    otherwise leave it out and let If-None-Match do the validating.
+    """
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        stable = _stable_http_date(last_modified)
+        matched = bool(stable and since and stable <= since)
+
+    if not matched:
+        return None
+    return add_validators(Response(status=304), etag, last_modified)
+
+def add_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    last_modified = _stable_http_date(last_modified)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
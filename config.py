@@ -9,16 +9,178 @@ class Config: #Base config. Other configs will inherit from this class
 
     SQLALCHEMY_TRACK_NOTIFICATIONS = False
 
-    JWT_SECRTET_KEY = os.environ.get('JWR_SECRET') or 'smgmediclics'
+    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'smgmediclics'
 
     JWT_ACCESS_TOKEN = timedelta(hours=2)
 
+    #More than one process serves the app (serve.py sets this when it forks several workers; set
+    #MULTI_PROCESS=1 for `uvicorn --workers N`). Invalidations made in one process cannot reach the
+    #in-process caches of the others, so those caches are turned off and token revocations are kept
+    #in the database
+    MULTI_PROCESS = os.environ.get('MULTI_PROCESS', '').lower() in ('1', 'true')
+
+    #Verified tokens remembered per process so repeat requests skip the HMAC check
+    JWT_VERIFIED_CACHE_SIZE = 4096
+
+    #Doctors loaded for cookie sessions are cached per process (seconds); off under MULTI_PROCESS
+    PRINCIPAL_CACHE_SIZE = 1024
+
+    PRINCIPAL_CACHE_TTL = 60
+
+    #bcrypt cost factor; stored hashes with another cost are rehashed at next login
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS') or 12)
+
+    #Threads reserved for password hashing (0 = hash on the request thread)
+    BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS') or 2)
+
+    #Hashes allowed to wait for a free hashing thread; past that, login and password changes get 503 with Retry-After
+    BCRYPT_QUEUE_SIZE = int(os.environ.get('BCRYPT_QUEUE_SIZE') or 8)
+
+    #Encoded doctor directory responses; any CacheBackend subclass can be plugged in. Under
+    #MULTI_PROCESS only a backend shared by every process (shared = True) is used
+    RESPONSE_CACHE_BACKEND = 'cache.LocalCacheBackend'
+
+    RESPONSE_CACHE_SIZE = 1024
+
+    RESPONSE_CACHE_TTL = 300
+
+    #PRAGMAs run on every new SQLite connection
+    SQLITE_PRAGMAS = {}
+
+    #Route GET/HEAD queries to a separate pool of read-only connections
+    SQLITE_READ_ENGINE = False
+
+    SQLITE_READ_ENGINE_OPTIONS = {}
+
+    #List endpoints select row tuples and encode them directly (uses orjson when installed)
+    FAST_SERIALIZATION = False
+
+    #ASGI mode (asgi.py): aiosqlite engine options, and threads for routes still served by the sync views
+    ASGI_ENGINE_OPTIONS = {}
+
+    ASGI_SYNC_THREADS = 8
+
+    #Request latency histograms and SQL totals, served at /metrics
+    METRICS_ENABLED = True
+
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    #/metrics reveals traffic patterns, so it is off unless asked for; with a token set, scrapers must send
+    #"Authorization: Bearer <token>"
+    METRICS_ENDPOINT = False
+
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    #Requests slower than this (seconds) are logged with their slowest SQL; None turns the log off
+    SLOW_REQUEST_THRESHOLD = None
+
+    SLOW_REQUEST_MAX_STATEMENTS = 10
+
+    #List endpoints are paginated; clients can ask for less but never more than the max
+    PAGE_SIZE_DEFAULT = 50
+
+    PAGE_SIZE_MAX = 500
+
+    #Ids accepted by one batch fetch (resolved with a single IN query)
+    BATCH_SIZE_MAX = 500
+
+    #Rows fetched per round-trip by the streaming export
+    EXPORT_BATCH_SIZE = 1000
+
+    #Patients moved per UPDATE/transaction when a doctor's panel is reassigned
+    REASSIGN_CHUNK_SIZE = 1000
+
+    #Rows per INSERT/transaction for the bulk import
+    BULK_IMPORT_CHUNK_SIZE = 1000
+
+    #Coalesce concurrent patient/doctor writes into one transaction per window (seconds) on a writer thread
+    GROUP_COMMIT_ENABLED = False
+
+    GROUP_COMMIT_WINDOW = 0.002
+
+    GROUP_COMMIT_MAX_BATCH = 64
+
+    #Seconds a request waits for the writer thread before giving up with 503
+    GROUP_COMMIT_TIMEOUT = 10.0
+
+    #Patient access trail (audit.py): queued per request, appended to audit_log in batches by a background thread
+    AUDIT_ENABLED = True
+
+    AUDIT_QUEUE_SIZE = 10000
+
+    AUDIT_BATCH_SIZE = 500
+
+    AUDIT_FLUSH_INTERVAL = 1.0
+
+    #Full queue: 'block' waits up to AUDIT_BLOCK_TIMEOUT seconds for room, 'drop' gives up at once; drops are counted
+    AUDIT_OVERFLOW = 'block'
+
+    AUDIT_BLOCK_TIMEOUT = 0.1
+
+    #create_app() runs create_all and pending migrations itself; otherwise run `flask migrate` on deploy
+    CREATE_SCHEMA = False
+
+    #serve.py: pre-forked worker processes (0 = one per CPU) and seconds allowed for in-flight requests at shutdown
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS') or 0)
+
+    SERVER_GRACEFUL_TIMEOUT = 30
+
 class DevelopmentConfig(Config):
     DEBUG = True
 
+    CREATE_SCHEMA = True
+
+    METRICS_ENDPOINT = True
+
+class TestingConfig(Config):
+    TESTING = True
+
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+
+    CREATE_SCHEMA = True
+
+    #Cheapest cost bcrypt allows, so fixtures do not spend seconds hashing
+    BCRYPT_LOG_ROUNDS = 4
+
+    METRICS_ENDPOINT = True
+
+    #Audit events are written on flush() only, never in the middle of a test's request
+    AUDIT_FLUSH_INTERVAL = None
+
 
 class ProductionConfig(Config):
     DEBUG = False
 
+    #WAL lets readers run alongside the single writer instead of blocking on it
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 268435456,
+        'cache_size': -65536,
+        'temp_store': 'MEMORY',
+    }
+
+    #Writes serialize in SQLite anyway, so the writer pool stays small
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': 4,
+        'max_overflow': 4,
+        'pool_timeout': 10,
+    }
+
+    SQLITE_READ_ENGINE = True
+
+    SQLITE_READ_ENGINE_OPTIONS = {
+        'pool_size': 16,
+        'max_overflow': 16,
+        'pool_timeout': 10,
+    }
 
+    SLOW_REQUEST_THRESHOLD = 1.0
 
+#Names accepted by create_app() and the APP_CONFIG environment variable
+configs = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
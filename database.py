@@ -0,0 +1,74 @@
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from metrics import instrument_engine
+
+READ_METHODS = ('GET', 'HEAD')
+
+def _is_write(mapper, clause):
+    # The unit of work asks for a connection by mapper alone; statements say whether they are DML
+    if clause is None:
+        return mapper is not None
+    return clause.is_dml
+
+class RoutingSession(Session):
+    """Sends statements issued while serving GET/HEAD to the read-only engine.
+
+    Flushes and DML statements (Core or ORM insert/update/delete) always go
+    to the primary engine, so a GET that does write still lands on the
+    writer. Without a read engine this is a plain Session.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # A session opened with its own bind (the group-commit writer's) keeps it
+        if bind is None and self.bind is not None:
+            return self.bind
+        if bind is None and not _is_write(mapper, clause) and has_request_context() \
+                and request.method in READ_METHODS:
+            read_engine = current_app.extensions.get('read_engine')
+            if read_engine is not None:
+                return read_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def apply_sqlite_pragmas(engine, pragmas, read_only=False):
+    """Run PRAGMAs on every new DBAPI connection the engine opens."""
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
+
+def init_engines(app, db):
+    """Apply the SQLite profile from config; call after db.init_app and before first use."""
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+
+    apply_sqlite_pragmas(engine, app.config['SQLITE_PRAGMAS'])
+
+    # A second pool of query_only connections for reads; pointless for :memory:
+    # databases, which are private to each connection
+    if app.config['SQLITE_READ_ENGINE'] and engine.url.database not in (None, '', ':memory:'):
+        read_engine = create_engine(engine.url, **app.config['SQLITE_READ_ENGINE_OPTIONS'])
+        apply_sqlite_pragmas(read_engine, app.config['SQLITE_PRAGMAS'], read_only=True)
+        app.extensions['read_engine'] = read_engine
+
+def dedicated_engine(app, engine):
+    """A one-connection engine on ``engine``'s SQLite file, for a background thread of its own.
+
+    Such a thread never waits on the request pool. In-memory databases are
+    private to their connection, so for those ``engine`` itself is returned.
+    """
+    if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        return engine
+
+    dedicated = create_engine(engine.url, pool_size=1, max_overflow=0)
+    apply_sqlite_pragmas(dedicated, app.config['SQLITE_PRAGMAS'])
+    if 'metrics' in app.extensions:
+        instrument_engine(dedicated)
+    return dedicated
@@ -0,0 +1,30 @@
+from flask import request
+from sqlalchemy.orm import load_only
+
+class FieldsError(ValueError):
+    pass
+
+def requested_fields(allowed, default=None):
+    """Parse ``?fields=a,b`` into a tuple ordered like ``allowed``.
+
+    Returns ``default`` when the parameter is absent (None means the full schema).
+    """
+    raw = request.args.get('fields')
+    if not raw:
+        return default
+
+    names = {name.strip() for name in raw.split(',') if name.strip()}
+    unknown = names - set(allowed)
+    if unknown:
+        raise FieldsError('Unknown fields: ' + ', '.join(sorted(unknown)))
+    return tuple(field for field in allowed if field in names)
+
+def load_fields(model, fields, *required):
+    """A load_only() option selecting just the columns behind ``fields`` plus ``required``.
+
+    ``required`` covers columns the endpoint itself reads (ownership checks,
+    sort keys, ETags) even if the client did not ask for them.
+    """
+    columns = model.__table__.columns
+    names = {field for field in fields if field in columns} | set(required) | {'id'}
+    return load_only(*[getattr(model, name) for name in sorted(names)])
@@ -0,0 +1,177 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from flask import current_app
+from models import db
+from database import dedicated_engine
+
+class GroupCommitUnavailable(Exception):
+    """Raised when the writer thread is gone or does not finish a job in time; answered with 503 and Retry-After."""
+
+class GroupCommitWriter:
+    """Coalesces write jobs from concurrent requests into shared transactions.
+
+    One thread takes the jobs queued within ``window`` seconds of the first
+    (at most ``max_batch``) and runs each in its own SAVEPOINT. It then
+    commits the whole batch at once, so N concurrent writes cost one COMMIT
+    and one fsync instead of N. A job that raises is rolled back to its
+    savepoint, and only its own caller sees the error.
+
+    Callers wait at most ``timeout`` seconds for their job. A job that was
+    not started by then is cancelled. One already running may still commit
+    after its caller has been told the write failed.
+    """
+
+    def __init__(self, app, window=0.002, max_batch=64, timeout=10.0):
+        self.app = app
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        # Requests waiting on the writer hold pooled connections, so it gets its own
+        with app.app_context():
+            self.engine = dedicated_engine(app, db.engine)
+        self.batches = 0
+        self.jobs = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+        self._thread.start()
+
+    def submit(self, job):
+        # A dead writer would leave the job queued forever
+        if not self._thread.is_alive():
+            raise GroupCommitUnavailable('The group-commit writer thread is not running')
+        future = Future()
+        self._queue.put((future, job))
+        return future
+
+    def run(self, job):
+        """Queue ``job`` and wait for its result once the batch holding it has committed."""
+        future = self.submit(job)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise GroupCommitUnavailable(f'No commit from the group-commit writer within {self.timeout}s')
+
+    def shutdown(self):
+        """Commit what is already queued, then stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+        with self.app.app_context():
+            if self.engine is not db.engine:
+                self.engine.dispose()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.perf_counter(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the stop marker back so the loop ends after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                self._commit(self._collect(item))
+
+    def _commit(self, batch):
+        session = db.session(bind=self.engine)
+        outcomes = []
+        try:
+            connection = session.connection()
+            if connection.dialect.name == 'sqlite':
+                # pysqlite only emits BEGIN before DML, and releasing an outermost
+                # SAVEPOINT would commit; take the write lock up front instead
+                connection.exec_driver_sql('BEGIN IMMEDIATE')
+            for future, job in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with session.begin_nested():
+                        outcomes.append((future, job(), None))
+                except Exception as e:
+                    outcomes.append((future, None, e))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            for future, job in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            db.session.remove()
+
+        self.batches += 1
+        self.jobs += len(outcomes)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+def get_writer():
+    """The app's group-commit writer, or None when GROUP_COMMIT_ENABLED is off."""
+    if not current_app.config['GROUP_COMMIT_ENABLED']:
+        return None
+    writer = current_app.extensions.get('group_commit')
+    if writer is None:
+        writer = current_app.extensions['group_commit'] = GroupCommitWriter(
+            current_app._get_current_object(), current_app.config['GROUP_COMMIT_WINDOW'],
+            current_app.config['GROUP_COMMIT_MAX_BATCH'], current_app.config['GROUP_COMMIT_TIMEOUT'])
+    return writer
+
+def commit_write(job):
+    """Run ``job()`` and commit what it did; returns the job's result.
+
+    With group commit on, the job runs on the writer thread in that thread's
+    session. It must not touch request state (current_user, request) and
+    should return plain data, serialized inside the job, not ORM objects.
+    """
+    writer = get_writer()
+    if writer is not None:
+        return writer.run(job)
+    try:
+        result = job()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return result
+
+def save(instance):
+    """Persist ``instance`` (new, or changed on the request's session) and return its to_dict()."""
+    def job():
+        if instance in db.session or instance.id is None:
+            db.session.add(instance)
+            target = instance
+        else:
+            target = db.session.merge(instance)
+        db.session.flush()
+        return target.to_dict()
+
+    result = commit_write(job)
+    # With group commit the writer saved its own copy; drop the request session's unflushed edits
+    if instance in db.session and db.session.is_modified(instance):
+        db.session.expire(instance)
+    return result
+
+def delete(instance):
+    """Delete ``instance``, loaded on the request's session, and commit."""
+    def job():
+        db.session.delete(instance if instance in db.session else db.session.merge(instance))
+
+    commit_write(job)
+    # The writer deleted its own copy; the request session must not keep serving this one
+    if instance in db.session:
+        db.session.expunge(instance)
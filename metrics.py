@@ -0,0 +1,173 @@
+import bisect
+import heapq
+import hmac
+import threading
+import time
+from flask import Response, current_app, g, has_app_context, jsonify, request
+from sqlalchemy import event
+
+# Methods kept as their own label; anything else is counted as OTHER
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+class RequestStats:
+    """SQL issued while serving one request."""
+
+    def __init__(self, keep=0):
+        self.statements = 0
+        self.db_time = 0.0
+        self.keep = keep
+        self.slowest = []  # min-heap of the ``keep`` slowest (seconds, sql), for the slow log
+
+    def add(self, elapsed, statement):
+        self.statements += 1
+        self.db_time += elapsed
+        if self.keep:
+            if len(self.slowest) < self.keep:
+                heapq.heappush(self.slowest, (elapsed, statement))
+            elif elapsed > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (elapsed, statement))
+
+class Metrics:
+    """Per-process latency histograms and SQL totals, keyed by endpoint, method and status.
+
+    Recording is one lock and a bisect per request, cheap enough to leave on.
+    Each worker process keeps its own numbers; scrape every worker.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._requests = {}  # (endpoint, method, status) -> [bucket counts..., +Inf count, sum]
+        self._sql = {}  # endpoint -> [statements, seconds]
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, method, status, duration, stats):
+        with self._lock:
+            series = self._requests.get((endpoint, method, status))
+            if series is None:
+                series = self._requests[(endpoint, method, status)] = [0] * (len(self.buckets) + 2)
+            series[bisect.bisect_left(self.buckets, duration)] += 1
+            series[-1] += duration
+
+            totals = self._sql.get(endpoint)
+            if totals is None:
+                totals = self._sql[endpoint] = [0, 0.0]
+            totals[0] += stats.statements
+            totals[1] += stats.db_time
+
+    def render(self):
+        """Prometheus text exposition format."""
+        with self._lock:
+            requests = {key: list(series) for key, series in self._requests.items()}
+            sql = {key: list(totals) for key, totals in self._sql.items()}
+
+        lines = [
+            '# HELP http_request_duration_seconds Time spent serving requests.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (endpoint, method, status), series in sorted(requests.items()):
+            labels = f'endpoint="{_escape(endpoint)}",method="{method}",status="{status}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += series[-2]
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {series[-1]}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {cumulative}')
+
+        lines += [
+            '# HELP http_request_db_statements_total SQL statements issued while serving requests.',
+            '# TYPE http_request_db_statements_total counter',
+        ]
+        lines += [f'http_request_db_statements_total{{endpoint="{_escape(endpoint)}"}} {statements}'
+                  for endpoint, (statements, _) in sorted(sql.items())]
+        lines += [
+            '# HELP http_request_db_seconds_total Time spent in SQL statements while serving requests.',
+            '# TYPE http_request_db_seconds_total counter',
+        ]
+        lines += [f'http_request_db_seconds_total{{endpoint="{_escape(endpoint)}"}} {seconds}'
+                  for endpoint, (_, seconds) in sorted(sql.items())]
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    stats = g.get('_request_stats') if has_app_context() else None
+    if stats is None:
+        return
+    stats.add(elapsed, statement)
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute; drop its start time so the stack stays paired
+    if context.connection is not None and context.execution_context is not None:
+        starts = context.connection.info.get('query_start')
+        if starts:
+            starts.pop()
+
+def instrument_engine(engine):
+    """Attribute the statements run on ``engine`` to the request being served."""
+    if not event.contains(engine, 'after_cursor_execute', _after_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+
+def _start_request():
+    g._request_started = time.perf_counter()
+    slow_log = current_app.config['SLOW_REQUEST_THRESHOLD'] is not None
+    g._request_stats = RequestStats(current_app.config['SLOW_REQUEST_MAX_STATEMENTS'] if slow_log else 0)
+
+def _record_request(response):
+    started = g.pop('_request_started', None)
+    stats = g.pop('_request_stats', None)
+    if started is None:
+        return response
+    duration = time.perf_counter() - started
+
+    # Unmatched URLs and unknown methods share one label each so scanners cannot blow up the series count
+    endpoint = request.endpoint or 'unmatched'
+    method = request.method if request.method in METHODS else 'OTHER'
+    current_app.extensions['metrics'].observe(endpoint, method, response.status_code, duration, stats)
+
+    threshold = current_app.config['SLOW_REQUEST_THRESHOLD']
+    if threshold is not None and duration >= threshold:
+        log_slow_request(endpoint, duration, response.status_code, stats)
+    return response
+
+def log_slow_request(endpoint, duration, status, stats):
+    slowest = sorted(stats.slowest, reverse=True)
+    lines = [f'Slow request: {request.method} {request.full_path} -> {endpoint} {status} '
+             f'in {duration * 1000:.1f}ms ({stats.statements} statements, {stats.db_time * 1000:.1f}ms in SQL)']
+    lines += [f'  {elapsed * 1000:.1f}ms  {" ".join(statement.split())}' for elapsed, statement in slowest]
+    current_app.logger.warning('\n'.join(lines))
+
+def metrics_endpoint():
+    token = current_app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return jsonify({'message': 'Unauthorized access'}), 401, {'WWW-Authenticate': 'Bearer'}
+
+    body = current_app.extensions['metrics'].render()
+    # Subsystems with counters of their own (the audit log) are appended
+    if 'audit_log' in current_app.extensions:
+        body += current_app.extensions['audit_log'].render()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+def init_metrics(app, db):
+    """Time every request and expose the totals at /metrics (if METRICS_ENDPOINT); call after init_engines."""
+    if not app.config['METRICS_ENABLED']:
+        return
+
+    app.extensions['metrics'] = Metrics(app.config['METRICS_BUCKETS'])
+    with app.app_context():
+        instrument_engine(db.engine)
+    if 'read_engine' in app.extensions:
+        instrument_engine(app.extensions['read_engine'])
+
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    if app.config['METRICS_ENDPOINT']:
+        app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
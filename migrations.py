@@ -0,0 +1,92 @@
+from datetime import datetime
+from sqlalchemy import inspect, text
+from models import Doctor, Patient, RevokedToken
+from search import create_search_index
+from stats import create_stats_table, recreate_stats
+from changes import create_changes_table
+from audit import create_audit_log
+
+# db.create_all() only creates missing tables, so anything added to an existing
+# table (indexes, triggers, virtual tables) has to ship as a numbered migration.
+# Every migration must be idempotent: on a fresh database create_all has already
+# built the objects and the migration only records its version.
+MIGRATIONS = []
+
+def migration(version, description):
+    def register(f):
+        MIGRATIONS.append((version, description, f))
+        return f
+    return register
+
+@migration(1, 'Full-text search index over patients')
+def add_search_index(connection):
+    create_search_index(connection)
+
+@migration(2, 'Indexes for patient and doctor list endpoints')
+def add_list_indexes(connection):
+    for table in (Doctor.__table__, Patient.__table__):
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+@migration(3, 'doctors.updated_at and the patient list ETag index')
+def add_doctor_updated_at(connection):
+    add_column(connection, Doctor.__table__.c.updated_at)
+    connection.execute(text('UPDATE doctors SET updated_at = created_at WHERE updated_at IS NULL'))
+    for index in Patient.__table__.indexes:
+        index.create(connection, checkfirst=True)
+
+@migration(4, 'Patient census counters maintained by triggers')
+def add_patient_stats(connection):
+    create_stats_table(connection)
+
+@migration(5, 'Patient change log with tombstones for incremental sync')
+def add_patient_changes(connection):
+    create_changes_table(connection)
+
+@migration(6, 'Append-only audit log of patient record access')
+def add_audit_log(connection):
+    create_audit_log(connection)
+
+@migration(7, 'Census age bands counted by full birth date')
+def count_birth_dates(connection):
+    recreate_stats(connection)
+
+@migration(8, 'Token revocations shared by every server process')
+def add_token_revocations(connection):
+    add_column(connection, Doctor.__table__.c.tokens_revoked_before)
+    RevokedToken.__table__.create(connection, checkfirst=True)
+
+def add_column(connection, column):
+    """ALTER TABLE ... ADD COLUMN unless the column is already there."""
+    table = column.table.name
+    if column.name in {c['name'] for c in inspect(connection).get_columns(table)}:
+        return
+    column_type = column.type.compile(dialect=connection.dialect)
+    connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column.name} {column_type}'))
+
+def _ensure_version_table(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, description VARCHAR(200), applied_at DATETIME)'))
+
+def current_version(connection):
+    _ensure_version_table(connection)
+    return connection.execute(text('SELECT MAX(version) FROM schema_migrations')).scalar() or 0
+
+def upgrade(engine):
+    """Apply pending migrations in order, each in its own transaction. Returns the versions applied."""
+    applied = []
+    with engine.begin() as connection:
+        version = current_version(connection)
+
+    for number, description, apply in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if number <= version:
+            continue
+        with engine.begin() as connection:
+            apply(connection)
+            connection.execute(
+                text('INSERT INTO schema_migrations (version, description, applied_at) '
+                     'VALUES (:version, :description, :applied_at)'),
+                {'version': number, 'description': description, 'applied_at': datetime.utcnow()})
+        applied.append(number)
+    return applied
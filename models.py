@@ -1,12 +1,66 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from flask_bcrypt import generate_password_hash, check_password_hash
-from datetime import datetime
+from passwords import get_password_hasher
+from database import RoutingSession
+from flask import current_app
+from sqlalchemy import event
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime
+import threading
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Upper bound on SQL statements a list serialization may issue (the doctor-name prefetch)
+SERIALIZE_QUERY_BUDGET = 1
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+@contextmanager
+def query_budget(limit):
+    """Fail if the wrapped block issues more than ``limit`` SQL statements.
+
+    Only statements issued from the calling thread count, so concurrent
+    requests on a threaded dev server do not charge each other's SQL.
+    """
+    statements = []
+    thread = threading.get_ident()
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == thread:
+            statements.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    if len(statements) > limit:
+        raise QueryBudgetExceeded(
+            f'{len(statements)} queries issued, budget is {limit}:\n' + '\n'.join(statements))
+
+def _debug_query_budget(limit):
+    if current_app.debug or current_app.testing:
+        return query_budget(limit)
+    return nullcontext()
+
+def serialize_value(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
 
 class Doctor(db.Model, UserMixin):
     __tablename__ = 'doctors'
+    __table_args__ = (
+        # Active-doctor directory, paged by id
+        db.Index('ix_doctors_is_active_id', 'is_active', 'id'),
+    )
+    
+    # Keys of to_dict(), in order
+    SERIALIZED_FIELDS = (
+        'id', 'first_name', 'last_name', 'email', 'phone', 'specialty',
+        'license_number', 'created_at'
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(50), nullable=False)
@@ -18,17 +72,33 @@ class Doctor(db.Model, UserMixin):
     password_hash = db.Column(db.String(256), nullable=False)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Tokens issued at or before this epoch second are revoked (tokens.TokenStore under MULTI_PROCESS)
+    tokens_revoked_before = db.Column(db.Integer)
+    
+    # Relationship with patients; deleting a doctor removes the unloaded part of the
+    # panel with one DELETE (delete_panel below) instead of loading every patient
+    patients = db.relationship('Patient', backref='doctor', lazy=True, cascade="all, delete-orphan",
+                               passive_deletes=True)
     
-    # Relationship with patients
-    patients = db.relationship('Patient', backref='doctor', lazy=True, cascade="all, delete-orphan")
+    @property
+    def full_name(self):
+        return f"{self.first_name} {self.last_name}"
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password).decode('utf-8')
+        self.password_hash = get_password_hasher().hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return get_password_hasher().verify(password, self.password_hash)
+    
+    def password_needs_rehash(self):
+        return get_password_hasher().needs_rehash(self.password_hash)
     
-    def to_dict(self):
+    def to_dict(self, fields=None):
+        # A sparse fieldset only touches the attributes it needs, so unloaded columns stay unloaded
+        if fields is not None:
+            return {field: serialize_value(getattr(self, field)) for field in fields}
+        
         return {
             'id': self.id,
             'first_name': self.first_name,
@@ -42,6 +112,21 @@ class Doctor(db.Model, UserMixin):
 
 class Patient(db.Model):
     __tablename__ = 'patients'
+    __table_args__ = (
+        # A doctor's patient list, paged by (last_name, id); also serves doctor_id lookups
+        db.Index('ix_patients_doctor_last_name_id', 'doctor_id', 'last_name', 'id'),
+        # Admin patient list, paged by (last_name, id)
+        db.Index('ix_patients_last_name_id', 'last_name', 'id'),
+        # Covers the max(updated_at)/count() aggregate behind list ETags
+        db.Index('ix_patients_doctor_updated_at', 'doctor_id', 'updated_at'),
+    )
+    
+    # Keys of to_dict(), in order (used for CSV headers)
+    SERIALIZED_FIELDS = (
+        'id', 'first_name', 'last_name', 'date_of_birth', 'gender', 'phone', 'email',
+        'address', 'emergency_contact', 'blood_type', 'allergies', 'doctor_id',
+        'doctor_name', 'created_at', 'updated_at'
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(50), nullable=False)
@@ -60,7 +145,16 @@ class Patient(db.Model):
     # Foreign key to Doctor
     doctor_id = db.Column(db.Integer, db.ForeignKey('doctors.id'), nullable=False)
     
-    def to_dict(self):
+    def to_dict(self, doctor_name=None, fields=None):
+        # Callers serializing many patients pass doctor_name to avoid lazy-loading self.doctor
+        if doctor_name is None and (fields is None or 'doctor_name' in fields) and self.doctor:
+            doctor_name = self.doctor.full_name
+        
+        # A sparse fieldset only touches the attributes it needs, so unloaded columns stay unloaded
+        if fields is not None:
+            return {field: doctor_name if field == 'doctor_name' else serialize_value(getattr(self, field))
+                    for field in fields}
+        
         return {
             'id': self.id,
             'first_name': self.first_name,
@@ -74,7 +168,61 @@ class Patient(db.Model):
             'blood_type': self.blood_type,
             'allergies': self.allergies,
             'doctor_id': self.doctor_id,
-            'doctor_name': f"{self.doctor.first_name} {self.doctor.last_name}" if self.doctor else None,
+            'doctor_name': doctor_name,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        }
\ No newline at end of file
+        }
+
+class AuditEvent(db.Model):
+    __tablename__ = 'audit_log'
+    __table_args__ = (
+        # "Who touched this patient, and when"
+        db.Index('ix_audit_log_patient_occurred_at', 'patient_id', 'occurred_at'),
+    )
+    
+    # Append-only (enforced by triggers in audit.py) and written in batches by audit.AuditLog.
+    # No foreign keys: the trail must outlive deleted patients and doctors
+    id = db.Column(db.Integer, primary_key=True)
+    occurred_at = db.Column(db.DateTime, nullable=False)
+    actor_id = db.Column(db.Integer)
+    action = db.Column(db.String(10), nullable=False)
+    patient_id = db.Column(db.Integer)
+    status = db.Column(db.Integer, nullable=False)
+    remote_addr = db.Column(db.String(45))
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+    
+    # Logged-out tokens, so every server process rejects them; rows are pruned once the token expires
+    jti = db.Column(db.String(32), primary_key=True)
+    expires_at = db.Column(db.Integer, nullable=False)
+
+@event.listens_for(Doctor, 'before_delete')
+def delete_panel(mapper, connection, doctor):
+    # Loaded patients were already deleted by the ORM cascade; this catches the rest
+    patients = Patient.__table__
+    connection.execute(patients.delete().where(patients.c.doctor_id == doctor.id))
+
+def doctor_name_map(doctor_ids):
+    """Map doctor id -> "First Last" for all ``doctor_ids`` in a single query."""
+    doctor_ids = set(doctor_ids)
+    if not doctor_ids:
+        return {}
+    
+    rows = db.session.query(Doctor.id, Doctor.first_name, Doctor.last_name) \
+        .filter(Doctor.id.in_(doctor_ids)).all()
+    return {doctor_id: f"{first_name} {last_name}" for doctor_id, first_name, last_name in rows}
+
+def serialize_patients(patients, doctor_names=None, fields=None):
+    """Serialize a list of patients without touching the lazy ``doctor`` relationship.
+
+    ``doctor_names`` is a prefetched doctor id -> name map; when omitted it is
+    built with one query for the doctors referenced by ``patients``.
+    """
+    with _debug_query_budget(SERIALIZE_QUERY_BUDGET):
+        if fields is not None and 'doctor_name' not in fields:
+            doctor_names = {}
+        elif doctor_names is None:
+            doctor_names = doctor_name_map(patient.doctor_id for patient in patients)
+        return [patient.to_dict(doctor_name=doctor_names.get(patient.doctor_id), fields=fields)
+                for patient in patients]
@@ -0,0 +1,60 @@
+from datetime import datetime
+from sqlalchemy import func, select, update
+from models import db, Patient
+
+def balanced_quotas(total, loads):
+    """Split ``total`` patients so the targets end up as even as possible.
+
+    ``loads`` maps target doctor id -> current patient count; the least
+    loaded doctors are filled up to a common level first.
+    """
+    order = sorted(loads, key=lambda doctor_id: (loads[doctor_id], doctor_id))
+    base = 0
+    for k, doctor_id in enumerate(order, start=1):
+        base += loads[doctor_id]
+        level = (base + total) // k
+        if k == len(order) or level <= loads[order[k]]:
+            break
+
+    filled = order[:k]
+    quotas = {doctor_id: level - loads[doctor_id] for doctor_id in filled}
+    for doctor_id in filled[:total - sum(quotas.values())]:
+        quotas[doctor_id] += 1
+    return {doctor_id: quotas.get(doctor_id, 0) for doctor_id in loads}
+
+def even_quotas(total, loads):
+    """Split ``total`` patients equally, ignoring the targets' current panels."""
+    share, extra = divmod(total, len(loads))
+    return {doctor_id: share + (1 if i < extra else 0) for i, doctor_id in enumerate(sorted(loads))}
+
+STRATEGIES = {
+    'balance': balanced_quotas,
+    'even': even_quotas,
+}
+
+def plan_reassignment(source_id, target_ids, strategy='balance'):
+    """How many of ``source_id``'s patients each target takes; two aggregate queries."""
+    total = db.session.query(func.count(Patient.id)).filter(Patient.doctor_id == source_id).scalar()
+    loads = dict.fromkeys(target_ids, 0)
+    loads.update(db.session.query(Patient.doctor_id, func.count(Patient.id))
+                 .filter(Patient.doctor_id.in_(target_ids)).group_by(Patient.doctor_id))
+    return total, STRATEGIES[strategy](total, loads)
+
+def move_patients(source_id, target_id, count, chunk_size):
+    """Move up to ``count`` patients to ``target_id`` with chunked UPDATEs, one commit each.
+
+    No patient rows are loaded: every chunk is a single
+    UPDATE ... WHERE id IN (SELECT id ... LIMIT n). Yields rows moved per chunk.
+    """
+    patients = Patient.__table__
+    moved = 0
+    while moved < count:
+        chunk = select(patients.c.id).where(patients.c.doctor_id == source_id) \
+            .limit(min(chunk_size, count - moved)).scalar_subquery()
+        result = db.session.execute(update(patients).where(patients.c.id.in_(chunk))
+                                    .values(doctor_id=target_id, updated_at=datetime.utcnow()))
+        db.session.commit()
+        if not result.rowcount:
+            return
+        moved += result.rowcount
+        yield result.rowcount
@@ -0,0 +1,93 @@
+import base64
+import json
+from datetime import date, datetime
+from flask import current_app, request, jsonify
+from sqlalchemy import tuple_
+
+class CursorError(ValueError):
+    pass
+
+def encode_cursor(values):
+    """Turn the sort key of the last row into an opaque, url-safe token."""
+    raw = json.dumps(list(values), separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _cursor_value(column, value):
+    # A forged cursor must not reach the row-value comparison with a value of the wrong type
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = str
+    if python_type is int:
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise CursorError('Invalid cursor')
+        return value
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise CursorError('Invalid cursor')
+    if python_type in (date, datetime):
+        try:
+            return python_type.fromisoformat(value)
+        except ValueError:
+            raise CursorError('Invalid cursor')
+    return value
+
+def decode_cursor(cursor, columns):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise CursorError('Invalid cursor')
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise CursorError('Invalid cursor')
+    return [_cursor_value(column, value) for column, value in zip(columns, values)]
+
+def get_page_limit():
+    """Read ?limit= and clamp it to the server-side maximum."""
+    limit = request.args.get('limit', current_app.config['PAGE_SIZE_DEFAULT'], type=int)
+    if limit < 1:
+        raise CursorError('limit must be a positive integer')
+    return min(limit, current_app.config['PAGE_SIZE_MAX'])
+
+def page_query(query, columns, limit, cursor=None):
+    """Add the keyset WHERE, ORDER BY and LIMIT to a Query or Core select().
+
+    One row more than ``limit`` is asked for, to tell whether a next page exists.
+    """
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        query = query.filter(tuple_(*columns) > tuple_(*values))
+    return query.order_by(*columns).limit(limit + 1)
+
+def split_page(rows, columns, limit):
+    """Trim the extra row fetched by page_query and build the cursor from the last one kept."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, column.key) for column in columns)
+    return rows, next_cursor
+
+def paginate(query, columns, limit, cursor=None):
+    """Fetch one page of ``query`` ordered by ``columns`` (the last one must be unique).
+
+    The position is carried in the cursor and applied as a WHERE clause on
+    the sort key, so every page costs the same no matter how deep it is.
+    Returns the rows and the cursor for the next page (None on the last page).
+    """
+    return split_page(page_query(query, columns, limit, cursor).all(), columns, limit)
+
+def page_response(items, next_cursor):
+    """Body stays a plain JSON array; the next page is advertised in a header.
+
+    ``items`` may also be an already-encoded JSON body (bytes), which is sent as is.
+    """
+    if isinstance(items, bytes):
+        response = current_app.response_class(items, mimetype='application/json')
+    else:
+        response = jsonify(items)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
@@ -0,0 +1,104 @@
+import asyncio
+import bcrypt
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+# bcrypt only reads the first 72 bytes of a password, and bcrypt 5 raises on longer ones
+MAX_PASSWORD_BYTES = 72
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool and its queue are full; answered with 503 and Retry-After."""
+
+class PasswordHasher:
+    """Runs bcrypt on a small dedicated pool instead of the request thread.
+
+    bcrypt releases the GIL while hashing, so threads are enough; the pool
+    size caps how many cores a burst of logins can take from other requests.
+    At most ``queue_size`` hashes wait for a pool thread. Beyond that,
+    PasswordHasherBusy is raised at once, so a burst cannot stretch every
+    login behind an unbounded backlog. With ``workers=0`` hashing runs
+    inline on the calling thread.
+    """
+
+    def __init__(self, rounds=12, workers=2, queue_size=8):
+        self.rounds = rounds
+        self.rejected = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt') if workers else None
+        self._slots = threading.BoundedSemaphore(workers + queue_size) if workers else None
+
+    def _submit(self, f, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PasswordHasherBusy()
+
+        def run():
+            # Freed before the caller sees the result, so its next call finds the slot
+            try:
+                return f(*args)
+            finally:
+                self._slots.release()
+
+        try:
+            return self._pool.submit(run)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _run(self, f, *args):
+        if self._pool is None:
+            return f(*args)
+        return self._submit(f, *args).result()
+
+    async def _run_async(self, f, *args):
+        if self._pool is None:
+            return f(*args)
+        return await asyncio.wrap_future(self._submit(f, *args))
+
+    def hash(self, password):
+        salt = bcrypt.gensalt(self.rounds)
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def verify(self, password, password_hash):
+        try:
+            return self._run(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+        except ValueError:
+            return False
+
+    async def hash_async(self, password):
+        """hash() for coroutines: awaits the pool instead of blocking the event loop."""
+        salt = bcrypt.gensalt(self.rounds)
+        return (await self._run_async(bcrypt.hashpw, password.encode('utf-8'), salt)).decode('utf-8')
+
+    async def verify_async(self, password, password_hash):
+        try:
+            return await self._run_async(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+        except ValueError:
+            return False
+
+    def needs_rehash(self, password_hash):
+        """True when the stored hash was made with a different cost than configured."""
+        try:
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+def password_error(password):
+    """Why ``password`` cannot be hashed, or None if it can."""
+    if not isinstance(password, str):
+        return 'password must be a string'
+    if len(password.encode('utf-8')) > MAX_PASSWORD_BYTES:
+        return f'password must be at most {MAX_PASSWORD_BYTES} bytes'
+    return None
+
+def get_password_hasher():
+    hasher = current_app.extensions.get('password_hasher')
+    if hasher is None:
+        hasher = current_app.extensions['password_hasher'] = PasswordHasher(
+            current_app.config['BCRYPT_LOG_ROUNDS'], current_app.config['BCRYPT_WORKERS'],
+            current_app.config['BCRYPT_QUEUE_SIZE'])
+    return hasher
@@ -0,0 +1,32 @@
+from flask import current_app
+from cache import TTLCache
+from models import db, Doctor
+
+def get_principal_cache():
+    cache = current_app.extensions.get('principal_cache')
+    if cache is None:
+        # invalidate_principal() only reaches this process, so with several a cache of size 0 keeps nothing
+        size = 0 if current_app.config['MULTI_PROCESS'] else current_app.config['PRINCIPAL_CACHE_SIZE']
+        cache = current_app.extensions['principal_cache'] = TTLCache(size, current_app.config['PRINCIPAL_CACHE_TTL'])
+    return cache
+
+def load_principal(doctor_id):
+    """Flask-Login user loader backed by a per-process cache of detached doctors.
+
+    Each request gets its own session-bound copy (merge with load=False issues
+    no SQL), so commits in one request never expire the cached snapshot.
+    Under MULTI_PROCESS nothing is cached and every request loads the doctor.
+    """
+    cache = get_principal_cache()
+    doctor = cache.get(doctor_id)
+    if doctor is None:
+        doctor = db.session.get(Doctor, doctor_id)
+        if doctor is None:
+            return None
+        db.session.expunge(doctor)
+        cache.set(doctor_id, doctor)
+    return db.session.merge(doctor, load=False)
+
+def invalidate_principal(doctor_id):
+    """Call whenever a doctor's profile, password or active flag changes (reaches this process only)."""
+    get_principal_cache().delete(doctor_id)
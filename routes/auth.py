@@ -1,9 +1,11 @@
 from flask import Blueprint, request, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
 from models import db, Doctor
-from flask_bcrypt import check_password_hash
+from principals import invalidate_principal
+from passwords import PasswordHasherBusy, password_error
+from cache import get_response_cache
+from tokens import TokenPrincipal, bearer_token, get_token_store, issue_token, verify_token
 import jwt
-import datetime
 from functools import wraps
 
 auth_bp = Blueprint('auth', __name__)
@@ -11,21 +13,20 @@ auth_bp = Blueprint('auth', __name__)
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
+        token = bearer_token(request.headers)
         
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         
+        # The principal is rebuilt from the token claims, so no DB lookup is needed
         try:
-            # Remove 'Bearer ' prefix if present
-            if token.startswith('Bearer '):
-                token = token[7:]
-            
-            data = jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=["HS256"])
-            current_user = Doctor.query.get(data['user_id'])
-        except:
+            current_user = TokenPrincipal(verify_token(token))
+        except jwt.InvalidTokenError:
             return jsonify({'message': 'Token is invalid!'}), 401
         
+        if not current_user.is_active:
+            return jsonify({'message': 'Account is deactivated'}), 401
+        
         return f(current_user, *args, **kwargs)
     
     return decorated
@@ -41,6 +42,10 @@ def register():
     if Doctor.query.filter_by(license_number=data['license_number']).first():
         return jsonify({'message': 'Doctor already exists with this license number'}), 400
     
+    error = password_error(data['password'])
+    if error:
+        return jsonify({'message': error}), 400
+    
     # Create new doctor
     doctor = Doctor(
         first_name=data['first_name'],
@@ -55,6 +60,7 @@ def register():
     
     db.session.add(doctor)
     db.session.commit()
+    get_response_cache('doctors').invalidate()
     
     return jsonify({
         'message': 'Doctor registered successfully',
@@ -72,11 +78,19 @@ def login():
     if not doctor.is_active:
         return jsonify({'message': 'Account is deactivated'}), 401
     
+    # Upgrade hashes made with an old cost factor while we have the plain password
+    # (skipped when the hashing pool is saturated; the next login tries again)
+    if doctor.password_needs_rehash():
+        try:
+            doctor.set_password(data['password'])
+        except PasswordHasherBusy:
+            pass
+        else:
+            db.session.commit()
+            invalidate_principal(doctor.id)
+    
     # Generate JWT token
-    token = jwt.encode({
-        'user_id': doctor.id,
-        'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)
-    }, current_app.config['JWT_SECRET_KEY'])
+    token = issue_token(doctor)
     
     login_user(doctor)
     
@@ -89,10 +103,27 @@ def login():
 @auth_bp.route('/logout', methods=['POST'])
 @login_required
 def logout():
+    # Revoke the bearer token too, if the client sent one
+    token = bearer_token(request.headers)
+    if token:
+        try:
+            get_token_store().revoke_token(verify_token(token))
+        except jwt.InvalidTokenError:
+            pass
+    
     logout_user()
     return jsonify({'message': 'Logout successful'}), 200
 
 @auth_bp.route('/me', methods=['GET'])
 @login_required
 def get_current_user():
-    return jsonify(current_user.to_dict()), 200
\ No newline at end of file
+    return jsonify(current_user.to_dict()), 200
+
+@auth_bp.route('/token', methods=['GET'])
+@token_required
+def get_token_info(principal):
+    return jsonify({
+        'user_id': principal.id,
+        'role': principal.role,
+        'exp': principal.claims['exp']
+    }), 200
@@ -1,7 +1,21 @@
-from flask import Blueprint, request, jsonify
-from flask_login import login_required
-from models import db, Doctor
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from flask_login import login_required, current_user
+from models import db, Doctor, Patient
+from pagination import CursorError, get_page_limit, paginate, page_response
+from tokens import get_token_store
+from principals import invalidate_principal
+from passwords import password_error
+from conditional import add_validators, make_etag, not_modified
+from cache import cached_response, get_response_cache
+from fieldsets import FieldsError, load_fields, requested_fields
+from serializers import get_layout
+from batch import BatchError, batch_results, parse_ids
+from offboarding import STRATEGIES, move_patients, plan_reassignment
+from groupcommit import save
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import func
 from functools import wraps
+import json
 
 doctors_bp = Blueprint('doctors', __name__)
 
@@ -16,14 +30,91 @@ def admin_required(f):
 @doctors_bp.route('/', methods=['GET'])
 @login_required
 def get_doctors():
-    doctors = Doctor.query.filter_by(is_active=True).all()
-    return jsonify([doctor.to_dict() for doctor in doctors]), 200
+    cache = get_response_cache('doctors')
+    key = cache.key('list?' + request.query_string.decode())
+    entry = cache.get(key)
+    if entry:
+        return cached_response(entry, request)
+    
+    try:
+        fields = requested_fields(Doctor.SERIALIZED_FIELDS)
+    except FieldsError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    query = Doctor.query.filter_by(is_active=True)
+    
+    # Validate the cached copy from a cheap aggregate before loading any rows. No Last-Modified:
+    # a doctor leaving the directory changes the count but not max(updated_at)
+    last_modified, count = query.with_entities(func.max(Doctor.updated_at), func.count(Doctor.id)).one()
+    etag = make_etag('doctors', last_modified, count, sorted(request.args.items()))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    # The fast path selects plain row tuples and encodes them in one pass, skipping the ORM
+    fast = current_app.config['FAST_SERIALIZATION']
+    if fast:
+        layout = get_layout(Doctor, fields)
+        query = layout.select(query)
+    elif fields is not None:
+        query = query.options(load_fields(Doctor, fields))
+    
+    # Keyset pagination on id
+    try:
+        doctors, next_cursor = paginate(query, (Doctor.id,),
+                                        get_page_limit(), request.args.get('cursor'))
+    except CursorError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    body = layout.encode(doctors) if fast else [doctor.to_dict(fields) for doctor in doctors]
+    response = add_validators(page_response(body, next_cursor), etag)
+    cache.set(key, response)
+    return response, 200
 
 @doctors_bp.route('/<int:doctor_id>', methods=['GET'])
 @login_required
 def get_doctor(doctor_id):
-    doctor = Doctor.query.get_or_404(doctor_id)
-    return jsonify(doctor.to_dict()), 200
+    cache = get_response_cache('doctors')
+    key = cache.key(f'doctor/{doctor_id}?' + request.query_string.decode())
+    entry = cache.get(key)
+    if entry:
+        return cached_response(entry, request)
+    
+    try:
+        fields = requested_fields(Doctor.SERIALIZED_FIELDS)
+    except FieldsError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    query = Doctor.query
+    if fields is not None:
+        query = query.options(load_fields(Doctor, fields, 'updated_at'))
+    doctor = query.get_or_404(doctor_id)
+    
+    etag = make_etag('doctor', doctor.id, doctor.updated_at, fields)
+    cached = not_modified(etag, doctor.updated_at)
+    if cached:
+        return cached
+    
+    response = add_validators(jsonify(doctor.to_dict(fields)), etag, doctor.updated_at)
+    cache.set(key, response)
+    return response, 200
+
+@doctors_bp.route('/batch', methods=['POST'])
+@login_required
+def get_doctors_batch():
+    data = request.get_json(silent=True)
+    try:
+        ids = parse_ids(data.get('ids') if isinstance(data, dict) else None)
+        fields = requested_fields(Doctor.SERIALIZED_FIELDS)
+    except (BatchError, FieldsError) as e:
+        return jsonify({'message': str(e)}), 400
+    
+    # Single IN query; like get_doctor, inactive doctors are still returned
+    query = Doctor.query.filter(Doctor.id.in_(ids))
+    if fields is not None:
+        query = query.options(load_fields(Doctor, fields))
+    found = {doctor.id: doctor.to_dict(fields) for doctor in query}
+    return jsonify({'results': batch_results(ids, found, 'doctor')}), 200
 
 @doctors_bp.route('/<int:doctor_id>', methods=['PUT'])
 @login_required
@@ -31,6 +122,11 @@ def update_doctor(doctor_id):
     doctor = Doctor.query.get_or_404(doctor_id)
     data = request.get_json()
     
+    if 'password' in data:
+        error = password_error(data['password'])
+        if error:
+            return jsonify({'message': error}), 400
+    
     # Update fields
     if 'first_name' in data:
         doctor.first_name = data['first_name']
@@ -43,19 +139,97 @@ def update_doctor(doctor_id):
     if 'password' in data:
         doctor.set_password(data['password'])
     
-    db.session.commit()
+    doctor_data = save(doctor)
+    invalidate_principal(doctor.id)
+    get_response_cache('doctors').invalidate()
     
     return jsonify({
         'message': 'Doctor updated successfully',
-        'doctor': doctor.to_dict()
+        'doctor': doctor_data
     }), 200
 
+def deactivate_doctor(doctor):
+    doctor.is_active = False
+    save(doctor)
+    invalidate_principal(doctor.id)
+    get_response_cache('doctors').invalidate()
+    
+    # Tokens already handed out would otherwise stay valid until they expire
+    get_token_store().revoke_user(doctor.id)
+
 @doctors_bp.route('/<int:doctor_id>', methods=['DELETE'])
 @login_required
 @admin_required
 def delete_doctor(doctor_id):
     doctor = Doctor.query.get_or_404(doctor_id)
-    doctor.is_active = False
-    db.session.commit()
+    deactivate_doctor(doctor)
+    
+    return jsonify({'message': 'Doctor deactivated successfully'}), 200
+
+@doctors_bp.route('/<int:doctor_id>/reassign', methods=['POST'])
+@login_required
+def reassign_patients(doctor_id):
+    """Move a doctor's whole panel to one colleague or spread it over several.
+    
+    Body: {"to": 7} or {"to": [7, 8, 9], "strategy": "balance" | "even", "deactivate": true}.
+    Only the doctor themselves or an admin may do this. Validation and planning
+    happen before the response starts, so bad input still gets a 4xx. After that
+    the status is 200 and the body streams one NDJSON progress line per chunk,
+    then a {"done": true, ...} summary. If a chunk fails, the stream ends with an
+    {"error": ...} line instead; clients must check the last line.
+    """
+    source = Doctor.query.get_or_404(doctor_id)
+    
+    # Taking a colleague's panel (and deactivating them) is not something any doctor may do
+    if source.id != current_user.id and not getattr(current_user, 'is_admin', False):
+        return jsonify({'message': 'Access denied'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    
+    target_ids = data.get('to')
+    if isinstance(target_ids, int) and not isinstance(target_ids, bool):
+        target_ids = [target_ids]
+    if not isinstance(target_ids, list) or not target_ids or \
+            not all(isinstance(t, int) and not isinstance(t, bool) for t in target_ids):
+        return jsonify({'message': 'to must be a doctor id or a non-empty list of doctor ids'}), 400
+    target_ids = list(dict.fromkeys(target_ids))
+    if source.id in target_ids:
+        return jsonify({'message': 'Cannot reassign patients to the same doctor'}), 400
+    
+    strategy = data.get('strategy', 'balance')
+    if strategy not in STRATEGIES:
+        return jsonify({'message': 'strategy must be one of: ' + ', '.join(STRATEGIES)}), 400
+    
+    active = {doctor_id for doctor_id, in db.session.query(Doctor.id)
+              .filter(Doctor.id.in_(target_ids), Doctor.is_active == True)}
+    missing = [target for target in target_ids if target not in active]
+    if missing:
+        return jsonify({'message': 'Doctor not found or inactive: ' + ', '.join(map(str, missing))}), 404
+    
+    total, quotas = plan_reassignment(source.id, target_ids, strategy)
+    chunk_size = current_app.config['REASSIGN_CHUNK_SIZE']
+    
+    def progress():
+        moved = {target: 0 for target in quotas}
+        try:
+            for target, quota in quotas.items():
+                for count in move_patients(doctor_id, target, quota, chunk_size):
+                    moved[target] += count
+                    yield json.dumps({'to': target, 'moved': moved[target],
+                                      'total_moved': sum(moved.values()), 'total': total}) + '\n'
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            yield json.dumps({'error': str(getattr(e, 'orig', None) or e),
+                              'total_moved': sum(moved.values())}) + '\n'
+            return
+        
+        # Patients created for the source while the move ran are left for another pass
+        remaining = Patient.query.filter_by(doctor_id=doctor_id).count()
+        deactivated = bool(data.get('deactivate')) and remaining == 0
+        if deactivated:
+            deactivate_doctor(source)
+        yield json.dumps({'done': True, 'total_moved': sum(moved.values()), 'remaining': remaining,
+                          'assignments': {str(target): count for target, count in moved.items()},
+                          'deactivated': deactivated}) + '\n'
     
-    return jsonify({'message': 'Doctor deactivated successfully'}), 200
\ No newline at end of file
+    return Response(stream_with_context(progress()), mimetype='application/x-ndjson')
@@ -1,32 +1,257 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 from flask_login import login_required, current_user
-from models import db, Patient, Doctor
+from models import db, Patient, Doctor, doctor_name_map, serialize_patients, serialize_value
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload
+from pagination import CursorError, get_page_limit, paginate, page_response
+from search import search_patients
+from conditional import PreconditionError, add_validators, if_match_versions, make_etag, make_versioned_etag, not_modified
+from fieldsets import FieldsError, load_fields, requested_fields
+from serializers import get_layout
+from batch import BatchError, batch_results, parse_ids
+from stats import census
+from changes import ChangesError, changes_since, parse_since
+from groupcommit import commit_write, delete, save
+from audit import audit, audit_stream
+from sqlalchemy import exists, func, or_, select, update
 from datetime import datetime
+import csv
+import io
+import json
 
 patients_bp = Blueprint('patients', __name__)
 
+def visible_patients():
+    """Patients the current user may list, plus a doctor-name map when it is known up front."""
+    # If doctor, get only their patients
+    # If admin, get all patients
+    if hasattr(current_user, 'is_admin') and current_user.is_admin:
+        return Patient.query, None
+    return Patient.query.filter_by(doctor_id=current_user.id), {current_user.id: current_user.full_name}
+
 @patients_bp.route('/', methods=['GET'])
 @login_required
 def get_patients():
-    # If doctor, get only their patients
-    # If admin, get all patients
+    query, doctor_names = visible_patients()
+    
+    # Full schema by default; ?fields= leaves columns (the large Text ones included) unread and unsent
+    try:
+        fields = requested_fields(Patient.SERIALIZED_FIELDS)
+    except FieldsError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    # Validate the cached copy from a cheap aggregate before loading any rows. No Last-Modified:
+    # a delete changes the count but not max(updated_at), so only the ETag can tell
+    last_modified, count = query.with_entities(func.max(Patient.updated_at), func.count(Patient.id)).one()
+    if doctor_names is None:
+        names_version = db.session.query(func.max(Doctor.updated_at)).scalar()
+    else:
+        names_version = current_user.updated_at
+    etag = make_etag('patients', last_modified, count, names_version, sorted(request.args.items()))
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    # The fast path selects plain row tuples and encodes them in one pass, skipping the ORM
+    fast = current_app.config['FAST_SERIALIZATION']
+    if fast:
+        layout = get_layout(Patient, fields)
+        query = layout.select(query)
+    elif fields is not None:
+        query = query.options(load_fields(Patient, fields, 'last_name', 'doctor_id'))
+    
+    # Keyset pagination on (last_name, id)
+    try:
+        patients, next_cursor = paginate(query, (Patient.last_name, Patient.id),
+                                         get_page_limit(), request.args.get('cursor'))
+    except CursorError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    audit('list', [patient.id for patient in patients])
+    body = layout.encode(patients) if fast else serialize_patients(patients, doctor_names, fields)
+    response = page_response(body, next_cursor)
+    return add_validators(response, etag), 200
+
+def iter_patient_rows(query, doctor_names):
+    """Yield serialized patients in id order, holding one batch in memory at a time."""
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    statement = query.order_by(Patient.id).statement.execution_options(yield_per=batch_size)
+    
+    for batch in db.session.execute(statement).scalars().partitions():
+        names = doctor_names
+        if names is None:
+            names = doctor_name_map(patient.doctor_id for patient in batch)
+        for patient in batch:
+            yield patient.to_dict(doctor_name=names.get(patient.doctor_id))
+        # Drop the batch from the identity map so memory stays flat
+        for patient in batch:
+            db.session.expunge(patient)
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, separators=(',', ':')) + '\n'
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=Patient.SERIALIZED_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'csv': (csv_lines, 'text/csv'),
+}
+
+@patients_bp.route('/export', methods=['GET'])
+@login_required
+def export_patients():
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'message': 'format must be one of: ' + ', '.join(EXPORT_FORMATS)}), 400
+    
+    encode, mimetype = EXPORT_FORMATS[export_format]
+    query, doctor_names = visible_patients()
+    
+    # Audited as the rows go out: after_request runs before the body is streamed
+    rows = audit_stream('export', iter_patient_rows(query, doctor_names), current_app.config['EXPORT_BATCH_SIZE'])
+    response = Response(stream_with_context(encode(rows)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=patients.{export_format}'
+    return response
+
+@patients_bp.route('/search', methods=['GET'])
+@login_required
+def find_patients():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify({'message': 'q is required'}), 400
+    
+    try:
+        limit = get_page_limit()
+    except CursorError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    # Same ownership scoping as get_patient: doctors only see their own patients
+    if hasattr(current_user, 'is_admin') and current_user.is_admin:
+        patients = search_patients(q, limit)
+        doctor_names = None
+    else:
+        patients = search_patients(q, limit, doctor_id=current_user.id)
+        doctor_names = {current_user.id: current_user.full_name}
+    
+    audit('search', [patient.id for patient in patients])
+    return jsonify(serialize_patients(patients, doctor_names)), 200
+
+@patients_bp.route('/stats', methods=['GET'])
+@login_required
+def get_patient_stats():
+    # Counters are kept current by triggers, so this never scans patients
+    if hasattr(current_user, 'is_admin') and current_user.is_admin:
+        return jsonify(census()), 200
+    return jsonify(census(current_user.id)), 200
+
+@patients_bp.route('/changes', methods=['GET'])
+@login_required
+def get_patient_changes():
+    try:
+        since = parse_since(request.args.get('since'))
+        limit = get_page_limit()
+        fields = requested_fields(Patient.SERIALIZED_FIELDS)
+    except (ChangesError, CursorError, FieldsError) as e:
+        return jsonify({'message': str(e)}), 400
+    
+    admin = hasattr(current_user, 'is_admin') and current_user.is_admin
+    rows, has_more = changes_since(since, limit, None if admin else current_user.id)
+    
+    # Current state of the changed patients in one IN query; a row gone by now reads as deleted
+    live_ids = [row.patient_id for row in rows if not row.deleted]
+    query = Patient.query.filter(Patient.id.in_(live_ids))
+    if not admin:
+        query = query.filter_by(doctor_id=current_user.id)
+    if fields is not None:
+        query = query.options(load_fields(Patient, fields, 'doctor_id'))
+    patients = query.all() if live_ids else []
+    doctor_names = None if admin else {current_user.id: current_user.full_name}
+    found = {patient.id: data for patient, data in
+             zip(patients, serialize_patients(patients, doctor_names, fields))}
+    
+    changes = []
+    for row in rows:
+        if row.patient_id in found and not row.deleted:
+            changes.append({'seq': row.seq, 'id': row.patient_id, 'deleted': False,
+                            'patient': found[row.patient_id]})
+        else:
+            changes.append({'seq': row.seq, 'id': row.patient_id, 'deleted': True})
+    
+    audit('changes', list(found))
+    return jsonify({
+        'changes': changes,
+        'since': rows[-1].seq if rows else since,
+        'has_more': has_more
+    }), 200
+
+@patients_bp.route('/batch', methods=['GET'])
+@login_required
+def get_patients_batch():
+    try:
+        ids = parse_ids(request.args.get('ids', '').split(',') if request.args.get('ids') else [])
+        fields = requested_fields(Patient.SERIALIZED_FIELDS)
+    except (BatchError, FieldsError) as e:
+        return jsonify({'message': str(e)}), 400
+    
+    # One IN query for the whole batch; ownership is checked on the rows it returns
+    query = Patient.query.filter(Patient.id.in_(ids))
+    if fields is not None:
+        query = query.options(load_fields(Patient, fields, 'doctor_id'))
+    
     if hasattr(current_user, 'is_admin') and current_user.is_admin:
-        patients = Patient.query.all()
+        allowed, forbidden = query.all(), set()
+        doctor_names = None
     else:
-        patients = Patient.query.filter_by(doctor_id=current_user.id).all()
+        allowed, forbidden = [], set()
+        for patient in query:
+            if patient.doctor_id == current_user.id:
+                allowed.append(patient)
+            else:
+                forbidden.add(patient.id)
+        doctor_names = {current_user.id: current_user.full_name}
     
-    return jsonify([patient.to_dict() for patient in patients]), 200
+    serialized = serialize_patients(allowed, doctor_names, fields)
+    found = {patient.id: data for patient, data in zip(allowed, serialized)}
+    audit('batch', list(found))
+    return jsonify({'results': batch_results(ids, found, 'patient', forbidden)}), 200
 
 @patients_bp.route('/<int:patient_id>', methods=['GET'])
 @login_required
 def get_patient(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    try:
+        fields = requested_fields(Patient.SERIALIZED_FIELDS)
+    except FieldsError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    query = Patient.query.options(joinedload(Patient.doctor))
+    if fields is not None:
+        query = query.options(load_fields(Patient, fields, 'doctor_id', 'updated_at'))
+    patient = query.get_or_404(patient_id)
+    audit('read', patient.id)
     
     # Check if current doctor owns this patient
     if patient.doctor_id != current_user.id and not (hasattr(current_user, 'is_admin') and current_user.is_admin):
         return jsonify({'message': 'Access denied'}), 403
     
-    return jsonify(patient.to_dict()), 200
+    # doctor_name is part of the payload, so the doctor's version goes into the ETag too. The
+    # patient's updated_at alone would miss a rename, so no Last-Modified
+    etag = make_versioned_etag(patient.updated_at, 'patient', patient.id, patient.updated_at, patient.doctor_id,
+                               patient.doctor.updated_at if patient.doctor else None, fields)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    
+    return add_validators(jsonify(patient.to_dict(fields=fields)), etag), 200
 
 @patients_bp.route('/', methods=['POST'])
 @login_required
@@ -57,18 +282,144 @@ def create_patient():
         doctor_id=doctor_id
     )
     
-    db.session.add(patient)
-    db.session.commit()
+    created = save(patient)
+    audit('create', created['id'])
     
     return jsonify({
         'message': 'Patient created successfully',
-        'patient': patient.to_dict()
+        'patient': created
     }), 201
 
+BULK_OPTIONAL_FIELDS = ('gender', 'phone', 'email', 'address', 'emergency_contact',
+                        'blood_type', 'allergies')
+
+def parse_bulk_row(data, doctor_ids):
+    """Validate one import record and turn it into an INSERT parameter dict."""
+    if not isinstance(data, dict):
+        raise ValueError('Record must be a JSON object')
+    
+    # A value SQLite cannot bind would fail the executemany for the whole chunk
+    for field in ('first_name', 'last_name', 'date_of_birth') + BULK_OPTIONAL_FIELDS:
+        if data.get(field) is not None and not isinstance(data[field], str):
+            raise ValueError(f'{field} must be a string')
+    
+    for field in ('first_name', 'last_name', 'date_of_birth'):
+        if not data.get(field):
+            raise ValueError(f'{field} is required')
+    
+    try:
+        dob = datetime.strptime(data['date_of_birth'], '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError('date_of_birth must be YYYY-MM-DD')
+    
+    doctor_id = data.get('doctor_id', current_user.id)
+    if not isinstance(doctor_id, int) or isinstance(doctor_id, bool):
+        raise ValueError('doctor_id must be an integer')
+    if doctor_id not in doctor_ids:
+        raise ValueError('Doctor not found')
+    
+    row = {field: data.get(field) for field in BULK_OPTIONAL_FIELDS}
+    row.update(first_name=data['first_name'], last_name=data['last_name'],
+               date_of_birth=dob, doctor_id=doctor_id)
+    return row
+
+def iter_bulk_records():
+    """Yield import records from a JSON array body or, line by line, from an NDJSON stream."""
+    if request.mimetype == 'application/x-ndjson':
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield line  # reported as a row error rather than failing the whole load
+        return
+    
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON array or an application/x-ndjson body')
+    yield from data
+
+def bulk_error_message(e):
+    return str(e.orig) if getattr(e, 'orig', None) else str(e)
+
+def insert_chunk(chunk, result):
+    """Insert one chunk with a single executemany and commit it as its own transaction.
+
+    If the executemany fails, the chunk is retried a row at a time, each row
+    in a SAVEPOINT, so only the rows at fault are reported.
+    """
+    statement = Patient.__table__.insert()
+    try:
+        db.session.execute(statement, [row for _, row in chunk])
+        db.session.commit()
+        result['inserted'] += len(chunk)
+        return
+    except SQLAlchemyError:
+        db.session.rollback()
+    
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite':
+        # pysqlite only emits BEGIN before DML, and releasing an outermost
+        # SAVEPOINT would commit each row on its own
+        connection.exec_driver_sql('BEGIN')
+    inserted = []
+    for index, row in chunk:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(statement, [row])
+            inserted.append(index)
+        except SQLAlchemyError as e:
+            result['errors'].append({'row': index, 'message': bulk_error_message(e)})
+    
+    try:
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        result['errors'].extend({'row': index, 'message': bulk_error_message(e)} for index in inserted)
+        return
+    result['inserted'] += len(inserted)
+
+@patients_bp.route('/bulk', methods=['POST'])
+@login_required
+def bulk_create_patients():
+    chunk_size = current_app.config['BULK_IMPORT_CHUNK_SIZE']
+    
+    # One query for every valid doctor id instead of a lookup per row
+    doctor_ids = {doctor_id for doctor_id, in db.session.query(Doctor.id)}
+    
+    result = {'inserted': 0, 'errors': []}
+    chunk = []
+    try:
+        for index, data in enumerate(iter_bulk_records()):
+            try:
+                chunk.append((index, parse_bulk_row(data, doctor_ids)))
+            except ValueError as e:
+                result['errors'].append({'row': index, 'message': str(e)})
+                continue
+            
+            if len(chunk) >= chunk_size:
+                insert_chunk(chunk, result)
+                chunk = []
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    if chunk:
+        insert_chunk(chunk, result)
+    
+    return jsonify({
+        'message': 'Bulk import finished',
+        'inserted': result['inserted'],
+        'failed': len(result['errors']),
+        'errors': result['errors']
+    }), 200
+
 @patients_bp.route('/<int:patient_id>', methods=['PUT'])
 @login_required
 def update_patient(patient_id):
     patient = Patient.query.get_or_404(patient_id)
+    audit('update', patient.id)
     
     # Check if current doctor owns this patient
     if patient.doctor_id != current_user.id and not (hasattr(current_user, 'is_admin') and current_user.is_admin):
@@ -76,6 +427,10 @@ def update_patient(patient_id):
     
     data = request.get_json()
     
+    # Verify new doctor exists before touching the patient, so the lookup cannot autoflush it
+    if 'doctor_id' in data and not Doctor.query.get(data['doctor_id']):
+        return jsonify({'message': 'Doctor not found'}), 404
+    
     # Update fields
     if 'first_name' in data:
         patient.first_name = data['first_name']
@@ -98,30 +453,125 @@ def update_patient(patient_id):
     if 'allergies' in data:
         patient.allergies = data['allergies']
     if 'doctor_id' in data:
-        # Verify new doctor exists
-        doctor = Doctor.query.get(data['doctor_id'])
-        if not doctor:
-            return jsonify({'message': 'Doctor not found'}), 404
         patient.doctor_id = data['doctor_id']
     
     patient.updated_at = datetime.utcnow()
-    db.session.commit()
     
     return jsonify({
         'message': 'Patient updated successfully',
-        'patient': patient.to_dict()
+        'patient': save(patient)
     }), 200
 
+# Columns a PATCH may set; NOT NULL ones cannot be cleared
+PATCHABLE_FIELDS = ('first_name', 'last_name', 'date_of_birth', 'gender', 'phone', 'email', 'address',
+                    'emergency_contact', 'blood_type', 'allergies', 'doctor_id')
+
+REQUIRED_FIELDS = ('first_name', 'last_name', 'date_of_birth', 'doctor_id')
+
+def parse_patch(data):
+    """Validate a PATCH body into column values plus the optional ``updated_at`` precondition."""
+    if not isinstance(data, dict):
+        raise ValueError('Expected a JSON object')
+    
+    unknown = set(data) - set(PATCHABLE_FIELDS) - {'updated_at'}
+    if unknown:
+        raise ValueError('Unknown fields: ' + ', '.join(sorted(unknown)))
+    
+    values = {field: data[field] for field in PATCHABLE_FIELDS if field in data}
+    if not values:
+        raise ValueError('No fields to update')
+    for field in REQUIRED_FIELDS:
+        if field in values and values[field] in (None, ''):
+            raise ValueError(f'{field} cannot be empty')
+    for field in PATCHABLE_FIELDS:
+        if field not in ('date_of_birth', 'doctor_id') and values.get(field) is not None \
+                and not isinstance(values[field], str):
+            raise ValueError(f'{field} must be a string')
+    
+    if 'date_of_birth' in values:
+        try:
+            values['date_of_birth'] = datetime.strptime(values['date_of_birth'], '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            raise ValueError('date_of_birth must be YYYY-MM-DD')
+    if 'doctor_id' in values and (isinstance(values['doctor_id'], bool) or not isinstance(values['doctor_id'], int)):
+        raise ValueError('doctor_id must be an integer')
+    
+    version = None
+    if data.get('updated_at') is not None:
+        try:
+            version = datetime.fromisoformat(data['updated_at'])
+        except (TypeError, ValueError):
+            raise ValueError('updated_at must be an ISO 8601 timestamp')
+    return values, version
+
+def patch_failure(patient_id, values):
+    """Explain why the conditional UPDATE matched no row; only runs when it did not."""
+    current = db.session.query(Patient.doctor_id).filter_by(id=patient_id).first()
+    if current is None:
+        return jsonify({'message': 'Resource not found'}), 404
+    if current.doctor_id != current_user.id and not (hasattr(current_user, 'is_admin') and current_user.is_admin):
+        return jsonify({'message': 'Access denied'}), 403
+    if 'doctor_id' in values and db.session.get(Doctor, values['doctor_id']) is None:
+        return jsonify({'message': 'Doctor not found'}), 404
+    return jsonify({'message': 'Patient was modified by another request; reload and retry'}), 409
+
+@patients_bp.route('/<int:patient_id>', methods=['PATCH'])
+@login_required
+def patch_patient(patient_id):
+    audit('update', patient_id)
+    try:
+        values, version = parse_patch(request.get_json(silent=True))
+        versions = if_match_versions()
+    except PreconditionError as e:
+        return jsonify({'message': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    
+    # If-Match wins; otherwise the updated_at the client last saw, if it sent one
+    if versions is None and version is not None:
+        versions = [version]
+    
+    # Ownership, the version check and the new doctor's existence all go into the
+    # WHERE clause, so the edit is one round-trip and contended edits cannot both win
+    patients, doctors = Patient.__table__, Doctor.__table__
+    conditions = [patients.c.id == patient_id]
+    if not (hasattr(current_user, 'is_admin') and current_user.is_admin):
+        conditions.append(patients.c.doctor_id == current_user.id)
+    if versions is not None:
+        conditions.append(or_(*[patients.c.updated_at == v if v else patients.c.updated_at.is_(None)
+                                for v in versions]))
+    if 'doctor_id' in values:
+        conditions.append(exists().where(doctors.c.id == values['doctor_id']))
+    
+    doctor = doctors.c.id == patients.c.doctor_id
+    statement = update(patients).where(*conditions).values(updated_at=datetime.utcnow(), **values).returning(
+        *patients.c,
+        select(doctors.c.first_name + ' ' + doctors.c.last_name).where(doctor).scalar_subquery().label('doctor_name'),
+        select(doctors.c.updated_at).where(doctor).scalar_subquery().label('doctor_updated_at'))
+    
+    row = commit_write(lambda: db.session.execute(statement).first())
+    if row is None:
+        return patch_failure(patient_id, values)
+    
+    patient = {field: serialize_value(row._mapping[field]) for field in Patient.SERIALIZED_FIELDS}
+    etag = make_versioned_etag(row.updated_at, 'patient', row.id, row.updated_at, row.doctor_id,
+                               row.doctor_updated_at, None)
+    response = jsonify({
+        'message': 'Patient updated successfully',
+        'patient': patient
+    })
+    return add_validators(response, etag), 200
+
 @patients_bp.route('/<int:patient_id>', methods=['DELETE'])
 @login_required
 def delete_patient(patient_id):
     patient = Patient.query.get_or_404(patient_id)
+    audit('delete', patient.id)
     
     # Check if current doctor owns this patient
     if patient.doctor_id != current_user.id and not (hasattr(current_user, 'is_admin') and current_user.is_admin):
         return jsonify({'message': 'Access denied'}), 403
     
-    db.session.delete(patient)
-    db.session.commit()
+    delete(patient)
     
     return jsonify({'message': 'Patient deleted successfully'}), 200
\ No newline at end of file
@@ -0,0 +1,80 @@
+import re
+from sqlalchemy import event, select, text
+from models import db, Patient
+
+# Indexed columns and their bm25 weights (name matches rank above allergy text)
+SEARCH_COLUMNS = (
+    ('first_name', 10.0),
+    ('last_name', 10.0),
+    ('phone', 5.0),
+    ('email', 5.0),
+    ('allergies', 1.0),
+)
+
+_columns = ', '.join(name for name, _ in SEARCH_COLUMNS)
+_new_values = ', '.join(f'new.{name}' for name, _ in SEARCH_COLUMNS)
+_old_values = ', '.join(f'old.{name}' for name, _ in SEARCH_COLUMNS)
+_weights = ', '.join(str(weight) for _, weight in SEARCH_COLUMNS)
+
+# External-content FTS5 table over patients, kept in sync by triggers so that
+# ORM writes and Core bulk inserts are both indexed
+SEARCH_DDL = (
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+        {_columns}, content='patients', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    f"""CREATE TRIGGER IF NOT EXISTS patients_fts_ai AFTER INSERT ON patients BEGIN
+        INSERT INTO patients_fts(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patients_fts_ad AFTER DELETE ON patients BEGIN
+        INSERT INTO patients_fts(patients_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patients_fts_au AFTER UPDATE OF {_columns} ON patients BEGIN
+        INSERT INTO patients_fts(patients_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old_values});
+        INSERT INTO patients_fts(rowid, {_columns}) VALUES (new.id, {_new_values});
+    END""",
+)
+
+def create_search_index(connection):
+    """Create the FTS table and triggers if missing, backfilling existing patients."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'")).first()
+    for statement in SEARCH_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        connection.execute(text("INSERT INTO patients_fts(patients_fts) VALUES ('rebuild')"))
+
+@event.listens_for(Patient.__table__, 'after_create')
+def _create_search_index(target, connection, **kw):
+    create_search_index(connection)
+
+@event.listens_for(Patient.__table__, 'before_drop')
+def _drop_search_index(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DROP TABLE IF EXISTS patients_fts'))
+
+def build_match_query(q):
+    """Turn free text into an FTS5 query: every term must match, each as a prefix.
+
+    Terms are quoted so user input can never be parsed as FTS5 operators.
+    """
+    terms = [term.replace('"', '""') for term in re.split(r'\s+', q.strip()) if term]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search_patients(q, limit, doctor_id=None):
+    """Best-ranked patients matching ``q``, optionally restricted to one doctor."""
+    match = build_match_query(q)
+    if not match:
+        return []
+
+    sql = ('SELECT patients.* FROM patients_fts JOIN patients ON patients.id = patients_fts.rowid '
+           'WHERE patients_fts MATCH :match')
+    params = {'match': match, 'limit': limit}
+    if doctor_id is not None:
+        sql += ' AND patients.doctor_id = :doctor_id'
+        params['doctor_id'] = doctor_id
+    sql += f' ORDER BY bm25(patients_fts, {_weights}), patients.id LIMIT :limit'
+
+    return db.session.execute(select(Patient).from_statement(text(sql)), params).scalars().all()
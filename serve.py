@@ -0,0 +1,205 @@
+"""Production entry point: pre-forked worker processes sharing one preloaded app.
+
+    APP_CONFIG=production python serve.py --bind 0.0.0.0:8000 --workers 4
+
+The master imports and builds the app once, warms what is safe to share
+(URL map, serializer layouts) and forks; workers get those pages
+copy-on-write. Each worker opens and checks its own database connections
+before it starts accepting on the shared socket, so the first requests do
+not pay for connects and PRAGMAs. SIGTERM or SIGINT stops accepting, lets
+in-flight requests finish (up to SERVER_GRACEFUL_TIMEOUT) and exits; a
+worker that dies is replaced. Schema changes are not applied here: run
+`flask migrate` before starting. With more than one worker MULTI_PROCESS is
+set, which turns off the in-process caches that invalidations in one worker
+could not reach.
+"""
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+
+log = logging.getLogger('serve')
+
+def memory_usage():
+    """Resident and proportional set size in MB; PSS splits pages shared with the master and siblings."""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            sizes = {name: int(value.split()[0]) for name, _, value in (line.partition(':') for line in f)
+                     if name in ('Rss', 'Pss')}
+        return round(sizes['Rss'] / 1024, 1), round(sizes['Pss'] / 1024, 1)
+    except (OSError, KeyError):
+        import resource
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), None
+
+def engines(app):
+    from models import db
+    with app.app_context():
+        yield db.engine
+    if 'read_engine' in app.extensions:
+        yield app.extensions['read_engine']
+
+def preload(app):
+    """Warm-up done once in the master, before forking."""
+    from models import Doctor, Patient
+    from serializers import get_layout
+
+    app.url_map.bind('localhost').match('/')
+    get_layout(Patient)
+    get_layout(Doctor)
+
+    # Connections must not cross a fork: every worker opens its own
+    for engine in engines(app):
+        engine.dispose()
+
+def warm_connections(app):
+    """Fill each pool with checked connections (PRAGMAs run on connect)."""
+    for engine in engines(app):
+        size = engine.pool.size() if hasattr(engine.pool, 'size') else 1
+        connections = [engine.connect() for _ in range(size)]
+        for connection in connections:
+            connection.exec_driver_sql('SELECT 1')
+            connection.close()
+
+def run_worker(app, listener, master_started):
+    """Body of a forked worker; never returns."""
+    from werkzeug.serving import make_server
+
+    started = time.perf_counter()
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD, signal.SIGALRM):
+        signal.signal(signum, signal.SIG_DFL)
+    # Threads and their locks do not survive fork; workers build their own lazily
+    app.extensions.pop('password_hasher', None)
+    app.extensions.pop('group_commit', None)
+    app.extensions.pop('audit_log', None)
+
+    try:
+        warm_connections(app)
+        server = make_server(*listener.getsockname()[:2], app, threaded=True, fd=listener.fileno())
+    except Exception:
+        log.exception('worker failed to start')
+        os._exit(3)
+    # Non-daemon request threads are joined by server_close(), which is what drains the worker
+    server.daemon_threads = False
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    rss, pss = memory_usage()
+    log.info('worker ready in %.0f ms (%.0f ms after master start), rss %s MB, pss %s MB',
+             (time.perf_counter() - started) * 1000, (time.perf_counter() - master_started) * 1000,
+             rss, pss)
+
+    server.serve_forever()
+    server.server_close()
+    for name in ('group_commit', 'audit_log', 'password_hasher'):
+        if name in app.extensions:
+            app.extensions[name].shutdown()
+    for engine in engines(app):
+        engine.dispose()
+    log.info('worker drained')
+    os._exit(0)
+
+class PreforkServer:
+    """Forks ``workers`` processes over one listening socket and keeps them running."""
+
+    def __init__(self, app, listener, workers, graceful_timeout):
+        self.app = app
+        self.listener = listener
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.pids = set()
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.app, self.listener, STARTED)
+        self.pids.add(pid)
+
+    def stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        log.info('shutting down %d workers', len(self.pids))
+        self.signal_workers(signal.SIGTERM)
+        signal.alarm(self.graceful_timeout)
+
+    def kill(self, signum, frame):
+        log.warning('graceful timeout reached, killing %d workers', len(self.pids))
+        self.signal_workers(signal.SIGKILL)
+
+    def signal_workers(self, signum):
+        for pid in self.pids:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGALRM, self.kill)
+        for _ in range(self.workers):
+            self.spawn()
+
+        exit_code = 0
+        while self.pids:
+            pid, status = os.wait()
+            self.pids.discard(pid)
+            code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                continue
+            if code == 3:
+                # Failed during warm-up: a replacement would fail the same way
+                log.error('worker %d could not start, stopping', pid)
+                exit_code = 1
+                self.stop(None, None)
+            else:
+                log.warning('worker %d exited with %d, starting a new one', pid, code)
+                self.spawn()
+
+        self.listener.close()
+        log.info('stopped')
+        return exit_code
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', help='config name (default: $APP_CONFIG, then development)')
+    parser.add_argument('--bind', default='127.0.0.1:8000', help='host:port to listen on')
+    parser.add_argument('--workers', type=int, help='worker processes (default: SERVER_WORKERS, then one per CPU)')
+    parser.add_argument('--access-log', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(process)d] %(message)s')
+    if not args.access_log:
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    from app import create_app
+    app = create_app(args.config)
+    loaded = time.perf_counter()
+    preload(app)
+
+    host, _, port = args.bind.rpartition(':')
+    listener = socket.create_server((host, int(port)), backlog=2048)
+    workers = args.workers or app.config['SERVER_WORKERS'] or os.cpu_count()
+    if workers > 1:
+        app.config['MULTI_PROCESS'] = True
+    rss, _ = memory_usage()
+    log.info('app loaded in %.0f ms, preloaded in %.0f ms, rss %s MB; listening on %s with %d workers',
+             (loaded - STARTED) * 1000, (time.perf_counter() - loaded) * 1000, rss,
+             args.bind, workers)
+
+    server = PreforkServer(app, listener, workers, app.config['SERVER_GRACEFUL_TIMEOUT'])
+    raise SystemExit(server.run())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+from bisect import bisect_right
+from datetime import date
+from sqlalchemy import event, text
+from models import db, Patient
+
+# Census dimensions and the bucket each patient row falls in ({row} is new, old or patients)
+CENSUS_DIMENSIONS = (
+    ('total', "''"),
+    ('gender', "coalesce({row}.gender, '')"),
+    ('blood_type', "coalesce({row}.blood_type, '')"),
+    ('birth_date', "{row}.date_of_birth"),
+)
+
+# Lower bounds of the age bands reported by census(); ages are exact, from full birth dates
+AGE_BANDS = (0, 18, 35, 50, 65)
+
+def _rows(row, delta):
+    # Every dimension is counted twice: for all patients (doctor_id 0) and for the patient's doctor
+    return ', '.join(f"({scope}, '{dimension}', {expression.format(row=row)}, {delta})"
+                     for scope in ('0', f'{row}.doctor_id')
+                     for dimension, expression in CENSUS_DIMENSIONS)
+
+_upsert = ('INSERT INTO patient_stats (doctor_id, dimension, bucket, count) VALUES {} '
+           'ON CONFLICT (doctor_id, dimension, bucket) DO UPDATE SET count = count + excluded.count;')
+_tracked = ('doctor_id', 'gender', 'blood_type', 'date_of_birth')
+_changed = ' OR '.join(f'old.{column} IS NOT new.{column}' for column in _tracked)
+
+# Counters kept in step with patients by triggers, in the writing transaction, so
+# ORM writes, Core bulk inserts and set-based UPDATE/DELETEs are all counted
+STATS_DDL = (
+    """CREATE TABLE IF NOT EXISTS patient_stats (
+        doctor_id INTEGER NOT NULL,
+        dimension VARCHAR(20) NOT NULL,
+        bucket VARCHAR(20) NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (doctor_id, dimension, bucket)
+    ) WITHOUT ROWID""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_stats_ai AFTER INSERT ON patients BEGIN
+        {_upsert.format(_rows('new', 1))}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_stats_ad AFTER DELETE ON patients BEGIN
+        {_upsert.format(_rows('old', -1))}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS patient_stats_au AFTER UPDATE OF {', '.join(_tracked)} ON patients
+        WHEN {_changed} BEGIN
+        {_upsert.format(_rows('old', -1))}
+        {_upsert.format(_rows('new', 1))}
+    END""",
+)
+
+def rebuild_stats(connection):
+    """Recount every census bucket from the patients table (one scan, one transaction)."""
+    selects = [f"SELECT {scope}, '{dimension}', {expression.format(row='patients')}, count(*) "
+               f"FROM patients GROUP BY 1, 3"
+               for scope in ('0', 'doctor_id')
+               for dimension, expression in CENSUS_DIMENSIONS]
+    connection.execute(text('DELETE FROM patient_stats'))
+    connection.execute(text('INSERT INTO patient_stats (doctor_id, dimension, bucket, count) '
+                            + ' UNION ALL '.join(selects)))
+    return connection.execute(text(
+        "SELECT count FROM patient_stats WHERE doctor_id = 0 AND dimension = 'total'")).scalar() or 0
+
+def create_stats_table(connection):
+    """Create the census table and triggers if missing, backfilling existing patients."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patient_stats'")).first()
+    for statement in STATS_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        rebuild_stats(connection)
+
+def recreate_stats(connection):
+    """Replace the census triggers and recount every bucket, for when CENSUS_DIMENSIONS changes."""
+    if connection.dialect.name != 'sqlite':
+        return
+
+    for trigger in ('patient_stats_ai', 'patient_stats_ad', 'patient_stats_au'):
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {trigger}'))
+    for statement in STATS_DDL:
+        connection.execute(text(statement))
+    rebuild_stats(connection)
+
+@event.listens_for(Patient.__table__, 'after_create')
+def _create_stats_table(target, connection, **kw):
+    create_stats_table(connection)
+
+@event.listens_for(Patient.__table__, 'before_drop')
+def _drop_stats_table(target, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text('DROP TABLE IF EXISTS patient_stats'))
+
+def age_band(age):
+    index = bisect_right(AGE_BANDS, age) - 1
+    if index + 1 < len(AGE_BANDS):
+        return f'{AGE_BANDS[index]}-{AGE_BANDS[index + 1] - 1}'
+    return f'{AGE_BANDS[-1]}+'
+
+def _years_before(day, years):
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        # 29 February in a year that has none
+        return day.replace(year=day.year - years, day=28)
+
+def _age_band_case(today):
+    # Anyone born on or before the cutoff has turned that age by today
+    cutoffs = {f'cutoff_{lower}': _years_before(today, lower).isoformat() for lower in AGE_BANDS[1:]}
+    whens = ' '.join(f"WHEN bucket <= :cutoff_{lower} THEN '{age_band(lower)}'"
+                     for lower in reversed(AGE_BANDS[1:]))
+    return f"CASE {whens} ELSE '{age_band(AGE_BANDS[0])}' END", cutoffs
+
+def census(doctor_id=None):
+    """Patient counts by doctor, gender, blood type and age band, read from the counters.
+
+    Costs two indexed reads of the counter rows, bounded by the number of
+    distinct birth dates rather than patients. ``doctor_id`` restricts
+    everything to one doctor's panel.
+    """
+    scope = doctor_id or 0
+    rows = db.session.execute(text(
+        "SELECT dimension, bucket, count FROM patient_stats "
+        "WHERE doctor_id = :scope AND dimension != 'birth_date' AND count > 0"),
+        {'scope': scope})
+
+    result = {
+        'total': 0,
+        'gender': {},
+        'blood_type': {},
+        'age_bands': {age_band(lower): 0 for lower in AGE_BANDS},
+    }
+    for dimension, bucket, count in rows:
+        if dimension == 'total':
+            result['total'] = count
+        else:
+            result[dimension][bucket or 'unknown'] = count
+
+    band, cutoffs = _age_band_case(date.today())
+    bands = db.session.execute(text(
+        f"SELECT {band}, sum(count) FROM patient_stats "
+        f"WHERE doctor_id = :scope AND dimension = 'birth_date' GROUP BY 1"),
+        {'scope': scope, **cutoffs})
+    for label, count in bands:
+        result['age_bands'][label] += count
+
+    if doctor_id is None:
+        per_doctor = db.session.execute(text(
+            "SELECT doctor_id, count FROM patient_stats "
+            "WHERE dimension = 'total' AND doctor_id != 0 AND count > 0 ORDER BY doctor_id"))
+    else:
+        per_doctor = [(doctor_id, result['total'])] if result['total'] else []
+    result['per_doctor'] = {str(doctor): count for doctor, count in per_doctor}
+    return result
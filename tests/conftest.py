@@ -0,0 +1,2 @@
+# pytest only auto-loads conftest.py; the fixtures live in conftests.py
+from tests.conftests import *
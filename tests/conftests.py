@@ -1,5 +1,7 @@
 import pytest
 import json
+from flask.testing import FlaskClient
+from sqlalchemy import event
 from app import create_app, db
 from models import Doctor, Patient
 from datetime import datetime
@@ -18,17 +20,28 @@ def app():
     with app.app_context():
         db.create_all()
         yield app
+        # Write out buffered audit events while the tables still exist
+        if 'audit_log' in app.extensions:
+            app.extensions.pop('audit_log').shutdown()
         db.session.remove()
         db.drop_all()
 
+class RedirectingClient(FlaskClient):
+    """Follows redirects, so '/api/patients' reaches the '/api/patients/' routes"""
+
+    def open(self, *args, **kwargs):
+        kwargs.setdefault('follow_redirects', True)
+        return super().open(*args, **kwargs)
+
 @pytest.fixture
 def client(app):
     """Test client"""
+    app.test_client_class = RedirectingClient
     return app.test_client()
 
 @pytest.fixture
-def auth_headers():
-    """Create authenticated headers"""
+def auth_headers(create_test_doctor):
+    """Create authenticated headers; the test doctor exists so its token can be had"""
     def _create_headers(token):
         return {
             'Authorization': f'Bearer {token}',
@@ -36,35 +49,68 @@ def auth_headers():
         }
     return _create_headers
 
+@pytest.fixture
+def login(client):
+    """Log in through the API and return the bearer token"""
+    def _login(email='test@doctor.com', password='password123'):
+        response = client.post('/api/auth/login',
+                               data=json.dumps({'email': email, 'password': password}),
+                               content_type='application/json')
+        return json.loads(response.data)['token']
+    return _login
+
 @pytest.fixture
 def create_test_doctor(app):
     """Create test doctor in database"""
-    with app.app_context():
-        doctor = Doctor(
-            first_name='Test',
-            last_name='Doctor',
-            email='test@doctor.com',
-            license_number='TEST123',
-            specialty='General'
-        )
-        doctor.set_password('password123')
-        db.session.add(doctor)
-        db.session.commit()
-        return doctor
+    # In the app fixture's context: a context of its own would detach the doctor on exit
+    doctor = Doctor(
+        first_name='Test',
+        last_name='Doctor',
+        email='test@doctor.com',
+        license_number='TEST123',
+        specialty='General'
+    )
+    doctor.set_password('password123')
+    db.session.add(doctor)
+    db.session.commit()
+    return doctor
 
 @pytest.fixture
 def create_test_patient(app, create_test_doctor):
     """Create test patient in database"""
-    with app.app_context():
-        patient = Patient(
-            first_name='John',
-            last_name='Doe',
-            date_of_birth=datetime(1990, 1, 1).date(),
-            gender='Male',
-            email='john@patient.com',
-            phone='1234567890',
-            doctor_id=create_test_doctor.id
-        )
-        db.session.add(patient)
-        db.session.commit()
-        return patient
\ No newline at end of file
+    patient = Patient(
+        first_name='John',
+        last_name='Doe',
+        date_of_birth=datetime(1990, 1, 1).date(),
+        gender='Male',
+        email='john@patient.com',
+        phone='1234567890',
+        doctor_id=create_test_doctor.id
+    )
+    db.session.add(patient)
+    db.session.commit()
+    return patient
+
+@pytest.fixture
+def query_plans(app):
+    """Record SELECTs run while active; call with substrings to get the matching EXPLAIN QUERY PLANs"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+
+    def _plans(*markers):
+        plans = []
+        with db.engine.connect() as connection:
+            for statement, parameters in statements:
+                if not all(marker in statement for marker in markers):
+                    continue
+                rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)
+                plans.append(' | '.join(row[-1] for row in rows))
+        return plans
+
+    yield _plans
+    event.remove(db.engine, 'before_cursor_execute', record)
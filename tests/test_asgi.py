@@ -0,0 +1,103 @@
+import pytest
+import asyncio
+import json
+import config
+
+pytest.importorskip('aiosqlite')
+
+from app import create_app
+from asgi import create_asgi_app
+
+@pytest.fixture
+def asgi_client(tmp_path, monkeypatch):
+    """ASGI app and the sync Flask app over one file database (aiosqlite cannot share :memory:)"""
+    monkeypatch.setattr(config.TestingConfig, 'SQLALCHEMY_DATABASE_URI',
+                        f"sqlite:///{tmp_path / 'hospital.db'}")
+    flask_app = create_app('testing')
+    asgi_app = create_asgi_app(flask_app)
+    loop = asyncio.new_event_loop()
+    cookies = {}
+
+    def call(method, path, body=None):
+        path, _, query = path.partition('?')
+        headers = [(b'content-type', b'application/json')] if body is not None else []
+        if cookies:
+            headers.append((b'cookie', '; '.join(f'{k}={v}' for k, v in cookies.items()).encode()))
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+                 'headers': headers, 'http_version': '1.1', 'scheme': 'http',
+                 'server': ('localhost', 80), 'client': ('127.0.0.1', 5000)}
+        raw = json.dumps(body).encode() if body is not None else b''
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': raw, 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        loop.run_until_complete(asgi_app(scope, receive, send))
+        start = messages[0]
+        response_headers = {name.decode(): value.decode() for name, value in start['headers']}
+        if 'set-cookie' in response_headers:
+            name, _, value = response_headers['set-cookie'].split(';')[0].partition('=')
+            cookies[name] = value
+        return start['status'], response_headers, b''.join(m.get('body', b'') for m in messages[1:])
+
+    call.flask_app = flask_app
+    yield call
+    loop.run_until_complete(asgi_app.engine.dispose())
+    loop.close()
+    asgi_app.executor.shutdown()
+    with flask_app.app_context():
+        from models import db
+        db.engine.dispose()
+
+def register(call):
+    return call('POST', '/api/auth/register', {
+        'first_name': 'Async', 'last_name': 'Doctor', 'email': 'async@doctor.com',
+        'password': 'password123', 'license_number': 'ASYNC1'})
+
+def test_asgi_requires_session(asgi_client):
+    """Test that async views answer 401 like flask_login without a session"""
+    status, _, body = asgi_client('GET', '/api/patients/')
+    assert status == 401
+    assert json.loads(body) == {'message': 'Unauthorized access'}
+
+def test_asgi_matches_sync_app(asgi_client):
+    """Test that async reads return the same JSON as the sync views for data written through the sync side"""
+    assert register(asgi_client)[0] == 201
+    status, _, body = asgi_client('POST', '/api/auth/login', {'email': 'async@doctor.com', 'password': 'password123'})
+    assert status == 200 and json.loads(body)['token']
+
+    # Writes are served by the sync views on the thread pool
+    for name in ('Zed', 'Adams', 'Moss'):
+        status, _, body = asgi_client('POST', '/api/patients/', {
+            'first_name': 'P', 'last_name': name, 'date_of_birth': '1990-01-01', 'allergies': 'none'})
+        assert status == 201
+    patient_id = json.loads(body)['patient']['id']
+
+    client = asgi_client.flask_app.test_client()
+    client.post('/api/auth/login', json={'email': 'async@doctor.com', 'password': 'password123'})
+    for path in ('/api/patients/', '/api/patients/?limit=2', '/api/patients/?fields=id,doctor_name',
+                 f'/api/patients/{patient_id}', '/api/doctors/', '/api/doctors/1', '/api/auth/me'):
+        status, headers, body = asgi_client('GET', path)
+        expected = client.get(path)
+        assert status == expected.status_code, path
+        assert json.loads(body) == expected.get_json(), path
+        assert headers.get('x-next-cursor') == expected.headers.get('X-Next-Cursor'), path
+
+    # Validators carry over as well
+    status, headers, _ = asgi_client('GET', '/api/patients/')
+    assert headers['etag'] == client.get('/api/patients/').headers['ETag']
+
+def test_asgi_streams_sync_routes(asgi_client):
+    """Test that routes without an async view, such as the export, still stream through"""
+    register(asgi_client)
+    asgi_client('POST', '/api/auth/login', {'email': 'async@doctor.com', 'password': 'password123'})
+    for i in range(3):
+        asgi_client('POST', '/api/patients/', {'first_name': 'P', 'last_name': f'N{i}', 'date_of_birth': '1990-01-01'})
+
+    status, headers, body = asgi_client('GET', '/api/patients/export?format=ndjson')
+    assert status == 200
+    assert headers['content-type'] == 'application/x-ndjson'
+    assert len(body.splitlines()) == 3
@@ -0,0 +1,147 @@
+import pytest
+import json
+import threading
+import time
+from sqlalchemy import text
+from models import db, Doctor, AuditEvent
+from audit import AuditLog, get_audit_log
+
+def audit_rows():
+    get_audit_log().flush()
+    db.session.expire_all()
+    return [(event.action, event.patient_id, event.status)
+            for event in AuditEvent.query.order_by(AuditEvent.id).all()]
+
+def test_patient_access_is_audited(client, create_test_doctor, auth_headers, login):
+    """Test that every patient read and write is logged with its actor and final status"""
+    headers = auth_headers(login())
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+
+    created = []
+    for name in ('Adams', 'Baker'):
+        response = client.post('/api/patients/', headers=headers, data=json.dumps(
+            {'first_name': 'P', 'last_name': name, 'date_of_birth': '1990-01-01'}))
+        created.append(json.loads(response.data)['patient']['id'])
+    first, second = created
+
+    client.get('/api/patients/', headers=headers)
+    client.get(f'/api/patients/{first}', headers=headers)
+    client.put(f'/api/patients/{first}', headers=headers, data=json.dumps({'phone': '555'}))
+    client.patch(f'/api/patients/{second}', headers=headers, data=json.dumps({'blood_type': 'O+'}))
+    client.delete(f'/api/patients/{second}', headers=headers)
+
+    other = Doctor(first_name='Other', last_name='Doctor', email='other@doctor.com', license_number='OTHER1')
+    other.set_password('password123')
+    db.session.add(other)
+    db.session.commit()
+    other_headers = auth_headers(login('other@doctor.com'))
+    assert client.get(f'/api/patients/{first}', headers=other_headers).status_code == 403
+
+    assert audit_rows() == [
+        ('create', first, 201), ('create', second, 201),
+        # A list read is one row per patient on the page
+        ('list', first, 200), ('list', second, 200),
+        ('read', first, 200), ('update', first, 200), ('update', second, 200),
+        ('delete', second, 200), ('read', first, 403),
+    ]
+    actors = [event.actor_id for event in AuditEvent.query.order_by(AuditEvent.id).all()]
+    assert actors == [doctor_id] * 8 + [other.id]
+
+    # Doctor-only endpoints and the login itself leave no trace
+    client.get('/api/doctors/', headers=headers)
+    assert len(audit_rows()) == 9
+
+def test_audit_log_is_append_only(app):
+    """Test that audit rows cannot be edited or deleted through SQL"""
+    audit_log = get_audit_log()
+    audit_log.record(1, 'read', (1,), 200, '127.0.0.1')
+    audit_log.flush()
+
+    for statement in ('UPDATE audit_log SET status = 500', 'DELETE FROM audit_log'):
+        with pytest.raises(Exception, match='append-only'):
+            db.session.execute(text(statement))
+        db.session.rollback()
+    assert AuditEvent.query.count() == 1
+
+def test_audit_log_drops_and_counts_when_full(app):
+    """Test that a full queue drops events under the drop policy and counts them"""
+    audit_log = AuditLog(app, queue_size=2, batch_size=1, flush_interval=None, overflow='drop')
+    # Stall the writer on its first batch so the queue fills up behind it
+    gate = threading.Event()
+    write = audit_log._write
+    audit_log._write = lambda events: gate.wait() and write(events)
+    try:
+        assert audit_log.record(1, 'read', (1,), 200, None)
+        while audit_log._queue.qsize():
+            time.sleep(0.001)
+        results = [audit_log.record(1, 'read', (1,), 200, None) for _ in range(9)]
+        assert results == [True] * 2 + [False] * 7
+        assert (audit_log.queued, audit_log.dropped) == (3, 7)
+
+        gate.set()
+        audit_log.flush()
+        assert audit_log.written == 3
+        body = audit_log.render()
+        assert 'audit_events_dropped_total 7' in body
+        assert 'audit_queue_depth 0' in body
+    finally:
+        audit_log.shutdown()
+    assert audit_log.record(1, 'read', (1,), 200, None) is False
+
+def test_audit_counters_in_metrics(client, create_test_doctor, auth_headers, login):
+    """Test that /metrics reports the audit queue's counters"""
+    headers = auth_headers(login())
+    client.post('/api/patients/', headers=headers, data=json.dumps(
+        {'first_name': 'P', 'last_name': 'Adams', 'date_of_birth': '1990-01-01'}))
+    get_audit_log().flush()
+
+    body = client.get('/metrics').data.decode()
+    assert 'audit_events_queued_total 1' in body
+    assert 'audit_events_written_total 1' in body
+    assert 'audit_events_dropped_total 0' in body
+
+def test_bulk_reads_are_audited(client, create_test_doctor, auth_headers, login):
+    """Test that search, batch, change feed and streamed export reads log every patient served"""
+    headers = auth_headers(login())
+    created = []
+    for name in ('Adams', 'Baker', 'Carter'):
+        response = client.post('/api/patients/', headers=headers, data=json.dumps(
+            {'first_name': 'P', 'last_name': name, 'date_of_birth': '1990-01-01'}))
+        created.append(json.loads(response.data)['patient']['id'])
+    first, second, third = created
+    skip = len(audit_rows())
+
+    client.get('/api/patients/search?q=Baker', headers=headers)
+    client.get(f'/api/patients/batch?ids={first},{third},999', headers=headers)
+    client.get('/api/patients/changes', headers=headers)
+    response = client.get('/api/patients/export', headers=headers)
+    assert len(response.data.splitlines()) == 3
+
+    assert audit_rows()[skip:] == [
+        ('search', second, 200),
+        ('batch', first, 200), ('batch', third, 200),
+        ('changes', first, 200), ('changes', second, 200), ('changes', third, 200),
+        ('export', first, 200), ('export', second, 200), ('export', third, 200),
+    ]
+
+def test_audit_write_is_retried_once(app):
+    """Test that a failed batch is retried with the next write and only then discarded"""
+    audit_log = AuditLog(app, batch_size=1, flush_interval=None)
+    write = audit_log._write
+    outcomes = iter([False, True, False, False, True])
+    audit_log._write = lambda events: next(outcomes) and write(events)
+    try:
+        audit_log.record(1, 'read', (1,), 200, None)
+        audit_log.flush()
+        assert (audit_log.written, audit_log.failed) == (1, 0)
+
+        audit_log.record(1, 'read', (2,), 200, None)
+        audit_log.flush()
+        assert (audit_log.written, audit_log.failed) == (1, 1)
+
+        audit_log.record(1, 'read', (3,), 200, None)
+        audit_log.flush()
+        assert (audit_log.written, audit_log.failed) == (2, 1)
+    finally:
+        audit_log.shutdown()
+    assert [event.patient_id for event in AuditEvent.query.order_by(AuditEvent.id)] == [1, 3]
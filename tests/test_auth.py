@@ -1,6 +1,10 @@
 import pytest
 import json
-from models import Doctor
+import threading
+from models import Doctor, query_budget
+from passwords import PasswordHasher
+from tokens import TokenStore, get_token_store
+import jwt
 
 def test_doctor_registration(client):
     """Test doctor registration endpoint"""
@@ -74,4 +78,108 @@ def test_get_current_doctor(client, create_test_doctor, auth_headers):
     
     assert response.status_code == 200
     response_data = json.loads(response.data)
-    assert response_data['email'] == 'test@doctor.com'
\ No newline at end of file
+    assert response_data['email'] == 'test@doctor.com'
+
+def test_token_required_needs_no_queries(client, create_test_doctor, auth_headers, login):
+    """Test that a bearer token is authenticated from its claims alone"""
+    token = login()
+
+    with query_budget(0):
+        response = client.get('/api/auth/token', headers=auth_headers(token))
+        response = client.get('/api/auth/token', headers=auth_headers(token))
+
+    assert response.status_code == 200
+    response_data = json.loads(response.data)
+    assert response_data['role'] == 'doctor'
+    assert response_data['user_id'] == Doctor.query.filter_by(email='test@doctor.com').first().id
+
+def test_token_rejected_after_logout(client, create_test_doctor, auth_headers, login):
+    """Test that logout revokes the bearer token even though it is cached"""
+    token = login()
+    assert client.get('/api/auth/token', headers=auth_headers(token)).status_code == 200
+
+    client.post('/api/auth/logout', headers=auth_headers(token))
+
+    assert client.get('/api/auth/token', headers=auth_headers(token)).status_code == 401
+
+def test_token_rejected_after_doctor_deleted(client, create_test_doctor, auth_headers, login):
+    """Test that deactivating a doctor revokes their outstanding tokens"""
+    token = login()
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+
+    client.delete(f'/api/doctors/{doctor_id}', headers=auth_headers(token))
+
+    assert client.get('/api/auth/token', headers=auth_headers(token)).status_code == 401
+
+def test_token_revocations_reach_every_process(client, app, create_test_doctor, auth_headers, login):
+    """Test that under MULTI_PROCESS a logout or deactivation in one worker is seen by another"""
+    app.config['MULTI_PROCESS'] = True
+    other_worker = TokenStore(shared=True)
+    logged_out, kept = login(), login()
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+
+    client.post('/api/auth/logout', headers=auth_headers(logged_out))
+    assert other_worker.is_revoked(jwt.decode(logged_out, options={'verify_signature': False}))
+    assert not other_worker.is_revoked(jwt.decode(kept, options={'verify_signature': False}))
+
+    # A fresh worker, which has seen neither revocation
+    app.extensions['token_store'] = TokenStore(shared=True)
+    assert client.get('/api/auth/token', headers=auth_headers(logged_out)).status_code == 401
+    assert client.get('/api/auth/token', headers=auth_headers(kept)).status_code == 200
+
+    get_token_store().revoke_user(doctor_id)
+    assert other_worker.is_revoked(jwt.decode(kept, options={'verify_signature': False}))
+
+def test_tampered_token_rejected(client, create_test_doctor, auth_headers, login):
+    """Test that a token with a bad signature is rejected"""
+    token = login()
+
+    response = client.get('/api/auth/token', headers=auth_headers(token[:-2] + 'xx'))
+    assert response.status_code == 401
+
+def test_login_rehashes_outdated_cost(client, app, create_test_doctor, login):
+    """Test that a hash made with another bcrypt cost is upgraded at login"""
+    app.extensions['password_hasher'] = PasswordHasher(rounds=5, workers=1)
+
+    token = login()
+    assert token
+
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    assert doctor.password_hash.startswith('$2b$05$')
+    assert doctor.check_password('password123')
+
+def test_login_shed_when_hashing_pool_full(client, app, create_test_doctor):
+    """Test that a login past the hashing queue bound gets 503 at once instead of waiting"""
+    hasher = app.extensions['password_hasher'] = PasswordHasher(rounds=4, workers=1, queue_size=0)
+    gate = threading.Event()
+    busy = hasher._submit(gate.wait)
+    credentials = json.dumps({'email': 'test@doctor.com', 'password': 'password123'})
+
+    response = client.post('/api/auth/login', data=credentials, content_type='application/json')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert hasher.rejected == 1
+
+    gate.set()
+    busy.result()
+    response = client.post('/api/auth/login', data=credentials, content_type='application/json')
+    assert response.status_code == 200
+    hasher.shutdown()
+
+def test_password_longer_than_bcrypt_accepts_is_rejected(client, create_test_doctor, auth_headers, login):
+    """Test that passwords over bcrypt's 72 bytes get 400 on register and update instead of 500"""
+    data = {'first_name': 'John', 'last_name': 'Smith', 'email': 'john.smith@hospital.com',
+            'password': 'x' * 80, 'license_number': 'MED123456'}
+    response = client.post('/api/auth/register', data=json.dumps(data), content_type='application/json')
+    assert response.status_code == 400
+    assert json.loads(response.data)['message'] == 'password must be at most 72 bytes'
+    assert Doctor.query.filter_by(email=data['email']).first() is None
+
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+    headers = auth_headers(login())
+    # The limit is in UTF-8 bytes: 37 two-byte characters are 74 bytes, 36 are exactly 72
+    response = client.put(f'/api/doctors/{doctor_id}', data=json.dumps({'password': 'é' * 37}), headers=headers)
+    assert response.status_code == 400
+    response = client.put(f'/api/doctors/{doctor_id}', data=json.dumps({'password': 'é' * 36}), headers=headers)
+    assert response.status_code == 200
+    assert login(password='é' * 36)
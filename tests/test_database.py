@@ -0,0 +1,55 @@
+import pytest
+from flask import Flask
+from sqlalchemy import insert, text
+from config import ProductionConfig
+from database import init_engines
+from models import db, Doctor
+
+@pytest.fixture
+def production_app(tmp_path):
+    """App with the production engine profile on a file database"""
+    app = Flask(__name__)
+    app.config.from_object(ProductionConfig)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'hospital.db'}"
+    db.init_app(app)
+    init_engines(app, db)
+    with app.app_context():
+        db.create_all()
+    yield app
+    app.extensions['read_engine'].dispose()
+    with app.app_context():
+        db.engine.dispose()
+
+def test_production_pragmas_applied(production_app):
+    """Test that WAL and the other connect-time pragmas are set"""
+    with production_app.app_context():
+        with db.engine.connect() as connection:
+            assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert connection.execute(text('PRAGMA synchronous')).scalar() == 1
+            assert connection.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+
+def test_get_requests_use_read_only_engine(production_app):
+    """Test that GET reads are routed to the query_only pool and flushes and DML are not"""
+    read_engine = production_app.extensions['read_engine']
+
+    with production_app.test_request_context(method='GET'):
+        assert db.session.get_bind() is read_engine
+        with pytest.raises(Exception):
+            db.session.execute(text("INSERT INTO doctors (first_name, last_name, email, password_hash) "
+                                    "VALUES ('a', 'b', 'c', 'd')"))
+        db.session.rollback()
+
+        # Core DML is recognised as a write whatever the request method
+        db.session.execute(insert(Doctor.__table__).values(first_name='C', last_name='Ore',
+                                                           email='core@hospital.com', password_hash='x'))
+        db.session.commit()
+        assert Doctor.query.filter_by(email='core@hospital.com').count() == 1
+
+    with production_app.test_request_context(method='POST'):
+        assert db.session.get_bind() is db.engine
+        doctor = Doctor(first_name='W', last_name='Riter', email='w@hospital.com', password_hash='x')
+        db.session.add(doctor)
+        db.session.commit()
+
+    with production_app.test_request_context(method='GET'):
+        assert Doctor.query.filter_by(email='w@hospital.com').count() == 1
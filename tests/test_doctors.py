@@ -0,0 +1,319 @@
+import pytest
+import json
+from datetime import date, datetime, timedelta
+from sqlalchemy import event
+from models import db, Doctor, Patient, query_budget
+from offboarding import balanced_quotas
+from principals import get_principal_cache, load_principal
+from cache import NullCacheBackend, get_response_cache
+import serializers
+
+def add_doctors(count, is_active=True):
+    for i in range(count):
+        doctor = Doctor(
+            first_name='Doc',
+            last_name=f'Number{i}',
+            email=f'doc{i}-{is_active}@hospital.com',
+            license_number=f'LIC{i}-{is_active}',
+            is_active=is_active
+        )
+        doctor.password_hash = 'x'
+        db.session.add(doctor)
+    db.session.commit()
+
+def test_get_doctors_keyset_pagination(client, create_test_doctor, auth_headers, login):
+    """Test that the doctor directory pages by id and skips inactive doctors"""
+    add_doctors(5)
+    add_doctors(2, is_active=False)
+    token = login()
+
+    ids = []
+    cursor = None
+    while True:
+        url = '/api/doctors/?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url, headers=auth_headers(token))
+        assert response.status_code == 200
+        ids.extend(d['id'] for d in json.loads(response.data))
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+
+    assert ids == sorted(ids)
+    assert len(ids) == 6
+
+def test_get_doctors_limit_is_capped(client, app, create_test_doctor, auth_headers, login):
+    """Test that limit is clamped to the server-side maximum"""
+    app.config['PAGE_SIZE_MAX'] = 3
+    add_doctors(5)
+    token = login()
+
+    response = client.get('/api/doctors/?limit=1000', headers=auth_headers(token))
+    assert response.status_code == 200
+    assert len(json.loads(response.data)) == 3
+    assert 'X-Next-Cursor' in response.headers
+
+def test_get_doctors_uses_index(client, create_test_doctor, auth_headers, query_plans, login):
+    """Test that the active-doctor directory is served from the (is_active, id) index"""
+    token = login()
+
+    client.get('/api/doctors/', headers=auth_headers(token))
+
+    plans = query_plans('FROM doctors', 'doctors.is_active =', 'ORDER BY')
+    assert plans
+    for plan in plans:
+        assert 'ix_doctors_is_active_id' in plan
+        assert 'TEMP B-TREE' not in plan
+
+def test_session_principal_is_cached_and_invalidated(client, app, create_test_doctor, auth_headers, login):
+    """Test that the user loader serves repeat loads from cache until the doctor changes"""
+    token = login()
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+    db.session.expunge_all()
+
+    load_principal(doctor_id)
+    with query_budget(0):
+        doctor = load_principal(doctor_id)
+    assert doctor.full_name == 'Test Doctor'
+
+    stats = get_principal_cache().stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+
+    client.put(f'/api/doctors/{doctor_id}',
+               data=json.dumps({'first_name': 'Renamed'}),
+               headers=auth_headers(token))
+    db.session.expunge_all()
+
+    assert load_principal(doctor_id).first_name == 'Renamed'
+    assert get_principal_cache().stats()['misses'] == 2
+
+def test_session_principal_not_cached_with_several_processes(app, create_test_doctor):
+    """Test that MULTI_PROCESS loads the doctor every time, since another worker's change is never invalidated here"""
+    app.config['MULTI_PROCESS'] = True
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+    db.session.expunge_all()
+
+    load_principal(doctor_id)
+    Doctor.query.filter_by(id=doctor_id).update({'is_active': False})
+    db.session.commit()
+    db.session.expunge_all()
+
+    assert load_principal(doctor_id).is_active is False
+    assert get_principal_cache().stats() == {'size': 0, 'hits': 0, 'misses': 2}
+
+def test_get_doctor_conditional_requests(client, create_test_doctor, auth_headers, login):
+    """Test that a doctor ETag matches until the doctor is updated"""
+    token = login()
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+
+    etag = client.get(f'/api/doctors/{doctor_id}', headers=auth_headers(token)).headers['ETag']
+    headers = dict(auth_headers(token), **{'If-None-Match': etag})
+    assert client.get(f'/api/doctors/{doctor_id}', headers=headers).status_code == 304
+    assert client.get('/api/doctors/', headers=auth_headers(token)).headers['ETag'] != etag
+
+    client.put(f'/api/doctors/{doctor_id}',
+               data=json.dumps({'specialty': 'Surgery'}),
+               headers=auth_headers(token))
+
+    assert client.get(f'/api/doctors/{doctor_id}', headers=headers).status_code == 200
+
+def test_get_doctor_last_modified_held_back_within_the_second(client, create_test_doctor, auth_headers, login):
+    """Test that If-Modified-Since validates a doctor, but no Last-Modified is sent for a same-second edit"""
+    token = login()
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    doctor_id = doctor.id
+    doctor.updated_at = datetime.utcnow() - timedelta(hours=1)
+    db.session.commit()
+    get_response_cache('doctors').invalidate()
+
+    last_modified = client.get(f'/api/doctors/{doctor_id}', headers=auth_headers(token)).headers['Last-Modified']
+    headers = dict(auth_headers(token), **{'If-Modified-Since': last_modified})
+    assert client.get(f'/api/doctors/{doctor_id}', headers=headers).status_code == 304
+
+    # Another edit in this second would carry the same HTTP date
+    doctor.updated_at = datetime.utcnow()
+    db.session.commit()
+    get_response_cache('doctors').invalidate()
+    response = client.get(f'/api/doctors/{doctor_id}', headers=auth_headers(token))
+    assert response.status_code == 200
+    assert 'Last-Modified' not in response.headers
+    assert 'Last-Modified' not in client.get('/api/doctors/', headers=auth_headers(token)).headers
+
+def test_doctor_directory_served_from_cache_until_invalidated(client, create_test_doctor, auth_headers, login):
+    """Test that cached directory bytes are reused and dropped on register/update"""
+    token = login()
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+
+    first = client.get('/api/doctors/', headers=auth_headers(token))
+    with query_budget(0):
+        second = client.get('/api/doctors/', headers=auth_headers(token))
+        client.get(f'/api/doctors/{doctor_id}', headers=auth_headers(token))
+        client.get(f'/api/doctors/{doctor_id}', headers=auth_headers(token))
+    assert second.data == first.data
+    assert second.headers['ETag'] == first.headers['ETag']
+
+    client.put(f'/api/doctors/{doctor_id}',
+               data=json.dumps({'specialty': 'Neurology'}),
+               headers=auth_headers(token))
+    assert json.loads(client.get('/api/doctors/', headers=auth_headers(token)).data)[0]['specialty'] == 'Neurology'
+    response = client.get(f'/api/doctors/{doctor_id}', headers=auth_headers(token))
+    assert json.loads(response.data)['specialty'] == 'Neurology'
+
+    client.post('/api/auth/register',
+                data=json.dumps({'first_name': 'New', 'last_name': 'Doc', 'email': 'new@doctor.com',
+                                 'password': 'pw', 'license_number': 'NEW1'}),
+                content_type='application/json')
+    assert len(json.loads(client.get('/api/doctors/', headers=auth_headers(token)).data)) == 2
+
+def test_doctor_directory_not_cached_with_several_processes(client, app, create_test_doctor, auth_headers, login):
+    """Test that MULTI_PROCESS turns off the process-local response cache, whose invalidation one worker cannot share"""
+    app.config['MULTI_PROCESS'] = True
+    token = login()
+    assert isinstance(get_response_cache('doctors').backend, NullCacheBackend)
+
+    client.get('/api/doctors/', headers=auth_headers(token))
+    # Another worker's write: this process never hears an invalidate()
+    Doctor.query.filter_by(email='test@doctor.com').one().specialty = 'Neurology'
+    db.session.commit()
+    assert json.loads(client.get('/api/doctors/', headers=auth_headers(token)).data)[0]['specialty'] == 'Neurology'
+
+def test_doctor_sparse_fieldsets(client, create_test_doctor, auth_headers, login):
+    """Test ?fields= on the doctor list and detail endpoints"""
+    token = login()
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+
+    response = client.get('/api/doctors/?fields=id,last_name', headers=auth_headers(token))
+    assert json.loads(response.data) == [{'id': doctor_id, 'last_name': 'Doctor'}]
+
+    response = client.get(f'/api/doctors/{doctor_id}?fields=specialty', headers=auth_headers(token))
+    assert json.loads(response.data) == {'specialty': 'General'}
+    response = client.get(f'/api/doctors/{doctor_id}', headers=auth_headers(token))
+    assert set(json.loads(response.data)) == set(Doctor.SERIALIZED_FIELDS)
+
+    response = client.get('/api/doctors/?fields=password_hash', headers=auth_headers(token))
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('stdlib_encoder', [False, True])
+def test_fast_serialization_matches_orm_path(client, app, create_test_doctor, auth_headers, login, monkeypatch,
+                                             stdlib_encoder):
+    """Test that the doctor list fast path returns the same bytes as jsonify of to_dict(), non-ASCII included"""
+    if stdlib_encoder:
+        monkeypatch.setattr(serializers, 'orjson', None)
+    add_doctors(3)
+    Doctor.query.filter_by(last_name='Number0').one().first_name = 'Zoë'
+    Doctor.query.filter_by(last_name='Number1').one().specialty = 'Cardiología'
+    db.session.commit()
+    token = login()
+
+    app.config['FAST_SERIALIZATION'] = False
+    slow = client.get('/api/doctors/?limit=2', headers=auth_headers(token))
+    get_response_cache('doctors').invalidate()
+    app.config['FAST_SERIALIZATION'] = True
+    fast = client.get('/api/doctors/?limit=2', headers=auth_headers(token))
+
+    assert fast.data == slow.data
+    assert fast.headers['X-Next-Cursor'] == slow.headers['X-Next-Cursor']
+
+def test_get_doctors_batch(client, create_test_doctor, auth_headers, login):
+    """Test that doctors are fetched by id list with not-found markers"""
+    add_doctors(2)
+    token = login()
+    ids = [d.id for d in Doctor.query.order_by(Doctor.id)]
+
+    response = client.post('/api/doctors/batch', data=json.dumps({'ids': [ids[2], 404, ids[0]]}),
+                           headers=auth_headers(token))
+    assert response.status_code == 200
+    results = json.loads(response.data)['results']
+    assert [(r['id'], r['status']) for r in results] == [(ids[2], 200), (404, 404), (ids[0], 200)]
+    assert results[2]['doctor']['email'] == 'test@doctor.com'
+
+    response = client.post('/api/doctors/batch', data=json.dumps({'ids': 'all'}), headers=auth_headers(token))
+    assert response.status_code == 400
+
+def add_panel(doctor_id, count):
+    db.session.execute(Patient.__table__.insert(), [
+        {'first_name': 'P', 'last_name': f'Panel{i}', 'date_of_birth': date(1980, 1, 1), 'doctor_id': doctor_id}
+        for i in range(count)])
+    db.session.commit()
+
+def test_balanced_quotas_fill_least_loaded_first():
+    """Test that the balancing rule evens out the targets' panels"""
+    assert balanced_quotas(10, {1: 0, 2: 4, 3: 20}) == {1: 7, 2: 3, 3: 0}
+    assert balanced_quotas(3, {1: 5, 2: 5}) == {1: 2, 2: 1}
+    assert balanced_quotas(0, {1: 5}) == {1: 0}
+
+def test_reassign_patients_in_chunks(client, app, create_test_doctor, auth_headers, login):
+    """Test that a panel is spread over colleagues with chunked UPDATEs and streamed progress"""
+    add_doctors(3)
+    doctors = Doctor.query.filter(Doctor.email.like('doc%')).order_by(Doctor.id).all()
+    for doctor in doctors:
+        doctor.set_password('password123')
+    db.session.commit()
+    source, first, second = [d.id for d in doctors]
+    source_email, first_email = doctors[0].email, doctors[1].email
+    token = login(source_email)
+    add_panel(source, 25)
+    add_panel(second, 5)
+    app.config['REASSIGN_CHUNK_SIZE'] = 4
+
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    response = client.post(f'/api/doctors/{source}/reassign',
+                           data=json.dumps({'to': [first, second], 'deactivate': True}),
+                           headers=auth_headers(token))
+    lines = [json.loads(line) for line in response.data.splitlines()]
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    summary = lines[-1]
+    assert summary['done'] and summary['total_moved'] == 25 and summary['remaining'] == 0
+    assert summary['assignments'] == {str(first): 15, str(second): 10}
+    assert summary['deactivated']
+    assert all(line['total_moved'] <= 25 for line in lines[:-1]) and len(lines) > 6
+
+    # Rows are never loaded: only aggregates and UPDATE ... WHERE id IN (SELECT ... LIMIT)
+    assert not any(s.lstrip().startswith('SELECT patients.first_name') for s in statements)
+    db.session.expire_all()
+    assert Patient.query.filter_by(doctor_id=first).count() == 15
+    assert Patient.query.filter_by(doctor_id=second).count() == 15
+    assert db.session.get(Doctor, source).is_active is False
+
+    token = login(first_email)
+    bad = client.post(f'/api/doctors/{first}/reassign', data=json.dumps({'to': [first]}), headers=auth_headers(token))
+    assert bad.status_code == 400
+    bad = client.post(f'/api/doctors/{first}/reassign', data=json.dumps({'to': source}), headers=auth_headers(token))
+    assert bad.status_code == 404
+
+def test_reassign_someone_elses_panel_is_denied(client, create_test_doctor, auth_headers, login):
+    """Test that a doctor who is not an admin cannot take a colleague's panel or deactivate them"""
+    add_doctors(1)
+    colleague = Doctor.query.filter(Doctor.email.like('doc%')).one().id
+    me = Doctor.query.filter_by(email='test@doctor.com').one().id
+    add_panel(colleague, 3)
+    token = login()
+
+    response = client.post(f'/api/doctors/{colleague}/reassign',
+                           data=json.dumps({'to': me, 'deactivate': True}), headers=auth_headers(token))
+    assert response.status_code == 403
+
+    db.session.expire_all()
+    assert Patient.query.filter_by(doctor_id=colleague).count() == 3
+    assert db.session.get(Doctor, colleague).is_active is True
+
+def test_deleting_doctor_removes_panel_without_loading_it(app, create_test_doctor):
+    """Test that the ORM cascade deletes a doctor's patients with one DELETE"""
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    add_panel(doctor.id, 50)
+    db.session.expire_all()
+
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    db.session.delete(doctor)
+    db.session.commit()
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert Patient.query.count() == 0
+    assert not any('FROM patients' in s and s.lstrip().startswith('SELECT') for s in statements)
+    assert sum(1 for s in statements if s.lstrip().startswith('DELETE FROM patients')) == 1
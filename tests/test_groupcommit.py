@@ -0,0 +1,90 @@
+import pytest
+import json
+import threading
+from datetime import date
+from models import db, Doctor, Patient
+from groupcommit import GroupCommitUnavailable, get_writer
+
+@pytest.fixture
+def group_commit(app):
+    """Turn group commit on with a window wide enough to batch jobs queued by the test"""
+    app.config.update({'GROUP_COMMIT_ENABLED': True, 'GROUP_COMMIT_WINDOW': 0.05})
+    yield
+    if 'group_commit' in app.extensions:
+        app.extensions.pop('group_commit').shutdown()
+
+def test_group_commit_routes_match_direct_commits(client, create_test_doctor, auth_headers, group_commit, login):
+    """Test that writes routed through the writer thread respond and persist as before"""
+    headers = auth_headers(login())
+
+    response = client.post('/api/patients/', data=json.dumps({
+        'first_name': 'Group', 'last_name': 'Commit', 'date_of_birth': '1990-01-01'}), headers=headers)
+    assert response.status_code == 201
+    created = json.loads(response.data)['patient']
+    assert created['id'] and created['doctor_name'] == 'Test Doctor'
+
+    response = client.put(f"/api/patients/{created['id']}", data=json.dumps({'phone': '555'}), headers=headers)
+    assert json.loads(response.data)['patient']['phone'] == '555'
+    response = client.patch(f"/api/patients/{created['id']}", data=json.dumps({'blood_type': 'O+'}), headers=headers)
+    assert json.loads(response.data)['patient']['blood_type'] == 'O+'
+    fetched = json.loads(client.get(f"/api/patients/{created['id']}", headers=headers).data)
+    assert (fetched['phone'], fetched['blood_type']) == ('555', 'O+')
+
+    response = client.put(f"/api/patients/{created['id']}", data=json.dumps({'doctor_id': 999}), headers=headers)
+    assert response.status_code == 404
+
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+    response = client.put(f'/api/doctors/{doctor_id}', data=json.dumps({'specialty': 'Cardiology'}), headers=headers)
+    assert json.loads(response.data)['doctor']['specialty'] == 'Cardiology'
+
+    assert client.delete(f"/api/patients/{created['id']}", headers=headers).status_code == 200
+    assert client.get(f"/api/patients/{created['id']}", headers=headers).status_code == 404
+    assert get_writer().jobs == 5
+
+def test_group_commit_batches_jobs_and_isolates_errors(app, create_test_doctor, group_commit):
+    """Test that queued jobs share one transaction and a failing job only fails its own caller"""
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+    writer = get_writer()
+
+    def add(name):
+        def job():
+            patient = Patient(first_name='P', last_name=name, date_of_birth=date(1990, 1, 1), doctor_id=doctor_id)
+            db.session.add(patient)
+            db.session.flush()
+            return patient.id
+        return job
+
+    def broken():
+        db.session.add(Patient(first_name='P', last_name='Broken', doctor_id=doctor_id))
+        db.session.flush()
+
+    futures = [writer.submit(add('A')), writer.submit(broken), writer.submit(add('B'))]
+    assert all(isinstance(future.result(), int) for future in (futures[0], futures[2]))
+    with pytest.raises(Exception):
+        futures[1].result()
+
+    assert writer.batches == 1
+    assert sorted(p.last_name for p in Patient.query.all()) == ['A', 'B']
+
+def test_group_commit_wait_is_bounded(client, app, create_test_doctor, auth_headers, group_commit, login):
+    """Test that a stalled or dead writer answers 503 instead of blocking the request forever"""
+    headers = auth_headers(login())
+    app.config['GROUP_COMMIT_TIMEOUT'] = 0.05
+    writer = get_writer()
+    gate = threading.Event()
+    stalled = writer.submit(gate.wait)
+    data = json.dumps({'first_name': 'Group', 'last_name': 'Commit', 'date_of_birth': '1990-01-01'})
+
+    response = client.post('/api/patients/', data=data, headers=headers)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+    # The queued job was cancelled, so it never commits after its caller was told it failed
+    gate.set()
+    stalled.result()
+    assert Patient.query.count() == 0
+
+    writer._queue.put(None)
+    writer._thread.join()
+    with pytest.raises(GroupCommitUnavailable):
+        writer.submit(lambda: None)
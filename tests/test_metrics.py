@@ -0,0 +1,68 @@
+import pytest
+import json
+import logging
+from app import create_app
+from models import db
+
+def test_metrics_exposes_latency_histogram_and_sql(client, create_test_doctor, auth_headers, login):
+    """Test that requests are timed per endpoint and status with their SQL totals"""
+    token = login()
+    client.post('/api/patients/', headers=auth_headers(token),
+                data=json.dumps({'first_name': 'John', 'last_name': 'Doe', 'date_of_birth': '1990-01-01'}))
+    client.get('/api/patients/', headers=auth_headers(token))
+    client.get('/api/patients/', headers=auth_headers(token))
+    client.get('/api/patients/999', headers=auth_headers(token))
+    client.get('/no/such/url')
+
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.data.decode()
+
+    assert '# TYPE http_request_duration_seconds histogram' in body
+    assert ('http_request_duration_seconds_count{endpoint="patients.get_patients",'
+            'method="GET",status="200"} 2') in body
+    assert ('http_request_duration_seconds_bucket{endpoint="patients.get_patients",'
+            'method="GET",status="200",le="+Inf"} 2') in body
+    assert 'endpoint="patients.get_patient",method="GET",status="404"' in body
+    assert 'endpoint="unmatched",method="GET",status="404"' in body
+
+    statements = [line for line in body.splitlines()
+                  if line.startswith('http_request_db_statements_total{endpoint="patients.get_patients"}')]
+    assert len(statements) == 1 and int(statements[0].split()[-1]) >= 4
+
+def test_slow_request_log_includes_sql(client, app, create_test_doctor, auth_headers, caplog, login):
+    """Test that requests over the threshold are logged with their statements"""
+    app.config['SLOW_REQUEST_THRESHOLD'] = 0
+    token = login()
+    client.post('/api/patients/', headers=auth_headers(token),
+                data=json.dumps({'first_name': 'John', 'last_name': 'Doe', 'date_of_birth': '1990-01-01'}))
+
+    with caplog.at_level(logging.WARNING):
+        client.get('/api/patients/', headers=auth_headers(token))
+
+    messages = [record.getMessage() for record in caplog.records if 'Slow request' in record.getMessage()]
+    assert messages
+    assert 'patients.get_patients 200' in messages[-1]
+    assert 'FROM patients' in messages[-1]
+
+def test_metrics_labels_and_token(client, app, create_test_doctor):
+    """Test that unknown methods share one label, failed SQL keeps timings paired and the token is enforced"""
+    client.open('/api/patients/', method='BREW')
+    with db.engine.connect() as connection:
+        with pytest.raises(Exception):
+            connection.exec_driver_sql('SELECT * FROM no_such_table')
+        assert connection.info.get('query_start') == []
+
+    app.config['METRICS_TOKEN'] = 'scrape-secret'
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+    assert response.status_code == 200
+    body = response.data.decode()
+    assert 'method="OTHER"' in body and 'BREW' not in body
+
+def test_metrics_endpoint_is_opt_in():
+    """Test that /metrics is not served unless METRICS_ENDPOINT is on"""
+    app = create_app('production')
+    assert app.test_client().get('/metrics').status_code == 404
@@ -0,0 +1,66 @@
+import pytest
+import threading
+from datetime import datetime
+from models import (db, Doctor, Patient, QueryBudgetExceeded, query_budget,
+                    serialize_patients)
+
+def add_patients_for_doctors(doctor_count, patients_per_doctor):
+    for i in range(doctor_count):
+        doctor = Doctor(first_name='Doc', last_name=f'D{i}', email=f'd{i}@hospital.com',
+                        license_number=f'L{i}', password_hash='x')
+        db.session.add(doctor)
+        db.session.flush()
+        for j in range(patients_per_doctor):
+            db.session.add(Patient(first_name=f'P{j}', last_name=f'D{i}',
+                                   date_of_birth=datetime(1990, 1, 1).date(),
+                                   doctor_id=doctor.id))
+    db.session.commit()
+    db.session.expunge_all()
+
+def test_serialize_patients_prefetches_doctor_names(app):
+    """Test that batched serialization issues one query regardless of patient count"""
+    add_patients_for_doctors(doctor_count=4, patients_per_doctor=5)
+    patients = Patient.query.all()
+
+    with query_budget(1) as statements:
+        data = serialize_patients(patients)
+
+    assert len(statements) == 1
+    assert len(data) == 20
+    assert all(p['doctor_name'] == f"Doc {p['last_name']}" for p in data)
+
+def test_serialize_patients_matches_to_dict(app):
+    """Test that batched output is identical to the per-row serializer"""
+    add_patients_for_doctors(doctor_count=2, patients_per_doctor=2)
+    patients = Patient.query.all()
+
+    assert serialize_patients(patients) == [patient.to_dict() for patient in patients]
+
+def test_query_budget_catches_lazy_loads(app):
+    """Test that per-row lazy loading of the doctor trips the query budget"""
+    add_patients_for_doctors(doctor_count=3, patients_per_doctor=1)
+    patients = Patient.query.all()
+
+    with pytest.raises(QueryBudgetExceeded):
+        with query_budget(1):
+            [patient.to_dict() for patient in patients]
+
+def test_query_budget_ignores_other_threads(app):
+    """Test that SQL issued by a concurrent request's thread is not charged to the budget"""
+    def other_request():
+        with app.app_context():
+            Doctor.query.all()
+            Patient.query.all()
+
+    with query_budget(0) as statements:
+        thread = threading.Thread(target=other_request)
+        thread.start()
+        thread.join()
+    assert statements == []
+
+def test_serialized_fields_match_to_dict(app):
+    """Test that the declared field layout matches to_dict output"""
+    add_patients_for_doctors(doctor_count=1, patients_per_doctor=1)
+    patient = Patient.query.first()
+
+    assert tuple(patient.to_dict()) == Patient.SERIALIZED_FIELDS
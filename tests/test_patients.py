@@ -1,8 +1,14 @@
 #Test my patient CRUD priinciples
 import pytest
 import json
-from datetime import datetime
-from models import Patient
+from datetime import datetime, date, timedelta
+from sqlalchemy import event
+from models import db, Patient, Doctor
+from stats import census, rebuild_stats, _years_before
+from changes import changes_since
+from principals import invalidate_principal
+from routes.patients import insert_chunk
+from pagination import encode_cursor
 
 def test_create_patient(client, create_test_doctor, auth_headers):
     """Test creating a new patient with doctor as foreign key"""
@@ -121,4 +127,592 @@ def test_create_patient_invalid_doctor(client, auth_headers):
     
     assert response.status_code == 404
     response_data = json.loads(response.data)
-    assert 'Doctor not found' in response_data['message']
\ No newline at end of file
+    assert 'Doctor not found' in response_data['message']
+
+def test_get_patients_keyset_pagination(client, create_test_doctor, auth_headers):
+    """Test paging through patients with limit and next cursor"""
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    for name in ['Cole', 'Adams', 'Baker', 'Adams', 'Evans']:
+        db.session.add(Patient(first_name='P', last_name=name,
+                               date_of_birth=datetime(1980, 1, 1).date(),
+                               doctor_id=doctor.id))
+    db.session.commit()
+
+    login_data = {'email': 'test@doctor.com', 'password': 'password123'}
+    login_response = client.post('/api/auth/login',
+                                data=json.dumps(login_data),
+                                content_type='application/json')
+    token = json.loads(login_response.data)['token']
+
+    seen = []
+    cursor = None
+    while True:
+        url = '/api/patients/?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        response = client.get(url, headers=auth_headers(token))
+        assert response.status_code == 200
+        page = json.loads(response.data)
+        assert len(page) <= 2
+        seen.extend((p['last_name'], p['id']) for p in page)
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+
+    assert seen == sorted(seen)
+    assert [name for name, _ in seen] == ['Adams', 'Adams', 'Baker', 'Cole', 'Evans']
+
+def test_get_patients_invalid_cursor(client, create_test_doctor, auth_headers):
+    """Test that a tampered cursor is rejected"""
+    login_data = {'email': 'test@doctor.com', 'password': 'password123'}
+    login_response = client.post('/api/auth/login',
+                                data=json.dumps(login_data),
+                                content_type='application/json')
+    token = json.loads(login_response.data)['token']
+
+    response = client.get('/api/patients/?cursor=not-a-cursor',
+                         headers=auth_headers(token))
+    assert response.status_code == 400
+
+    # Well-formed but with values of the wrong type for (last_name, id)
+    for values in ([{'a': 1}, 2], ['Adams', '2'], ['Adams', True], [1, 2], ['Adams']):
+        response = client.get(f'/api/patients/?cursor={encode_cursor(values)}', headers=auth_headers(token))
+        assert response.status_code == 400
+    response = client.get(f'/api/doctors/?cursor={encode_cursor([None])}', headers=auth_headers(token))
+    assert response.status_code == 400
+    response = client.get(f"/api/patients/?cursor={encode_cursor(['Adams', 2])}", headers=auth_headers(token))
+    assert response.status_code == 200
+
+def test_export_patients_streams_ndjson_and_csv(client, app, create_test_doctor, auth_headers):
+    """Test streaming export in both formats, across several fetch batches"""
+    app.config['EXPORT_BATCH_SIZE'] = 2
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    for i in range(5):
+        db.session.add(Patient(first_name=f'P{i}', last_name='Export',
+                               date_of_birth=datetime(1980, 1, 1).date(),
+                               allergies='dust, "pollen"', doctor_id=doctor.id))
+    db.session.commit()
+
+    login_data = {'email': 'test@doctor.com', 'password': 'password123'}
+    login_response = client.post('/api/auth/login',
+                                data=json.dumps(login_data),
+                                content_type='application/json')
+    token = json.loads(login_response.data)['token']
+
+    response = client.get('/api/patients/export?format=ndjson', headers=auth_headers(token))
+    assert response.status_code == 200
+    assert response.is_streamed
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [row['first_name'] for row in rows] == [f'P{i}' for i in range(5)]
+    assert rows[0]['doctor_name'] == 'Test Doctor'
+
+    response = client.get('/api/patients/export?format=csv', headers=auth_headers(token))
+    assert response.status_code == 200
+    lines = response.data.decode().splitlines()
+    assert lines[0].split(',') == list(Patient.SERIALIZED_FIELDS)
+    assert len(lines) == 6
+
+    response = client.get('/api/patients/export?format=xml', headers=auth_headers(token))
+    assert response.status_code == 400
+
+def test_bulk_create_patients_reports_row_errors(client, app, create_test_doctor, auth_headers):
+    """Test bulk import from a JSON array with a mix of valid and invalid rows"""
+    app.config['BULK_IMPORT_CHUNK_SIZE'] = 2
+    login_data = {'email': 'test@doctor.com', 'password': 'password123'}
+    login_response = client.post('/api/auth/login',
+                                data=json.dumps(login_data),
+                                content_type='application/json')
+    token = json.loads(login_response.data)['token']
+
+    rows = [
+        {'first_name': 'A', 'last_name': 'One', 'date_of_birth': '1990-01-01'},
+        {'first_name': 'B', 'last_name': 'Two', 'date_of_birth': 'not-a-date'},
+        {'first_name': 'C', 'last_name': 'Three', 'date_of_birth': '1991-02-03', 'doctor_id': 999},
+        {'first_name': 'D', 'last_name': 'Four', 'date_of_birth': '1992-03-04', 'blood_type': 'O+'},
+        {'last_name': 'Five', 'date_of_birth': '1993-04-05'},
+        {'first_name': 'F', 'last_name': 'Six', 'date_of_birth': '1994-05-06'},
+    ]
+    response = client.post('/api/patients/bulk',
+                          data=json.dumps(rows),
+                          headers=auth_headers(token))
+
+    assert response.status_code == 200
+    result = json.loads(response.data)
+    assert result['inserted'] == 3
+    assert [error['row'] for error in result['errors']] == [1, 2, 4]
+    assert Patient.query.filter_by(last_name='Four').first().blood_type == 'O+'
+
+def test_bulk_create_patients_rejects_bad_types_per_row(client, create_test_doctor, auth_headers, login):
+    """Test that a row with a non-string field is reported on its own and its neighbours still load"""
+    rows = [
+        {'first_name': 'A', 'last_name': 'One', 'date_of_birth': '1990-01-01'},
+        {'first_name': {}, 'last_name': 'Two', 'date_of_birth': '1990-01-01'},
+        {'first_name': 'C', 'last_name': 'Three', 'date_of_birth': '1990-01-01', 'phone': 5551234},
+        {'first_name': 'D', 'last_name': 'Four', 'date_of_birth': '1990-01-01', 'doctor_id': {}},
+    ]
+    response = client.post('/api/patients/bulk', data=json.dumps(rows), headers=auth_headers(login()))
+    
+    assert response.status_code == 200
+    result = json.loads(response.data)
+    assert result['inserted'] == 1
+    assert result['errors'] == [
+        {'row': 1, 'message': 'first_name must be a string'},
+        {'row': 2, 'message': 'phone must be a string'},
+        {'row': 3, 'message': 'doctor_id must be an integer'},
+    ]
+
+def test_bulk_insert_chunk_retries_row_by_row(app, create_test_doctor):
+    """Test that a chunk whose executemany fails is retried per row and only the bad row is reported"""
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+    row = {'first_name': 'A', 'last_name': 'One', 'date_of_birth': date(1990, 1, 1), 'doctor_id': doctor_id}
+    chunk = [(0, row), (1, {**row, 'first_name': ['x']}), (2, {**row, 'last_name': 'Three'})]
+    result = {'inserted': 0, 'errors': []}
+    
+    insert_chunk(chunk, result)
+    
+    assert result['inserted'] == 2
+    assert [error['row'] for error in result['errors']] == [1]
+    assert sorted(patient.last_name for patient in Patient.query) == ['One', 'Three']
+
+def test_bulk_create_patients_from_ndjson(client, create_test_doctor, auth_headers):
+    """Test bulk import from an NDJSON stream"""
+    login_data = {'email': 'test@doctor.com', 'password': 'password123'}
+    login_response = client.post('/api/auth/login',
+                                data=json.dumps(login_data),
+                                content_type='application/json')
+    token = json.loads(login_response.data)['token']
+
+    body = '\n'.join([
+        json.dumps({'first_name': 'N', 'last_name': 'One', 'date_of_birth': '1990-01-01'}),
+        '{broken',
+        json.dumps({'first_name': 'N', 'last_name': 'Two', 'date_of_birth': '1990-01-02'}),
+    ])
+    headers = auth_headers(token)
+    headers['Content-Type'] = 'application/x-ndjson'
+    response = client.post('/api/patients/bulk', data=body, headers=headers)
+
+    assert response.status_code == 200
+    result = json.loads(response.data)
+    assert result['inserted'] == 2
+    assert result['errors'][0]['row'] == 1
+    assert Patient.query.filter_by(first_name='N').count() == 2
+
+def test_search_patients_ranked_prefix_and_scoped(client, create_test_doctor, auth_headers):
+    """Test full-text search with prefix matching and doctor scoping"""
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    other = Doctor(first_name='Other', last_name='Doctor', email='other@doctor.com',
+                   license_number='OTHER1', password_hash='x')
+    db.session.add(other)
+    db.session.flush()
+    db.session.add_all([
+        Patient(first_name='Johanna', last_name='Smith', date_of_birth=datetime(1980, 1, 1).date(),
+                allergies='penicillin', doctor_id=doctor.id),
+        Patient(first_name='Mary', last_name='Jones', date_of_birth=datetime(1980, 1, 1).date(),
+                allergies='peanuts', email='mary@mail.com', doctor_id=doctor.id),
+        Patient(first_name='Johnny', last_name='Other', date_of_birth=datetime(1980, 1, 1).date(),
+                doctor_id=other.id),
+    ])
+    db.session.commit()
+
+    login_data = {'email': 'test@doctor.com', 'password': 'password123'}
+    login_response = client.post('/api/auth/login',
+                                data=json.dumps(login_data),
+                                content_type='application/json')
+    token = json.loads(login_response.data)['token']
+
+    response = client.get('/api/patients/search?q=joh', headers=auth_headers(token))
+    assert response.status_code == 200
+    assert [p['first_name'] for p in json.loads(response.data)] == ['Johanna']
+
+    response = client.get('/api/patients/search?q=pe', headers=auth_headers(token))
+    assert {p['first_name'] for p in json.loads(response.data)} == {'Johanna', 'Mary'}
+
+    # Updates are picked up by the index
+    mary = Patient.query.filter_by(first_name='Mary').first()
+    mary.allergies = 'latex'
+    db.session.commit()
+    response = client.get('/api/patients/search?q=peanut', headers=auth_headers(token))
+    assert json.loads(response.data) == []
+
+    response = client.get('/api/patients/search?q="OR', headers=auth_headers(token))
+    assert response.status_code == 200
+
+    response = client.get('/api/patients/search', headers=auth_headers(token))
+    assert response.status_code == 400
+
+def test_get_patients_uses_index(client, create_test_doctor, auth_headers, query_plans):
+    """Test that the doctor's patient list is served from the composite index"""
+    login_data = {'email': 'test@doctor.com', 'password': 'password123'}
+    login_response = client.post('/api/auth/login',
+                                data=json.dumps(login_data),
+                                content_type='application/json')
+    token = json.loads(login_response.data)['token']
+
+    client.get('/api/patients/?limit=1', headers=auth_headers(token))
+
+    plans = query_plans('FROM patients', 'patients.doctor_id =', 'ORDER BY')
+    assert plans
+    for plan in plans:
+        assert 'ix_patients_doctor_last_name_id' in plan
+        assert 'TEMP B-TREE' not in plan
+
+def test_get_patient_conditional_requests(client, create_test_doctor, auth_headers):
+    """Test ETag/If-None-Match on a single patient, which sends no Last-Modified"""
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    patient = Patient(first_name='Etag', last_name='Patient',
+                      date_of_birth=datetime(1980, 1, 1).date(), doctor_id=doctor.id)
+    db.session.add(patient)
+    db.session.commit()
+    patient_id = patient.id
+
+    login_data = {'email': 'test@doctor.com', 'password': 'password123'}
+    login_response = client.post('/api/auth/login',
+                                data=json.dumps(login_data),
+                                content_type='application/json')
+    token = json.loads(login_response.data)['token']
+
+    response = client.get(f'/api/patients/{patient_id}', headers=auth_headers(token))
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    # updated_at would not cover the doctor_name in the payload
+    assert 'Last-Modified' not in response.headers
+
+    headers = dict(auth_headers(token), **{'If-None-Match': etag})
+    response = client.get(f'/api/patients/{patient_id}', headers=headers)
+    assert response.status_code == 304
+    assert response.data == b''
+
+    headers = dict(auth_headers(token), **{'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert client.get(f'/api/patients/{patient_id}', headers=headers).status_code == 200
+
+    doctor.first_name = 'Renamed'
+    db.session.commit()
+    headers = dict(auth_headers(token), **{'If-None-Match': etag})
+    response = client.get(f'/api/patients/{patient_id}', headers=headers)
+    assert response.status_code == 200
+    assert json.loads(response.data)['doctor_name'] == 'Renamed Doctor'
+    etag = response.headers['ETag']
+
+    client.put(f'/api/patients/{patient_id}',
+               data=json.dumps({'phone': '555'}),
+               headers=auth_headers(token))
+
+    headers = dict(auth_headers(token), **{'If-None-Match': etag})
+    response = client.get(f'/api/patients/{patient_id}', headers=headers)
+    assert response.status_code == 200
+    assert json.loads(response.data)['phone'] == '555'
+
+def test_get_patients_list_etag_changes_with_rows(client, create_test_doctor, auth_headers):
+    """Test that the list ETag is stable until a patient is added, deleted or the doctor renamed"""
+    login_data = {'email': 'test@doctor.com', 'password': 'password123'}
+    login_response = client.post('/api/auth/login',
+                                data=json.dumps(login_data),
+                                content_type='application/json')
+    token = json.loads(login_response.data)['token']
+
+    etag = client.get('/api/patients/', headers=auth_headers(token)).headers['ETag']
+    headers = dict(auth_headers(token), **{'If-None-Match': etag})
+    assert client.get('/api/patients/', headers=headers).status_code == 304
+
+    client.post('/api/patients/',
+                data=json.dumps({'first_name': 'New', 'last_name': 'Row', 'date_of_birth': '2000-01-01'}),
+                headers=auth_headers(token))
+
+    response = client.get('/api/patients/', headers=headers)
+    assert response.status_code == 200
+    assert len(json.loads(response.data)) == 1
+    # A delete leaves max(updated_at) alone, so lists carry no Last-Modified to validate against
+    assert 'Last-Modified' not in response.headers
+
+    etag = response.headers['ETag']
+    headers = dict(auth_headers(token), **{'If-None-Match': etag})
+    client.delete(f"/api/patients/{json.loads(response.data)[0]['id']}", headers=auth_headers(token))
+    assert client.get('/api/patients/', headers=headers).status_code == 200
+
+    etag = client.get('/api/patients/', headers=auth_headers(token)).headers['ETag']
+    headers = dict(auth_headers(token), **{'If-None-Match': etag})
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    doctor.first_name = 'Renamed'
+    db.session.commit()
+    invalidate_principal(doctor.id)
+    assert client.get('/api/patients/', headers=headers).status_code == 200
+
+def test_sparse_fieldsets_select_only_requested_columns(client, app, create_test_doctor, auth_headers):
+    """Test that ?fields= shapes the payload and the SELECT, and plain lists keep the full schema"""
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    patient = Patient(first_name='Sparse', last_name='Fields', date_of_birth=datetime(1980, 1, 1).date(),
+                      address='1 Long Road', allergies='none', doctor_id=doctor.id)
+    db.session.add(patient)
+    db.session.commit()
+    patient_id = patient.id
+
+    login_data = {'email': 'test@doctor.com', 'password': 'password123'}
+    login_response = client.post('/api/auth/login',
+                                data=json.dumps(login_data),
+                                content_type='application/json')
+    token = json.loads(login_response.data)['token']
+
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get('/api/patients/?fields=first_name,date_of_birth', headers=auth_headers(token))
+        listed = json.loads(response.data)
+        default_list = json.loads(client.get('/api/patients/', headers=auth_headers(token)).data)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert listed == [{'first_name': 'Sparse', 'date_of_birth': '1980-01-01'}]
+    assert set(default_list[0]) == set(Patient.SERIALIZED_FIELDS)
+    assert (default_list[0]['address'], default_list[0]['allergies']) == ('1 Long Road', 'none')
+    assert default_list[0]['doctor_name'] == 'Test Doctor'
+    # Only the sparse request left the Text columns unread
+    assert sum('patients.address' in statement for statement in statements) == 1
+
+    response = client.get(f'/api/patients/{patient_id}?fields=id,allergies', headers=auth_headers(token))
+    assert json.loads(response.data) == {'id': patient_id, 'allergies': 'none'}
+    response = client.get(f'/api/patients/{patient_id}', headers=auth_headers(token))
+    assert json.loads(response.data)['address'] == '1 Long Road'
+
+    response = client.get('/api/patients/?fields=first_name,password', headers=auth_headers(token))
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('debug', [False, True])
+@pytest.mark.parametrize('query_string', ['', '?fields=id,doctor_name,updated_at', '?limit=2'])
+def test_fast_serialization_matches_orm_path(client, app, create_test_doctor, auth_headers, query_string, debug):
+    """Test that the row-tuple fast path returns the same bytes as jsonify of to_dict(), non-ASCII included"""
+    # Debug mode makes jsonify indent its output
+    app.debug = debug
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    doctor.first_name = 'Zoë'
+    for i, (first_name, last_name) in enumerate([('Ñandú', 'Müller'), ('Łukasz', 'Path\u2028'), ('𝒜da', 'Ode')]):
+        db.session.add(Patient(first_name=first_name, last_name=last_name,
+                               date_of_birth=datetime(1980, 1, 1).date(), gender='Female',
+                               address=f'Straße {i}', doctor_id=doctor.id))
+    db.session.commit()
+
+    login_data = {'email': 'test@doctor.com', 'password': 'password123'}
+    login_response = client.post('/api/auth/login',
+                                data=json.dumps(login_data),
+                                content_type='application/json')
+    token = json.loads(login_response.data)['token']
+
+    app.config['FAST_SERIALIZATION'] = False
+    slow = client.get('/api/patients/' + query_string, headers=auth_headers(token))
+    app.config['FAST_SERIALIZATION'] = True
+    fast = client.get('/api/patients/' + query_string, headers=auth_headers(token))
+
+    assert fast.status_code == 200
+    assert fast.data == slow.data
+    assert fast.headers.get('X-Next-Cursor') == slow.headers.get('X-Next-Cursor')
+
+def test_get_patients_batch_single_query_with_markers(client, create_test_doctor, auth_headers, login):
+    """Test that a batch fetch resolves ids in one query and marks missing and foreign patients"""
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    other = Doctor(first_name='Other', last_name='Doctor', email='other@doctor.com',
+                   license_number='OTHER1', password_hash='x')
+    db.session.add(other)
+    db.session.flush()
+    mine = [Patient(first_name='P', last_name=f'Mine{i}', date_of_birth=datetime(1980, 1, 1).date(),
+                    doctor_id=doctor.id) for i in range(3)]
+    theirs = Patient(first_name='P', last_name='Theirs', date_of_birth=datetime(1980, 1, 1).date(),
+                     doctor_id=other.id)
+    db.session.add_all(mine + [theirs])
+    db.session.commit()
+    ids = [mine[2].id, theirs.id, 9999, mine[0].id, mine[2].id]
+
+    token = login()
+
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    response = client.get('/api/patients/batch?ids=' + ','.join(map(str, ids)), headers=auth_headers(token))
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert response.status_code == 200
+    assert len(statements) == 1 and ' IN ' in statements[0]
+    results = json.loads(response.data)['results']
+    assert [(r['id'], r['status']) for r in results] == [
+        (mine[2].id, 200), (theirs.id, 403), (9999, 404), (mine[0].id, 200)]
+    assert results[0]['patient']['last_name'] == 'Mine2'
+    assert results[0]['patient']['doctor_name'] == 'Test Doctor'
+    assert 'patient' not in results[1]
+
+    response = client.get(f'/api/patients/batch?ids={mine[1].id}&fields=id,last_name', headers=auth_headers(token))
+    assert json.loads(response.data)['results'][0]['patient'] == {'id': mine[1].id, 'last_name': 'Mine1'}
+
+    for bad in ('', 'ids=', 'ids=1,x', 'ids=' + ','.join(map(str, range(501)))):
+        assert client.get('/api/patients/batch?' + bad, headers=auth_headers(token)).status_code == 400
+
+def test_patch_patient_single_statement_with_if_match(client, create_test_doctor, auth_headers, login):
+    """Test that PATCH is one conditional UPDATE and that stale versions get 409"""
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    other = Doctor(first_name='Other', last_name='Doctor', email='other@doctor.com',
+                   license_number='OTHER1', password_hash='x')
+    db.session.add(other)
+    db.session.flush()
+    patient = Patient(first_name='Jane', last_name='Roe', date_of_birth=datetime(1980, 1, 1).date(),
+                      doctor_id=doctor.id)
+    foreign = Patient(first_name='Not', last_name='Mine', date_of_birth=datetime(1980, 1, 1).date(),
+                      doctor_id=other.id)
+    db.session.add_all([patient, foreign])
+    db.session.commit()
+    patient_id, foreign_id, other_id = patient.id, foreign.id, other.id
+
+    token = login()
+    etag = client.get(f'/api/patients/{patient_id}', headers=auth_headers(token)).headers['ETag']
+
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    response = client.patch(f'/api/patients/{patient_id}', data=json.dumps({'phone': '555-0101'}),
+                            headers={**auth_headers(token), 'If-Match': etag})
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert response.status_code == 200
+    assert len(statements) == 1 and statements[0].lstrip().startswith('UPDATE')
+    body = json.loads(response.data)['patient']
+    assert body['phone'] == '555-0101' and body['first_name'] == 'Jane'
+    assert body['doctor_name'] == 'Test Doctor'
+    new_etag = response.headers['ETag']
+    assert new_etag != etag
+    assert client.get(f'/api/patients/{patient_id}', headers=auth_headers(token)).headers['ETag'] == new_etag
+
+    # A second writer holding the old version loses instead of overwriting
+    response = client.patch(f'/api/patients/{patient_id}', data=json.dumps({'phone': '555-0202'}),
+                            headers={**auth_headers(token), 'If-Match': etag})
+    assert response.status_code == 409
+    response = client.patch(f'/api/patients/{patient_id}',
+                            data=json.dumps({'phone': '555-0202', 'updated_at': '2000-01-01T00:00:00'}),
+                            headers=auth_headers(token))
+    assert response.status_code == 409
+    response = client.patch(f'/api/patients/{patient_id}',
+                            data=json.dumps({'phone': '555-0303', 'updated_at': body['updated_at']}),
+                            headers=auth_headers(token))
+    assert response.status_code == 200
+    assert json.loads(client.get(f'/api/patients/{patient_id}', headers=auth_headers(token)).data)['phone'] == '555-0303'
+
+    def patch(target, data):
+        return client.patch(f'/api/patients/{target}', data=json.dumps(data), headers=auth_headers(token))
+
+    assert patch(foreign_id, {'phone': '1'}).status_code == 403
+    assert patch(9999, {'phone': '1'}).status_code == 404
+    assert json.loads(patch(patient_id, {'doctor_id': 9999}).data)['message'] == 'Doctor not found'
+    assert patch(patient_id, {'password_hash': 'x'}).status_code == 400
+    assert patch(patient_id, {'last_name': ''}).status_code == 400
+    assert patch(patient_id, {'date_of_birth': '01/02/1990'}).status_code == 400
+    response = patch(patient_id, {'first_name': ['x']})
+    assert response.status_code == 400
+    assert json.loads(response.data)['message'] == 'first_name must be a string'
+    assert patch(patient_id, {'allergies': {'peanuts': True}}).status_code == 400
+    assert patch(patient_id, {'phone': None}).status_code == 200
+
+    response = patch(patient_id, {'doctor_id': other_id})
+    assert response.status_code == 200
+    assert json.loads(response.data)['patient']['doctor_name'] == 'Other Doctor'
+
+def test_patient_stats_follow_every_write_path(client, create_test_doctor, auth_headers, login):
+    """Test that census counters stay equal to a full recount across creates, edits, moves and deletes"""
+    doctor = Doctor.query.filter_by(email='test@doctor.com').first()
+    other = Doctor(first_name='Other', last_name='Doctor', email='other@doctor.com',
+                   license_number='OTHER1', password_hash='x')
+    db.session.add(other)
+    db.session.commit()
+    doctor_id, other_id = doctor.id, other.id
+    token = login()
+    headers = auth_headers(token)
+
+    def create(**fields):
+        data = {'first_name': 'P', 'last_name': 'Q', 'date_of_birth': '1990-01-01', **fields}
+        return json.loads(client.post('/api/patients/', data=json.dumps(data), headers=headers).data)['patient']['id']
+
+    first = create(gender='Female', blood_type='O+')
+    second = create(gender='Male', blood_type='A-', date_of_birth='2015-06-01')
+    third = create()
+    client.post('/api/patients/bulk', data=json.dumps([
+        {'first_name': 'B', 'last_name': 'U', 'date_of_birth': '1950-03-03', 'gender': 'Female'},
+        {'first_name': 'B', 'last_name': 'V', 'date_of_birth': '1940-03-03', 'doctor_id': other_id}]),
+        headers=headers)
+    client.put(f'/api/patients/{first}', data=json.dumps({'blood_type': 'B+'}), headers=headers)
+    client.patch(f'/api/patients/{second}', data=json.dumps({'date_of_birth': '1960-01-01'}), headers=headers)
+    client.patch(f'/api/patients/{third}', data=json.dumps({'doctor_id': other_id}), headers=headers)
+    client.delete(f'/api/patients/{first}', headers=headers)
+
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    response = client.get('/api/patients/stats', headers=headers)
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert response.status_code == 200
+    assert not any('FROM patients' in statement for statement in statements)
+    stats = json.loads(response.data)
+    assert stats['total'] == 2
+    assert stats['per_doctor'] == {str(doctor_id): 2}
+    assert stats['gender'] == {'Male': 1, 'Female': 1}
+    assert stats['blood_type'] == {'A-': 1, 'unknown': 1}
+    assert stats['age_bands']['65+'] == 2 and sum(stats['age_bands'].values()) == 2
+
+    incremental = census()
+    assert incremental['total'] == 4
+    assert incremental['per_doctor'] == {str(doctor_id): 2, str(other_id): 2}
+    with db.engine.begin() as connection:
+        assert rebuild_stats(connection) == 4
+    assert census() == incremental
+
+def test_patient_stats_age_bands_use_full_birth_date(client, create_test_doctor):
+    """Test that a patient whose birthday has not come yet this year is not counted a year older"""
+    doctor_id = Doctor.query.filter_by(email='test@doctor.com').first().id
+    eighteen = _years_before(date.today(), 18)
+    for born in (eighteen, eighteen + timedelta(days=1), _years_before(date.today(), 65) + timedelta(days=1)):
+        db.session.add(Patient(first_name='P', last_name='Q', date_of_birth=born, doctor_id=doctor_id))
+    db.session.commit()
+
+    assert census()['age_bands'] == {'0-17': 1, '18-34': 1, '35-49': 0, '50-64': 1, '65+': 0}
+    assert _years_before(date(2028, 2, 29), 1) == date(2027, 2, 28)
+
+def test_patient_changes_feed(client, create_test_doctor, auth_headers, login):
+    """Test that the change feed returns only deltas since a cursor, with tombstones for deletes and moves"""
+    other = Doctor(first_name='Other', last_name='Doctor', email='other@doctor.com',
+                   license_number='OTHER1', password_hash='x')
+    db.session.add(other)
+    db.session.commit()
+    other_id = other.id
+    token = login()
+    headers = auth_headers(token)
+
+    ids = [json.loads(client.post('/api/patients/', data=json.dumps({
+        'first_name': 'P', 'last_name': f'N{i}', 'date_of_birth': '1990-01-01'}), headers=headers).data)['patient']['id']
+        for i in range(4)]
+
+    # Initial sync, paged
+    first = json.loads(client.get('/api/patients/changes?limit=3', headers=headers).data)
+    assert first['has_more'] is True
+    assert [change['id'] for change in first['changes']] == ids[:3]
+    rest = json.loads(client.get(f"/api/patients/changes?since={first['since']}&limit=3", headers=headers).data)
+    assert rest['has_more'] is False
+    assert [change['id'] for change in rest['changes']] == ids[3:]
+    assert rest['changes'][0]['patient']['last_name'] == 'N3'
+    cursor = rest['since']
+
+    # Nothing changed, nothing sent
+    idle = json.loads(client.get(f'/api/patients/changes?since={cursor}', headers=headers).data)
+    assert idle == {'changes': [], 'since': cursor, 'has_more': False}
+
+    client.put(f'/api/patients/{ids[0]}', data=json.dumps({'phone': '555'}), headers=headers)
+    client.patch(f'/api/patients/{ids[0]}', data=json.dumps({'blood_type': 'O+'}), headers=headers)
+    client.delete(f'/api/patients/{ids[1]}', headers=headers)
+    client.patch(f'/api/patients/{ids[2]}', data=json.dumps({'doctor_id': other_id}), headers=headers)
+
+    delta = json.loads(client.get(f'/api/patients/changes?since={cursor}', headers=headers).data)
+    assert [(change['id'], change['deleted']) for change in delta['changes']] == \
+        [(ids[0], False), (ids[1], True), (ids[2], True)]
+    assert delta['changes'][0]['patient']['phone'] == '555'
+    assert delta['changes'][0]['patient']['blood_type'] == 'O+'
+    assert 'patient' not in delta['changes'][1]
+
+    # The moved patient shows up in the new doctor's feed
+    rows, _ = changes_since(0, 100, other_id)
+    assert [(row.patient_id, bool(row.deleted)) for row in rows] == [(ids[2], False)]
+
+    assert client.get('/api/patients/changes?since=-1', headers=headers).status_code == 400
+    assert client.get('/api/patients/changes?since=abc', headers=headers).status_code == 400
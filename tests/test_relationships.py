@@ -1,28 +1,29 @@
 #Test Foreign Key
 import pytest
-from models import Doctor, Patient
+from datetime import datetime
+from models import db, Doctor, Patient
 
 def test_doctor_patient_relationship(app, create_test_doctor, create_test_patient):
     """Test foreign key relationship between doctor and patient"""
-    with app.app_context():
-        doctor = create_test_doctor
-        patient = create_test_patient
-        
-        # Test relationship from patient to doctor
-        assert patient.doctor_id == doctor.id
-        assert patient.doctor == doctor
-        
-        # Test relationship from doctor to patients
-        assert len(doctor.patients) == 1
-        assert doctor.patients[0] == patient
-        
-        # Test cascade delete (if configured)
-        db.session.delete(doctor)
-        db.session.commit()
-        
-        # Patient should be deleted if cascade is set
-        patient = Patient.query.get(create_test_patient.id)
-        assert patient is None
+    # Runs in the app fixture's context, the session the fixtures' objects belong to
+    doctor = create_test_doctor
+    patient = create_test_patient
+    
+    # Test relationship from patient to doctor
+    assert patient.doctor_id == doctor.id
+    assert patient.doctor == doctor
+    
+    # Test relationship from doctor to patients
+    assert len(doctor.patients) == 1
+    assert doctor.patients[0] == patient
+    
+    # Test cascade delete (if configured)
+    db.session.delete(doctor)
+    db.session.commit()
+    
+    # Patient should be deleted if cascade is set
+    patient = Patient.query.get(create_test_patient.id)
+    assert patient is None
 
 def test_multiple_patients_per_doctor(app, create_test_doctor):
     """Test that one doctor can have multiple patients"""
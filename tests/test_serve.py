@@ -0,0 +1,60 @@
+import pytest
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import urllib.request
+import config
+from sqlalchemy import inspect
+from app import create_app, db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_create_app_selects_config_by_name(monkeypatch):
+    """Test that the config comes from the argument, then APP_CONFIG"""
+    assert create_app('testing').config['TESTING'] is True
+
+    monkeypatch.setenv('APP_CONFIG', 'testing')
+    assert create_app().config['BCRYPT_LOG_ROUNDS'] == config.TestingConfig.BCRYPT_LOG_ROUNDS
+
+    with pytest.raises(ValueError):
+        create_app('staging')
+
+def test_production_skips_schema_creation(tmp_path, monkeypatch):
+    """Test that only development and testing create tables on start"""
+    monkeypatch.setattr(config.ProductionConfig, 'SQLALCHEMY_DATABASE_URI', f"sqlite:///{tmp_path / 'prod.db'}")
+    app = create_app('production')
+    with app.app_context():
+        assert inspect(db.engine).get_table_names() == []
+        db.engine.dispose()
+    app.extensions['read_engine'].dispose()
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='pre-forking needs os.fork')
+def test_serve_prefork_workers_and_drain(tmp_path):
+    """Test that serve.py answers from several workers and exits cleanly on SIGTERM"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, APP_CONFIG='development', DATABASE_URL=f"sqlite:///{tmp_path / 'serve.db'}")
+    server = subprocess.Popen([sys.executable, 'serve.py', '--bind', f'127.0.0.1:{port}', '--workers', '2'],
+                              cwd=ROOT, env=env, stderr=subprocess.PIPE, text=True)
+    try:
+        lines = []
+        while sum('worker ready' in line for line in lines) < 2:
+            line = server.stderr.readline()
+            assert line, ''.join(lines)
+            lines.append(line)
+        assert 'app loaded in' in lines[0]
+        assert all('rss' in line for line in lines if 'worker ready' in line)
+
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=10) as response:
+            assert json.loads(response.read())['message'] == 'Hospital Management System API'
+    finally:
+        server.send_signal(signal.SIGTERM)
+        output = server.communicate(timeout=30)[1]
+
+    assert server.returncode == 0
+    assert output.count('worker drained') == 2
+    assert 'stopped' in output
@@ -0,0 +1,141 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import jwt
+from flask import current_app
+from sqlalchemy import delete, exists, select, update
+from models import db, Doctor, RevokedToken
+
+class TokenPrincipal:
+    """The caller as described by a verified token; built without touching the database."""
+
+    def __init__(self, claims):
+        self.id = claims['user_id']
+        self.is_active = claims.get('active', False)
+        self.role = claims.get('role', 'doctor')
+        self.is_admin = self.role == 'admin'
+        self.claims = claims
+
+class TokenStore:
+    """Verified-token LRU plus a revocation list.
+
+    By default revocations are kept in process and only reach the process
+    they were made in. With ``shared`` (MULTI_PROCESS) they are written to
+    the database, revoked_tokens for one token and
+    doctors.tokens_revoked_before for all of a doctor's, and every check
+    reads them there at the cost of one query.
+    """
+
+    def __init__(self, max_size=4096, shared=False):
+        self.max_size = max_size
+        self.shared = shared
+        self._verified = OrderedDict()  # token -> claims
+        self._revoked_tokens = {}  # jti -> exp
+        self._revoked_users = {}  # user_id -> revoked at (epoch seconds)
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            claims = self._verified.get(token)
+            if claims is not None:
+                self._verified.move_to_end(token)
+            return claims
+
+    def put(self, token, claims):
+        with self._lock:
+            self._verified[token] = claims
+            self._verified.move_to_end(token)
+            while len(self._verified) > self.max_size:
+                self._verified.popitem(last=False)
+
+    def is_revoked(self, claims):
+        if self.shared:
+            revoked_before = select(Doctor.tokens_revoked_before).where(
+                Doctor.id == claims['user_id']).scalar_subquery()
+            revoked_token = exists().where(RevokedToken.jti == claims.get('jti'))
+            revoked_at, revoked = db.session.execute(select(revoked_before, revoked_token)).one()
+            return revoked or (revoked_at is not None and claims.get('iat', 0) <= revoked_at)
+        with self._lock:
+            if claims.get('jti') in self._revoked_tokens:
+                return True
+            revoked_at = self._revoked_users.get(claims['user_id'])
+            return revoked_at is not None and claims.get('iat', 0) <= revoked_at
+
+    def revoke_token(self, claims):
+        if 'jti' not in claims:
+            return
+        now = time.time()
+        if self.shared:
+            db.session.execute(delete(RevokedToken).where(RevokedToken.expires_at < now))
+            db.session.merge(RevokedToken(jti=claims['jti'], expires_at=claims['exp']))
+            db.session.commit()
+        with self._lock:
+            # Expired entries can never match again, so prune them while we hold the lock
+            for jti in [jti for jti, exp in self._revoked_tokens.items() if exp < now]:
+                del self._revoked_tokens[jti]
+            self._revoked_tokens[claims['jti']] = claims['exp']
+            self._verified = OrderedDict(
+                (token, cached) for token, cached in self._verified.items()
+                if cached.get('jti') != claims['jti'])
+
+    def revoke_user(self, user_id):
+        if self.shared:
+            db.session.execute(update(Doctor).where(Doctor.id == user_id).values(
+                tokens_revoked_before=int(time.time())))
+            db.session.commit()
+        with self._lock:
+            self._revoked_users[user_id] = int(time.time())
+            self._verified = OrderedDict(
+                (token, cached) for token, cached in self._verified.items()
+                if cached['user_id'] != user_id)
+
+    def clear(self):
+        with self._lock:
+            self._verified.clear()
+            self._revoked_tokens.clear()
+            self._revoked_users.clear()
+
+def get_token_store():
+    store = current_app.extensions.get('token_store')
+    if store is None:
+        store = current_app.extensions['token_store'] = TokenStore(
+            current_app.config['JWT_VERIFIED_CACHE_SIZE'], current_app.config['MULTI_PROCESS'])
+    return store
+
+def issue_token(doctor):
+    """Sign a token carrying everything token_required needs to rebuild the principal."""
+    now = int(time.time())
+    claims = {
+        'user_id': doctor.id,
+        'active': bool(doctor.is_active),
+        'role': 'admin' if getattr(doctor, 'is_admin', False) else 'doctor',
+        'jti': uuid.uuid4().hex,
+        'iat': now,
+        'exp': now + int(current_app.config['JWT_ACCESS_TOKEN'].total_seconds()),
+    }
+    return jwt.encode(claims, current_app.config['JWT_SECRET_KEY'], algorithm='HS256')
+
+def verify_token(token):
+    """Return the claims for a valid, unrevoked token or raise jwt.InvalidTokenError.
+
+    Tokens already verified are served from the LRU without redoing the HMAC.
+    """
+    store = get_token_store()
+    claims = store.get(token)
+    if claims is None:
+        claims = jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=['HS256'],
+                            options={'require': ['exp', 'user_id']})
+        store.put(token, claims)
+    elif claims['exp'] < time.time():
+        raise jwt.ExpiredSignatureError('Signature has expired')
+
+    if store.is_revoked(claims):
+        raise jwt.InvalidTokenError('Token has been revoked')
+    return claims
+
+def bearer_token(headers):
+    token = headers.get('Authorization')
+    if token and token.startswith('Bearer '):
+        token = token[7:]
+    return token